@@ -0,0 +1,67 @@
+"""
+Benchmark of the startup cost of the settings.
+
+Measures the import time of osc_extraction_utils.settings and osc_extraction_utils.settings_handler in fresh
+interpreters, the construction of MainSettings and the reading of a settings file with a cold and a warm yaml
+cache. Run it with the package installed (e.g. via pdm install):
+
+    python benchmarks/benchmark_import_settings.py --number-runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from osc_extraction_utils.settings import MainSettings
+from osc_extraction_utils.settings_handler import SettingsHandler, clear_yaml_cache
+
+PATH_FILE_SETTINGS: Path = Path(__file__).parents[1].resolve() / "data" / "TEST" / "settings.yaml"
+
+
+def measure_import(module: str, number_runs: int) -> list[float]:
+    code = f"import time; time_start = time.perf_counter(); import {module}; print(time.perf_counter() - time_start)"
+    return [
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, check=True, text=True).stdout)
+        for _ in range(number_runs)
+    ]
+
+
+def measure(function, number_runs: int) -> list[float]:
+    list_seconds = []
+    for _ in range(number_runs):
+        time_start = time.perf_counter()
+        function()
+        list_seconds.append(time.perf_counter() - time_start)
+    return list_seconds
+
+
+def read_settings_file_cold() -> None:
+    clear_yaml_cache()
+    SettingsHandler._read_setting_file(PATH_FILE_SETTINGS)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number-runs", type=int, default=20, help="number of runs per measurement")
+    args = parser.parse_args()
+
+    dict_measurements = {
+        "import settings": measure_import("osc_extraction_utils.settings", args.number_runs),
+        "import settings_handler": measure_import("osc_extraction_utils.settings_handler", args.number_runs),
+        "MainSettings()": measure(MainSettings, args.number_runs),
+        "read settings file, cold cache": measure(read_settings_file_cold, args.number_runs),
+        "read settings file, warm cache": measure(
+            lambda: SettingsHandler._read_setting_file(PATH_FILE_SETTINGS), args.number_runs
+        ),
+    }
+    for name, list_seconds in dict_measurements.items():
+        print(
+            f"{name:32} median {statistics.median(list_seconds) * 1000:8.2f} ms, "
+            f"min {min(list_seconds) * 1000:8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark of the relevance csv merge behind generate_text_3434.
+
+Compares the block copy of merger.merge_csv_files with the former line by line merge on a synthetic
+corpus of relevance inference csv files. Run it with the package installed (e.g. via pdm install):
+
+    python benchmarks/benchmark_merge_text_3434.py --size-mb 1024 --number-files 2000
+"""
+import argparse
+import glob
+import hashlib
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from osc_extraction_utils.merger import merge_csv_files
+
+HEADER: str = ",page,pdf_name,text,text_b,source,kpi_id,pred,score\n"
+
+
+def merge_line_by_line(list_paths_files: list[str], path_file_out: Path) -> None:
+    """Former implementation of the merge in generate_text_3434."""
+    with open(path_file_out, "w") as file_out:
+        very_first = True
+        for filepath in list_paths_files:
+            with open(filepath) as file_in:
+                first = True
+                for line in file_in:
+                    if very_first or not first:
+                        file_out.write(line)
+                    first = False
+                very_first = False
+
+
+def create_corpus(path_folder: Path, size_bytes: int, number_files: int) -> None:
+    size_bytes_per_file = size_bytes // number_files
+    for index_file in range(number_files):
+        rows = []
+        size_bytes_file = len(HEADER)
+        index_row = 0
+        while size_bytes_file < size_bytes_per_file:
+            row = (
+                f"{index_row},{index_row % 300},report_{index_file}.pdf,"
+                f'"Paragraph {index_row} of report {index_file} on scope 1 emissions in tonnes of CO2e",'
+                f"What are the total scope 1 emissions?,Text,{index_row % 30},{index_row % 2},0.{index_row:06d}\n"
+            )
+            rows.append(row)
+            size_bytes_file += len(row)
+            index_row += 1
+        (path_folder / f"report_{index_file}.csv").write_text(HEADER + "".join(rows))
+
+
+def sha256_of_file(path_file: Path) -> str:
+    hash_file = hashlib.sha256()
+    with open(path_file, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            hash_file.update(chunk)
+    return hash_file.hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024, help="total size of the synthetic corpus in MB")
+    parser.add_argument("--number-files", type=int, default=2000, help="number of relevance csv files")
+    parser.add_argument("--tmp-dir", type=Path, default=None, help="folder for the corpus, defaults to system tmp")
+    args = parser.parse_args()
+
+    path_folder_benchmark = Path(tempfile.mkdtemp(prefix="bench_text_3434_", dir=args.tmp_dir))
+    try:
+        path_folder_relevance = path_folder_benchmark / "relevance"
+        path_folder_relevance.mkdir()
+        print(f"Creating {args.number_files} files with {args.size_mb} MB in {path_folder_relevance}")
+        create_corpus(path_folder_relevance, args.size_mb * 1024 * 1024, args.number_files)
+        list_paths_files = sorted(glob.glob(str(path_folder_relevance / "*.csv")))
+
+        durations = {}
+        paths_files_out = {}
+        list_merges: list[tuple[str, Callable[[list[str], Path], None]]] = [
+            ("line_by_line", merge_line_by_line),
+            ("block_copy", merge_csv_files),
+        ]
+        for name, merge in list_merges:
+            paths_files_out[name] = path_folder_benchmark / f"text_3434_{name}.csv"
+            time_start = time.perf_counter()
+            merge(list_paths_files, paths_files_out[name])
+            durations[name] = time.perf_counter() - time_start
+            size_mb = paths_files_out[name].stat().st_size / 1024 / 1024
+            print(f"{name:>12}: {durations[name]:8.2f} s, {size_mb / durations[name]:8.1f} MB/s")
+
+        if sha256_of_file(paths_files_out["line_by_line"]) != sha256_of_file(paths_files_out["block_copy"]):
+            raise RuntimeError("Merged files differ between the implementations.")
+        print(f"Speedup: {durations['line_by_line'] / durations['block_copy']:.1f}x")
+    finally:
+        shutil.rmtree(path_folder_benchmark, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark of the scaling of merger.merge_csv_files with the number of reading threads.
+
+Merges the relevance csv files of a folder, either a given one, e.g. on a network file system, or a synthetic
+corpus with many small files, once per worker count and prints the duration, throughput and speedup. On local
+disks, --latency-ms simulates the latency of opening a file on a network file system. Run it with the package
+installed (e.g. via pdm install):
+
+    python benchmarks/benchmark_merge_text_3434_workers.py --number-files 20000 --latency-ms 2
+"""
+import argparse
+import builtins
+import glob
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmark_merge_text_3434 import create_corpus
+
+from osc_extraction_utils.merger import merge_csv_files
+
+
+def open_with_latency(latency_seconds: float):
+    def _open(*args, **kwargs):
+        time.sleep(latency_seconds)
+        return builtins.open(*args, **kwargs)
+
+    return _open
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path-folder-relevance", type=Path, default=None, help="folder with relevance csv files")
+    parser.add_argument("--size-mb", type=int, default=500, help="total size of the synthetic corpus in MB")
+    parser.add_argument("--number-files", type=int, default=20000, help="number of synthetic relevance csv files")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="worker counts")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency per opened file")
+    args = parser.parse_args()
+
+    path_folder_benchmark = Path(tempfile.mkdtemp(prefix="bench_text_3434_workers_"))
+    try:
+        path_folder_relevance = args.path_folder_relevance
+        if path_folder_relevance is None:
+            path_folder_relevance = path_folder_benchmark / "relevance"
+            path_folder_relevance.mkdir()
+            print(f"Creating {args.number_files} files with {args.size_mb} MB in {path_folder_relevance}")
+            create_corpus(path_folder_relevance, args.size_mb * 1024 * 1024, args.number_files)
+        list_paths_files = sorted(glob.glob(str(path_folder_relevance / "*.csv")))
+        path_file_out = path_folder_benchmark / "text_3434.csv"
+
+        print(f"{'workers':>8} {'seconds':>9} {'MB/s':>9} {'speedup':>8}")
+        duration_single_worker = None
+        for max_workers in args.workers:
+            with (
+                patch("osc_extraction_utils.merger.open", open_with_latency(args.latency_ms / 1000), create=True),
+                patch("osc_extraction_utils.merger.print", lambda *args: None, create=True),
+            ):
+                time_start = time.perf_counter()
+                merge_csv_files(list_paths_files, path_file_out, max_workers=max_workers)
+                duration = time.perf_counter() - time_start
+            duration_single_worker = duration_single_worker or duration
+            throughput = path_file_out.stat().st_size / 1024 / 1024 / duration
+            print(f"{max_workers:>8} {duration:>9.2f} {throughput:>9.1f} {duration_single_worker / duration:>7.1f}x")
+    finally:
+        shutil.rmtree(path_folder_benchmark, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
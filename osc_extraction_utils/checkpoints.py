@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+CHECKPOINTS_FILE_NAME: str = ".router_checkpoints.json"
+STAGE_SETTINGS_SECTIONS: dict[str, list[str]] = {
+    "extract": ["extraction"],
+    "curate": ["curation"],
+    "train_relevance": ["train_relevance"],
+    "infer_relevance": ["train_relevance", "infer_relevance"],
+    "text_3434": ["train_kpi"],
+    "train_kpi": ["train_kpi"],
+}
+
+
+def create_fingerprint(*parts) -> str:
+    """Return the sha256 of the json serialization of the parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def create_folder_manifest(path_folder: Path | str) -> list[tuple[str, int, int]]:
+    """
+    Return the relative path, size and mtime of all files in a folder, recursively and excluding hidden files and
+    folders. A missing folder has an empty manifest.
+    """
+    path_folder = Path(path_folder)
+    if not path_folder.is_dir():
+        return []
+    list_manifest: list[tuple[str, int, int]] = []
+    for path_file in sorted(path_folder.rglob("[!.]*")):
+        path_file_relative = path_file.relative_to(path_folder)
+        if path_file.is_file() and not any(part.startswith(".") for part in path_file_relative.parts):
+            stat_file = path_file.stat()
+            list_manifest.append((path_file_relative.as_posix(), stat_file.st_size, stat_file.st_mtime_ns))
+    return list_manifest
+
+
+class CheckpointStore:
+    """
+    Persisted fingerprints of the completed pipeline stages of a project, so that a rerun of the pipeline can skip
+    the stages whose inputs did not change since they were completed.
+
+    :param path_file_checkpoints: Path of the json file storing the fingerprint per completed stage
+    """
+
+    def __init__(self, path_file_checkpoints: Path | str) -> None:
+        self.path_file_checkpoints: Path = Path(path_file_checkpoints)
+        self._dict_fingerprints: dict[str, str] = self._read()
+
+    def _read(self) -> dict[str, str]:
+        if not self.path_file_checkpoints.exists():
+            return {}
+        try:
+            return json.loads(self.path_file_checkpoints.read_text())
+        except ValueError:
+            print(f"Ignoring corrupt checkpoints {self.path_file_checkpoints}.")
+            return {}
+
+    def _write(self) -> None:
+        self.path_file_checkpoints.parent.mkdir(parents=True, exist_ok=True)
+        path_file_tmp = self.path_file_checkpoints.with_name(
+            f"{self.path_file_checkpoints.name}.{uuid.uuid4().hex}.part"
+        )
+        path_file_tmp.write_text(json.dumps(self._dict_fingerprints, indent=2, sort_keys=True))
+        os.replace(path_file_tmp, self.path_file_checkpoints)
+
+    def is_completed(self, stage: str, fingerprint: str) -> bool:
+        return self._dict_fingerprints.get(stage) == fingerprint
+
+    def mark_completed(self, stage: str, fingerprint: str) -> None:
+        self._dict_fingerprints[stage] = fingerprint
+        self._write()
+
+    def invalidate(self, stage: str) -> None:
+        if self._dict_fingerprints.pop(stage, None) is not None:
+            self._write()
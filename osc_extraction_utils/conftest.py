@@ -1,15 +1,32 @@
+import gzip
+import hashlib
+import json
 import os
 import shutil
 import sys
+import threading
+import time
 import typing
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Generator
 from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
 
 import pandas as pd
 import pytest
+from botocore.exceptions import ClientError
 
 from osc_extraction_utils.paths import ProjectPaths
+from osc_extraction_utils.s3_communication import (
+    AsyncS3Communication,
+    S3Communication,
+    clear_shared_s3_resources,
+)
 from osc_extraction_utils.settings import (
     MainSettings,
     S3Settings,
@@ -90,6 +107,297 @@ def modify_project_settings(project_settings: typing.Dict, *args: typing.Tuple[s
     return project_settings
 
 
+class FakeS3Client:
+    """In-memory stand-in for the boto3 s3 client, covering the calls made by S3Communication.
+
+    The objects are stored per (bucket, key) and every call is counted by its S3 operation name.
+    """
+
+    def __init__(self) -> None:
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.last_modified: dict[tuple[str, str], datetime] = {}
+        self.calls: Counter = Counter()
+        self.keys_failing: set[str] = set()
+        self.upload_configs: dict[str, typing.Any] = {}
+        self.max_keys: int = 1000
+        self._lock = threading.Lock()
+
+    def _count_call(self, operation_name: str) -> None:
+        with self._lock:
+            self.calls[operation_name] += 1
+
+    def _get_body(self, bucket: str, key: str, operation_name: str) -> bytes:
+        self._count_call(operation_name)
+        if key in self.keys_failing or (bucket, key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation_name)
+        return self.objects[(bucket, key)]
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes | str) -> dict:
+        self._count_call("PutObject")
+        body = Body.encode() if isinstance(Body, str) else bytes(Body)
+        with self._lock:
+            self.objects[(Bucket, Key)] = body
+            self.last_modified[(Bucket, Key)] = datetime.now(timezone.utc)
+        return {"ETag": f'"{hashlib.md5(body).hexdigest()}"'}
+
+    def upload_fileobj(self, Fileobj: typing.BinaryIO, Bucket: str, Key: str, **kwargs) -> None:
+        self.upload_configs[Key] = kwargs.get("Config")
+        self.put_object(Bucket=Bucket, Key=Key, Body=b"".join(iter(lambda: Fileobj.read(1024 * 1024), b"")))
+
+    def download_fileobj(self, Bucket: str, Key: str, Fileobj: typing.BinaryIO, **kwargs) -> None:
+        Fileobj.write(self._get_body(Bucket, Key, "GetObject"))
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", ContinuationToken: str = "") -> dict:
+        self._count_call("ListObjectsV2")
+        keys = sorted(
+            key
+            for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix) and key > ContinuationToken
+        )
+        contents = [
+            {
+                "Key": key,
+                "Size": len(self.objects[(Bucket, key)]),
+                "ETag": f'"{hashlib.md5(self.objects[(Bucket, key)]).hexdigest()}"',
+                "LastModified": self.last_modified[(Bucket, key)],
+            }
+            for key in keys[: self.max_keys]
+        ]
+        result: dict = {"IsTruncated": len(keys) > self.max_keys, "KeyCount": len(contents)}
+        if contents:
+            result["Contents"] = contents
+        if result["IsTruncated"]:
+            result["NextContinuationToken"] = contents[-1]["Key"]
+        return result
+
+    def get_paginator(self, operation_name: str) -> SimpleNamespace:
+        if operation_name != "list_objects_v2":
+            raise NotImplementedError(operation_name)
+
+        def paginate(**kwargs) -> Generator[dict, None, None]:
+            continuation_token = ""
+            while True:
+                result = self.list_objects_v2(ContinuationToken=continuation_token, **kwargs)
+                yield result
+                if not result["IsTruncated"]:
+                    break
+                continuation_token = result["NextContinuationToken"]
+
+        return SimpleNamespace(paginate=paginate)
+
+
+class FakeS3Resource:
+    """Stand-in for the boto3 s3 resource, delegating to a FakeS3Client"""
+
+    def __init__(self, client: FakeS3Client) -> None:
+        self.meta = SimpleNamespace(client=client)
+
+
+@pytest.fixture
+def fake_s3_resources() -> Generator[None, None, None]:
+    """Fixture for replacing the boto3 s3 resources by FakeS3Resource objects, each with its own in-memory
+    FakeS3Client, and emptying the shared s3 resources before and after the test
+
+    :rtype: None
+    """
+    clear_shared_s3_resources()
+    with patch(
+        "osc_extraction_utils.s3_communication.boto3.resource",
+        side_effect=lambda *args, **kwargs: FakeS3Resource(FakeS3Client()),
+    ):
+        yield
+    clear_shared_s3_resources()
+
+
+@pytest.fixture
+def s3_communication_fake(fake_s3_resources) -> S3Communication:
+    """Fixture for a S3Communication object talking to an in-memory FakeS3Client, which is available as
+    s3_communication_fake.s3_client
+
+    :return: S3Communication object for the bucket "bucket"
+    :rtype: S3Communication
+    """
+    return S3Communication(
+        s3_endpoint_url="https://0.0.0.0",
+        aws_access_key_id="access_key",
+        aws_secret_access_key="secret_key",
+        s3_bucket="bucket",
+    )
+
+
+@pytest.fixture
+def async_s3_communication_fake(fake_s3_resources) -> Generator[AsyncS3Communication, None, None]:
+    """Fixture for a AsyncS3Communication object talking to an in-memory FakeS3Client, which is available as
+    async_s3_communication_fake.s3_communication.s3_client
+
+    :yield: AsyncS3Communication object for the bucket "bucket"
+    :rtype: Generator[AsyncS3Communication, None, None]
+    """
+    async_s3_communication = AsyncS3Communication(
+        s3_endpoint_url="https://0.0.0.0",
+        aws_access_key_id="access_key",
+        aws_secret_access_key="secret_key",
+        s3_bucket="bucket",
+    )
+    yield async_s3_communication
+    async_s3_communication.close()
+
+
+class JobServerStandIn:
+    """Local http server standing in for the extraction and inference servers.
+
+    Every node except liveness is submitted as a job, which is running for number_polls_running polls and then
+    succeeds, or fails for the nodes in nodes_failing. The nodes in nodes_sync and requests without async=true are
+    answered synchronously with status 200. All requests are recorded as (path, params) and the maximum number of
+    concurrently running jobs as max_number_jobs_running. The first number_responses_failing[node] requests of a
+    node, with the node "jobs" for all job status polls, are answered with status 502 and the requests of a node
+    are delayed by delays[node] seconds.
+
+    Payloads are accepted as json in the query parameter payload, as gzip compressed json body of a POST request
+    or by reference to a payload registered by PUT /payloads/<sha256>. The payloads are recorded per node in
+    payloads_received. A finished job of a payload listing documents reports their number as documents_processed.
+    """
+
+    def __init__(self) -> None:
+        self.number_polls_running: int = 1
+        self.nodes_failing: set[str] = set()
+        self.nodes_sync: set[str] = set()
+        self.requests: list[tuple[str, dict]] = []
+        self.jobs: dict[str, dict] = {}
+        self.number_jobs_running: int = 0
+        self.number_responses_failing: Counter = Counter()
+        self.delays: dict[str, float] = {}
+        self.client_ports: set[int] = set()
+        self.payloads_registered: dict[str, dict] = {}
+        self.payloads_received: list[tuple[str, dict]] = []
+        self.max_number_jobs_running: int = 0
+        self._lock = threading.Lock()
+        self.http_server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_request_handler())
+        self.ip: str = "127.0.0.1"
+        self.port: int = self.http_server.server_address[1]
+
+    def _create_request_handler(self) -> type[BaseHTTPRequestHandler]:
+        job_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                job_server.client_ports.add(self.client_address[1])
+                body_request = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status_code, body = job_server.handle(
+                    url.path,
+                    {key: values[0] for key, values in parse_qs(url.query).items()},
+                    self.command,
+                    body_request,
+                )
+                time.sleep(job_server.delays.get(url.path.strip("/"), 0))
+                body_bytes = (json.dumps(body) if isinstance(body, dict) else body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Length", str(len(body_bytes)))
+                self.end_headers()
+                self.wfile.write(body_bytes)
+
+            do_POST = do_GET
+            do_PUT = do_GET
+
+            def log_message(self, *args) -> None:
+                pass
+
+        return RequestHandler
+
+    def handle(self, path: str, params: dict, method: str = "GET", body: bytes = b"") -> tuple[int, dict | str]:
+        with self._lock:
+            self.requests.append((path, params))
+            node = path.strip("/")
+            node_failing = "jobs" if node.startswith("jobs/") else node
+            if self.number_responses_failing[node_failing] > 0:
+                self.number_responses_failing[node_failing] -= 1
+                return 502, "Bad Gateway"
+            if node == "liveness":
+                return 200, "Server is up."
+            if method == "PUT" and node.startswith("payloads/"):
+                payload_reference = node.removeprefix("payloads/")
+                payload_json = gzip.decompress(body)
+                if hashlib.sha256(payload_json).hexdigest() != payload_reference:
+                    return 400, "Payload does not match its reference."
+                self.payloads_registered[payload_reference] = json.loads(payload_json)
+                return 201, "Payload registered."
+            if node.startswith("jobs/"):
+                job = self.jobs.get(node.removeprefix("jobs/"))
+                if job is None:
+                    return 404, "Unknown job."
+                job["number_polls"] += 1
+                if job["number_polls"] <= self.number_polls_running:
+                    return 200, {"status": "running"}
+                if job["number_polls"] == self.number_polls_running + 1:
+                    self.number_jobs_running -= 1
+                return 200, {
+                    "status": "failed" if job["node"] in self.nodes_failing else "succeeded",
+                    "message": f"{job['node']} finished.",
+                } | ({"documents_processed": job["documents_processed"]} if "documents_processed" in job else {})
+            if method == "POST":
+                payload = json.loads(gzip.decompress(body))
+            elif "payload_ref" in params:
+                if params["payload_ref"] not in self.payloads_registered:
+                    return 400, "Unknown payload reference."
+                payload = self.payloads_registered[params["payload_ref"]]
+            else:
+                payload = json.loads(params.get("payload", "{}"))
+            self.payloads_received.append((node, payload))
+            if node in self.nodes_sync or params.get("async") != "true":
+                return 200, f"{node} finished."
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {"node": node, "number_polls": 0} | (
+                {"documents_processed": len(payload["documents"])} if "documents" in payload else {}
+            )
+            self.number_jobs_running += 1
+            self.max_number_jobs_running = max(self.max_number_jobs_running, self.number_jobs_running)
+            return 202, {"job_id": job_id}
+
+    def nodes_requested(self) -> list[str]:
+        return [
+            path.strip("/") for path, _ in self.requests if not path.startswith(("/jobs/", "/liveness", "/payloads/"))
+        ]
+
+
+@pytest.fixture
+def create_job_server() -> Generator[typing.Callable[[], JobServerStandIn], None, None]:
+    """Fixture for creating JobServerStandIns serving on free local ports, which are shut down after the test
+
+    :yield: Function creating a running JobServerStandIn
+    :rtype: Generator[typing.Callable[[], JobServerStandIn], None, None]
+    """
+    list_job_servers: list[tuple[JobServerStandIn, threading.Thread]] = []
+
+    def create_job_server() -> JobServerStandIn:
+        job_server = JobServerStandIn()
+        thread_server = threading.Thread(
+            target=job_server.http_server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+        thread_server.start()
+        list_job_servers.append((job_server, thread_server))
+        return job_server
+
+    yield create_job_server
+    for job_server, thread_server in list_job_servers:
+        job_server.http_server.shutdown()
+        job_server.http_server.server_close()
+        thread_server.join()
+
+
+@pytest.fixture
+def job_server(create_job_server) -> JobServerStandIn:
+    """Fixture for a JobServerStandIn serving on a free local port
+
+    :return: Running JobServerStandIn
+    :rtype: JobServerStandIn
+    """
+    return create_job_server()
+
+
 @pytest.fixture(scope="session")
 def path_folder_temporary() -> Generator:
     """Fixture for defining path for running check
@@ -1,6 +1,7 @@
 import shutil
 from pathlib import Path
 
+from osc_extraction_utils.checkpoints import create_folder_manifest
 from osc_extraction_utils.s3_communication import S3Communication
 from osc_extraction_utils.settings import MainSettings
 
@@ -30,9 +31,13 @@ def copy_file_without_overwrite(path_folder_source_as_str: str, path_folder_dest
     path_folder_source = Path(path_folder_source_as_str)
     path_folder_destination = Path(path_folder_destination_as_str)
 
-    for path_file_current_source in path_folder_source.iterdir():
-        path_file_current_destination = path_folder_destination / path_file_current_source.name
+    # files in sub-directories are copied into the same sub-directories, hidden files like the manifest of an
+    # incremental s3 download are skipped
+    for path_file_relative, _, _ in create_folder_manifest(path_folder_source):
+        path_file_current_source = path_folder_source / path_file_relative
+        path_file_current_destination = path_folder_destination / path_file_relative
         if not path_file_current_destination.exists():
+            path_file_current_destination.parent.mkdir(parents=True, exist_ok=True)
             shutil.copyfile(path_file_current_source, path_file_current_destination)
     return True
 
@@ -0,0 +1,86 @@
+import contextlib
+import threading
+import time
+from typing import Iterator, Literal
+
+EndpointDispatch = Literal["least_outstanding", "round_robin"]
+
+
+def get_server_addresses(list_endpoints: list[str], ip: str, port: int) -> list[str]:
+    """
+    Return the server addresses of the endpoints given as host:port or as url, or the server address of ip and port
+    if no endpoints are given.
+    """
+    return [endpoint if "://" in endpoint else f"http://{endpoint}" for endpoint in list_endpoints] or [
+        f"http://{ip}:{port}"
+    ]
+
+
+class EndpointPool:
+    """
+    Pool of the server addresses of equivalent servers, which dispatches every request to the endpoint with the
+    least outstanding requests or in round robin. An ejected endpoint, e.g. failing its liveness probe or refusing
+    the connection, does not get requests for ejection_time seconds, unless all endpoints are ejected.
+
+    :param list_server_addresses: Server addresses of the endpoints
+    :param dispatch: least_outstanding or round_robin, ties of least_outstanding are broken in round robin
+    :param ejection_time: Time in seconds, for which an ejected endpoint does not get requests
+    """
+
+    def __init__(
+        self,
+        list_server_addresses: list[str],
+        dispatch: EndpointDispatch = "least_outstanding",
+        ejection_time: float = 30.0,
+    ) -> None:
+        if not list_server_addresses:
+            raise ValueError("An endpoint pool needs at least one server address.")
+        self.list_server_addresses: list[str] = list(dict.fromkeys(list_server_addresses))
+        self.dispatch: EndpointDispatch = dispatch
+        self.ejection_time: float = ejection_time
+        self.dict_outstanding: dict[str, int] = {server_address: 0 for server_address in self.list_server_addresses}
+        self._dict_ejected_until: dict[str, float] = {}
+        self._index_next: int = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> str:
+        """Return the endpoint for the next request, which has to be released after the request."""
+        with self._lock:
+            time_now = time.monotonic()
+            list_server_addresses_available = [
+                server_address
+                for server_address in self.list_server_addresses
+                if self._dict_ejected_until.get(server_address, 0.0) <= time_now
+            ] or self.list_server_addresses
+            number_server_addresses = len(list_server_addresses_available)
+            list_server_addresses_ordered = [
+                list_server_addresses_available[(self._index_next + index) % number_server_addresses]
+                for index in range(number_server_addresses)
+            ]
+            if self.dispatch == "least_outstanding":
+                server_address = min(list_server_addresses_ordered, key=self.dict_outstanding.__getitem__)
+            else:
+                server_address = list_server_addresses_ordered[0]
+            self._index_next = (list_server_addresses_available.index(server_address) + 1) % number_server_addresses
+            self.dict_outstanding[server_address] += 1
+            return server_address
+
+    def release(self, server_address: str) -> None:
+        with self._lock:
+            self.dict_outstanding[server_address] -= 1
+
+    @contextlib.contextmanager
+    def endpoint(self) -> Iterator[str]:
+        server_address = self.acquire()
+        try:
+            yield server_address
+        finally:
+            self.release(server_address)
+
+    def eject(self, server_address: str) -> None:
+        with self._lock:
+            self._dict_ejected_until[server_address] = time.monotonic() + self.ejection_time
+
+    def is_ejected(self, server_address: str) -> bool:
+        with self._lock:
+            return self._dict_ejected_until.get(server_address, 0.0) > time.monotonic()
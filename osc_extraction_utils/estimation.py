@@ -0,0 +1,277 @@
+import dataclasses
+import json
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from osc_extraction_utils.checkpoints import create_folder_manifest
+from osc_extraction_utils.settings import MainSettings
+
+STAGES_PER_DOCUMENT: tuple[str, ...] = ("extract", "infer_relevance")
+STAGE_INPUT_UNITS: dict[str, str] = {
+    "extract": "pdf",
+    "curate": "table row",
+    "train_relevance": "row epoch",
+    "infer_relevance": "pdf",
+    "text_3434": "pdf",
+    "train_kpi": "row epoch",
+}
+PDF_PAGE_PATTERN: re.Pattern = re.compile(rb"/Type\s{0,32}/Page(?![a-zA-Z])")
+# longer than a match of PDF_PAGE_PATTERN including the byte of its lookahead
+PDF_PAGE_PATTERN_OVERLAP: int = 48
+PDF_READ_SIZE: int = 1024 * 1024
+
+
+def count_pdf_pages(path_file: Path | str, read_size: int = PDF_READ_SIZE) -> int:
+    """
+    Count the page objects of a pdf without parsing it, reading it in chunks of read_size bytes. Pages in
+    compressed object streams are not found, so the result is a lower bound.
+    """
+    number_pages = 0
+    buffer = b""
+    with open(path_file, "rb") as file:
+        for chunk in iter(lambda: file.read(read_size), b""):
+            buffer += chunk
+            # matches starting before position_end are complete, the rest is scanned again with the next chunk
+            position_end = len(buffer) - PDF_PAGE_PATTERN_OVERLAP
+            position_rest = max(0, position_end)
+            for match in PDF_PAGE_PATTERN.finditer(buffer):
+                if match.start() >= position_end:
+                    break
+                number_pages += 1
+                position_rest = max(position_rest, match.end())
+            buffer = buffer[position_rest:]
+    return number_pages + len(PDF_PAGE_PATTERN.findall(buffer))
+
+
+def count_table_rows(path_folder: Path | str) -> int:
+    """Count the rows of the csv and excel files in a folder, excluding hidden files."""
+    number_rows = 0
+    for path_file_relative, _, _ in create_folder_manifest(path_folder):
+        path_file = Path(path_folder) / path_file_relative
+        if path_file.suffix == ".csv":
+            number_rows += len(pd.read_csv(path_file))
+        elif path_file.suffix in (".xlsx", ".xls"):
+            number_rows += len(pd.read_excel(path_file))
+    return number_rows
+
+
+@dataclasses.dataclass
+class InputStatistics:
+    """
+    Size of the inputs of a pipeline run.
+
+    :param number_pdfs: Number of source pdfs
+    :param number_pdf_pages: Number of pages of the source pdfs, see count_pdf_pages
+    :param pdf_bytes: Total size of the source pdfs
+    :param number_annotation_rows: Number of rows of the annotation files
+    :param annotation_bytes: Total size of the annotation files
+    :param number_kpi_mapping_rows: Number of rows of the kpi mapping files
+    :param kpi_mapping_bytes: Total size of the kpi mapping files
+    """
+
+    number_pdfs: int = 0
+    number_pdf_pages: int = 0
+    pdf_bytes: int = 0
+    number_annotation_rows: int = 0
+    annotation_bytes: int = 0
+    number_kpi_mapping_rows: int = 0
+    kpi_mapping_bytes: int = 0
+
+
+def collect_input_statistics(
+    path_folder_source_pdf: Path | str,
+    path_folder_source_annotation: Path | str,
+    path_folder_source_mapping: Path | str,
+) -> InputStatistics:
+    list_manifest_pdf = [
+        (path_file, size)
+        for path_file, size, _ in create_folder_manifest(path_folder_source_pdf)
+        if "/" not in path_file
+    ]
+    return InputStatistics(
+        number_pdfs=len(list_manifest_pdf),
+        number_pdf_pages=sum(
+            count_pdf_pages(Path(path_folder_source_pdf) / path_file) for path_file, _ in list_manifest_pdf
+        ),
+        pdf_bytes=sum(size for _, size in list_manifest_pdf),
+        number_annotation_rows=count_table_rows(path_folder_source_annotation),
+        annotation_bytes=sum(size for _, size, _ in create_folder_manifest(path_folder_source_annotation)),
+        number_kpi_mapping_rows=count_table_rows(path_folder_source_mapping),
+        kpi_mapping_bytes=sum(size for _, size, _ in create_folder_manifest(path_folder_source_mapping)),
+    )
+
+
+def get_stage_input_units(
+    stage: str,
+    main_settings: MainSettings,
+    number_pdfs: int = 0,
+    number_annotation_rows: int = 0,
+    number_kpi_mapping_rows: int = 0,
+) -> int | None:
+    """
+    Return the size of the input of a stage in its unit of STAGE_INPUT_UNITS, which the duration of the stage is
+    assumed to scale with: the pdfs for the stages on pdfs, the annotation and kpi mapping rows for the curation and
+    the annotation rows times the epochs, and the folds with cross validation, for the trainings. Other stages have
+    no input units.
+    """
+    unit = STAGE_INPUT_UNITS.get(stage)
+    if unit == "pdf":
+        return number_pdfs
+    if unit == "table row":
+        return number_annotation_rows + number_kpi_mapping_rows
+    if unit == "row epoch":
+        training = getattr(main_settings, stage).training
+        return number_annotation_rows * training.n_epochs * (training.xval_folds if training.run_cv else 1)
+    return None
+
+
+@dataclasses.dataclass
+class StageHistory:
+    """Sums of the successful StageSpans of a stage, as written by StageMetrics.write_json_lines."""
+
+    number_spans: int = 0
+    seconds: float = 0.0
+    payload_bytes: int = 0
+    number_documents: int = 0
+    seconds_documents: float = 0.0
+    number_input_units: int = 0
+    seconds_input_units: float = 0.0
+
+
+def load_stage_history(path_file_metrics: Path | str | None) -> dict[str, StageHistory]:
+    """Sum the successful spans per stage of the json lines of StageMetrics, a missing file has no history."""
+    dict_history: dict[str, StageHistory] = {}
+    if path_file_metrics is None or not Path(path_file_metrics).exists():
+        return dict_history
+    with open(path_file_metrics) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            dict_span = json.loads(line)
+            if not dict_span.get("succeeded") or dict_span.get("duration") is None:
+                continue
+            stage_history = dict_history.setdefault(dict_span["stage"], StageHistory())
+            stage_history.number_spans += 1
+            stage_history.seconds += dict_span["duration"]
+            stage_history.payload_bytes += dict_span.get("payload_bytes") or 0
+            if dict_span.get("documents_processed"):
+                stage_history.number_documents += dict_span["documents_processed"]
+                stage_history.seconds_documents += dict_span["duration"]
+            if dict_span.get("input_units"):
+                stage_history.number_input_units += dict_span["input_units"]
+                stage_history.seconds_input_units += dict_span["duration"]
+    return dict_history
+
+
+@dataclasses.dataclass
+class StageEstimate:
+    """
+    Estimated cost of a stage.
+
+    :param stage: Name of the stage
+    :param seconds: Estimated wall-clock time in seconds, None without history of the stage
+    :param transfer_bytes: Estimated bytes of the payloads sent and the inputs read by the server for the stage
+    :param basis: Description of the basis of the estimate
+    :param skipped: Whether the stage is skipped, since it is completed according to the checkpoints
+    """
+
+    stage: str
+    seconds: float | None
+    transfer_bytes: int
+    basis: str
+    skipped: bool = False
+
+
+def estimate_stage(
+    stage: str,
+    stage_history: StageHistory | None,
+    number_documents: int,
+    number_requests: int = 1,
+    input_bytes: int = 0,
+    parallelism: int = 1,
+    input_units: int | None = None,
+) -> StageEstimate:
+    """
+    Estimate a stage from its history: stages per document by the historical seconds per processed document,
+    if the servers reported processed documents, else stages with input_units by the historical seconds per input
+    unit, see get_stage_input_units, if the spans recorded their input units, and all other stages by the mean
+    duration of their successful runs times the number of requests. The time is divided by the parallelism of the
+    requests.
+    """
+    if stage_history is None or stage_history.number_spans == 0:
+        return StageEstimate(stage, None, input_bytes, "no history")
+    payload_bytes = round(stage_history.payload_bytes / stage_history.number_spans * number_requests)
+    if stage in STAGES_PER_DOCUMENT and stage_history.number_documents > 0:
+        seconds_per_document = stage_history.seconds_documents / stage_history.number_documents
+        return StageEstimate(
+            stage,
+            seconds_per_document * number_documents / parallelism,
+            payload_bytes + input_bytes,
+            f"{seconds_per_document:.3g} s per pdf from {stage_history.number_documents} pdfs",
+        )
+    if input_units is not None and stage_history.number_input_units > 0:
+        seconds_per_unit = stage_history.seconds_input_units / stage_history.number_input_units
+        unit = STAGE_INPUT_UNITS.get(stage, "input unit")
+        return StageEstimate(
+            stage,
+            seconds_per_unit * input_units / parallelism,
+            payload_bytes + input_bytes,
+            f"{seconds_per_unit:.3g} s per {unit} from {stage_history.number_input_units} {unit}s",
+        )
+    return StageEstimate(
+        stage,
+        stage_history.seconds / stage_history.number_spans * number_requests / parallelism,
+        payload_bytes + input_bytes,
+        f"mean of {stage_history.number_spans} runs",
+    )
+
+
+@dataclasses.dataclass
+class RunEstimate:
+    """Estimated cost of a pipeline run per stage, see Router.estimate_run."""
+
+    input_statistics: InputStatistics
+    list_stage_estimates: list[StageEstimate]
+
+    @property
+    def seconds(self) -> float:
+        """Estimated wall-clock time of the stages with history, the stages run one after the other."""
+        return sum(
+            stage_estimate.seconds
+            for stage_estimate in self.list_stage_estimates
+            if stage_estimate.seconds is not None and not stage_estimate.skipped
+        )
+
+    @property
+    def transfer_bytes(self) -> int:
+        return sum(
+            stage_estimate.transfer_bytes for stage_estimate in self.list_stage_estimates if not stage_estimate.skipped
+        )
+
+    def to_text(self) -> str:
+        input_statistics = self.input_statistics
+        list_lines = [
+            f"Inputs: {input_statistics.number_pdfs} pdfs with {input_statistics.number_pdf_pages} pages and "
+            f"{input_statistics.pdf_bytes} bytes, {input_statistics.number_annotation_rows} annotation rows, "
+            f"{input_statistics.number_kpi_mapping_rows} kpi mapping rows."
+        ]
+        for stage_estimate in self.list_stage_estimates:
+            if stage_estimate.skipped:
+                list_lines.append(f"{stage_estimate.stage}: skipped, completed with unchanged inputs.")
+                continue
+            seconds = "unknown duration" if stage_estimate.seconds is None else f"{stage_estimate.seconds:.1f} s"
+            list_lines.append(
+                f"{stage_estimate.stage}: {seconds}, {stage_estimate.transfer_bytes} bytes ({stage_estimate.basis})."
+            )
+        list_stages_unknown = [
+            stage_estimate.stage
+            for stage_estimate in self.list_stage_estimates
+            if stage_estimate.seconds is None and not stage_estimate.skipped
+        ]
+        list_lines.append(
+            f"Total: {self.seconds:.1f} s, {self.transfer_bytes} bytes"
+            + (f", without {', '.join(list_stages_unknown)}." if list_stages_unknown else ".")
+        )
+        return "\n".join(list_lines)
@@ -1,2 +1,18 @@
 class AnnotationConversionError(Exception):
     pass
+
+
+class S3TransferError(Exception):
+    def __init__(self, failed_transfers: dict[str, Exception]) -> None:
+        self.failed_transfers: dict[str, Exception] = failed_transfers
+        super().__init__(f"{len(failed_transfers)} S3 transfer(s) failed: {', '.join(sorted(failed_transfers))}")
+
+
+class CsvHeaderMismatchError(ValueError):
+    def __init__(self, columns_expected: list[str], mismatches: dict[str, str]) -> None:
+        self.columns_expected: list[str] = columns_expected
+        self.mismatches: dict[str, str] = mismatches
+        super().__init__(
+            f"{len(mismatches)} file(s) do not match the columns {columns_expected} of the first file:\n"
+            + "\n".join(f"{path_file}: {mismatch}" for path_file, mismatch in mismatches.items())
+        )
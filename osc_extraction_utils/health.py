@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class ServerHealthCache:
+    """
+    Liveness of servers, probed concurrently by GET <server_address>/liveness and cached for ttl seconds, so that
+    many checks of the same servers, e.g. by the routers of many projects, cost one probe per server and ttl.
+    While the background refresh is running, all known servers are probed again every refresh_interval seconds,
+    so that the checks are answered from the cache.
+
+    :param session: Session of the probes, e.g. the pooled session of a Router
+    :param ttl: Time in seconds, for which a probe result is used
+    :param timeout: Timeout of a probe, as accepted by requests
+    :param refresh_interval: Interval of the background refresh in seconds, defaults to half of ttl
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        ttl: float = 30.0,
+        timeout: float | tuple[float, float | None] | None = 30.0,
+        refresh_interval: float | None = None,
+    ) -> None:
+        self._session: requests.Session = session or requests.Session()
+        self.ttl: float = ttl
+        self.timeout: float | tuple[float, float | None] | None = timeout
+        self.refresh_interval: float = ttl / 2 if refresh_interval is None else refresh_interval
+        self._dict_health: dict[str, tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+        self._event_stop = threading.Event()
+        self._thread_refresh: threading.Thread | None = None
+
+    def check(self, list_server_addresses: list[str]) -> dict[str, bool]:
+        """Return the liveness per server address, probing the servers without a cached result concurrently."""
+        list_server_addresses = list(dict.fromkeys(list_server_addresses))
+        time_now = time.monotonic()
+        with self._lock:
+            dict_health = {
+                server_address: self._dict_health[server_address][0]
+                for server_address in list_server_addresses
+                if server_address in self._dict_health and time_now - self._dict_health[server_address][1] < self.ttl
+            }
+        dict_health.update(
+            self._probe(
+                [server_address for server_address in list_server_addresses if server_address not in dict_health]
+            )
+        )
+        return {server_address: dict_health[server_address] for server_address in list_server_addresses}
+
+    @property
+    def is_refreshing(self) -> bool:
+        return self._thread_refresh is not None
+
+    def invalidate(self, server_address: str | None = None) -> None:
+        """Remove the cached result of the server address, or of all servers."""
+        with self._lock:
+            if server_address is None:
+                self._dict_health.clear()
+            else:
+                self._dict_health.pop(server_address, None)
+
+    def start_background_refresh(self) -> None:
+        if self._thread_refresh is not None:
+            return
+        self._event_stop.clear()
+        self._thread_refresh = threading.Thread(target=self._refresh, name="server_health_refresh", daemon=True)
+        self._thread_refresh.start()
+
+    def stop_background_refresh(self) -> None:
+        if self._thread_refresh is None:
+            return
+        self._event_stop.set()
+        self._thread_refresh.join()
+        self._thread_refresh = None
+
+    def __enter__(self) -> "ServerHealthCache":
+        self.start_background_refresh()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop_background_refresh()
+
+    def _refresh(self) -> None:
+        while not self._event_stop.wait(self.refresh_interval):
+            with self._lock:
+                list_server_addresses = list(self._dict_health)
+            self._probe(list_server_addresses)
+
+    def _probe(self, list_server_addresses: list[str]) -> dict[str, bool]:
+        if not list_server_addresses:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(list_server_addresses)) as executor:
+            dict_health = dict(
+                zip(list_server_addresses, executor.map(self._probe_server_address, list_server_addresses))
+            )
+        time_probed = time.monotonic()
+        with self._lock:
+            for server_address, is_live in dict_health.items():
+                self._dict_health[server_address] = (is_live, time_probed)
+        return dict_health
+
+    def _probe_server_address(self, server_address: str) -> bool:
+        try:
+            response = self._session.get(f"{server_address}/liveness", timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"Liveness probe of {server_address} failed: {e!r}")
+            return False
+        return response.status_code == 200
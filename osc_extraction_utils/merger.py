@@ -1,7 +1,19 @@
+import codecs
+import csv
 import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
 import os
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+from typing import IO, Iterable, Iterator, Sequence
 
+from osc_extraction_utils.exceptions import CsvHeaderMismatchError
 from osc_extraction_utils.paths import ProjectPaths
 from osc_extraction_utils.s3_communication import S3Communication
 from osc_extraction_utils.settings import MainSettings, S3Settings
@@ -64,7 +76,9 @@ class Merger:
     def _weird_writing_stuff(self) -> bool:
         with open(str(self.project_paths.path_folder_text_3434) + r"/text_3434.csv", "w") as file_out:
             very_first = True
-            rel_inf_list = list(glob.iglob(str(self.project_paths.path_folder_relevance) + r"/*.csv"))
+            rel_inf_list = list(
+                glob.iglob(str(self.project_paths.path_folder_relevance) + r"/**/*.csv", recursive=True)
+            )
         if len(rel_inf_list) == 0:
             print("No relevance inference results found.")
             return False
@@ -84,7 +98,384 @@ class Merger:
                 return False
 
 
-def generate_text_3434(project_name: str, s3_usage: bool, s3_settings: S3Settings, project_paths: ProjectPaths):
+MERGE_BUFFER_SIZE: int = 16 * 1024 * 1024
+CSV_ENCODING: str = "utf-8"
+CSV_REORDER_BATCH_ROWS: int = 10000
+COMPRESSION_FILE_EXTENSIONS: dict[str | None, str] = {None: "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_COMPRESSION_LEVEL: int = 6
+# Arrow types of the known columns of the relevance csv files, so that a first file with e.g. a numeric text or
+# an integer score does not fix a type, which the values of the next files cannot be converted to.
+PARQUET_COLUMN_TYPES: dict[str, str] = {
+    "page": "int64",
+    "pdf_name": "string",
+    "text": "string",
+    "text_b": "string",
+    "source": "string",
+    "score": "float64",
+}
+
+
+def merge_csv_files(
+    list_paths_files: Sequence[Path | str],
+    path_file_out: Path | str,
+    buffer_size: int = MERGE_BUFFER_SIZE,
+    max_workers: int = 1,
+    append: bool = False,
+    compression: str | None = None,
+) -> None:
+    """
+    Concatenates csv files into a single file, keeping only the header of the first file.
+
+    The headers of all files are read first and reconciled with the header of the first file: files with the
+    same header are copied as raw bytes, files with the same columns in another order are rewritten row by row
+    in the column order of the first file and files with other columns are reported together, before anything
+    is written.
+
+    The files are read ahead by max_workers threads, which hides the latency of opening and reading many small
+    files on network file systems, and written in the given order. Files larger than buffer_size are not read
+    ahead but copied in blocks of buffer_size, so memory usage is bounded by about 2 * max_workers * buffer_size.
+    Empty files are skipped and a missing trailing newline is added, so that the last row of a file is not glued
+    to the next file.
+
+    :param list_paths_files: Paths of the csv files to merge, in output order
+    :param path_file_out: Path of the merged csv file
+    :param buffer_size: Size of the copy buffer in bytes
+    :param max_workers: Number of threads reading the files
+    :param append: If True, the files are appended to an existing path_file_out and reconciled with its header
+    :param compression: None, "gzip" or "zstd" to compress path_file_out while writing, zstd requires the zstd extra
+    :raises CsvHeaderMismatchError: If the columns of a file differ from the columns of the first file
+    """
+    if append and compression is not None:
+        raise ValueError("Appending is only supported for uncompressed csv files.")
+    header_out = b""
+    ends_with_newline = True
+    if append:
+        with open(path_file_out, "rb") as file_out:
+            header_out = file_out.readline()
+            if file_out.seek(0, os.SEEK_END) > 0:
+                file_out.seek(-1, os.SEEK_END)
+                ends_with_newline = file_out.read(1) == b"\n"
+
+    view = memoryview(bytearray(buffer_size))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        list_headers = list(executor.map(_read_csv_header, list_paths_files))
+        list_column_orders = _reconcile_csv_headers(list_paths_files, list_headers, header_out)
+        with _open_csv_file_for_writing(path_file_out, "ab" if append else "wb", compression) as file_out:
+            is_header_written = bool(header_out)
+            for path_file, column_order, (header, content) in zip(
+                list_paths_files,
+                list_column_orders,
+                _read_csv_files_ahead(executor, list_paths_files, buffer_size, 2 * max(1, max_workers)),
+            ):
+                print(path_file)
+                if not header:
+                    continue
+                if not is_header_written:
+                    file_out.write(header)
+                    ends_with_newline = header.endswith(b"\n")
+                    is_header_written = True
+
+                blocks: Iterable[bytes | memoryview] = (
+                    [content] if content is not None else _iterate_csv_file_blocks(path_file, view)
+                )
+                if column_order is not None:
+                    print(f"Reordering the columns of {path_file} to the column order of the first file.")
+                    blocks = _reorder_csv_blocks(blocks, column_order)
+                is_start_of_file = True
+                for block in blocks:
+                    if not block:
+                        continue
+                    if is_start_of_file and not ends_with_newline:
+                        file_out.write(b"\n")
+                    file_out.write(block)
+                    ends_with_newline = block[-1:] == b"\n"
+                    is_start_of_file = False
+
+
+def _open_csv_file_for_writing(path_file: Path | str, mode: str, compression: str | None) -> IO[bytes]:
+    if compression is None:
+        return open(path_file, mode)
+    if compression == "gzip":
+        return gzip.open(path_file, mode, compresslevel=GZIP_COMPRESSION_LEVEL)  # type: ignore
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.open(path_file, mode, cctx=zstandard.ZstdCompressor(threads=-1))
+    raise ValueError(
+        f"Received unexpected compression {compression}. Can only be one of: {list(COMPRESSION_FILE_EXTENSIONS)}"
+    )
+
+
+def _read_csv_header(path_file: Path | str) -> bytes:
+    with open(path_file, "rb") as file_in:
+        return file_in.readline()
+
+
+def _parse_csv_header(header: bytes) -> list[str]:
+    return next(csv.reader([header.decode(CSV_ENCODING, errors="surrogateescape")]), [])
+
+
+def _reconcile_csv_headers(
+    list_paths_files: Sequence[Path | str], list_headers: list[bytes], header_reference: bytes = b""
+) -> list[list[int] | None]:
+    """
+    Return per file None, if its header equals header_reference, or else the indices of its columns in the
+    column order of header_reference. Without header_reference the header of the first non-empty file is used.
+
+    :raises CsvHeaderMismatchError: With all files whose columns differ from the columns of header_reference
+    """
+    header_reference = header_reference or next((header for header in list_headers if header), b"")
+    columns_reference = _parse_csv_header(header_reference)
+    list_column_orders: list[list[int] | None] = []
+    mismatches: dict[str, str] = {}
+    for path_file, header in zip(list_paths_files, list_headers):
+        if not header or header.rstrip(b"\r\n") == header_reference.rstrip(b"\r\n"):
+            list_column_orders.append(None)
+            continue
+        columns = _parse_csv_header(header)
+        if columns == columns_reference:
+            list_column_orders.append(None)
+        elif Counter(columns) == Counter(columns_reference) and len(set(columns)) == len(columns):
+            list_column_orders.append([columns.index(column) for column in columns_reference])
+        else:
+            columns_missing = list((Counter(columns_reference) - Counter(columns)).elements())
+            columns_unexpected = list((Counter(columns) - Counter(columns_reference)).elements())
+            mismatches[str(path_file)] = (
+                f"missing columns {columns_missing}, unexpected columns {columns_unexpected}"
+                if columns_missing or columns_unexpected
+                else f"duplicate columns in a different order {columns}"
+            )
+    if mismatches:
+        raise CsvHeaderMismatchError(columns_reference, mismatches)
+    return list_column_orders
+
+
+def _reorder_csv_blocks(blocks: Iterable[bytes | memoryview], column_order: list[int]) -> Iterator[bytes]:
+    """Yield the csv rows of the blocks with the columns in column_order, in batches of CSV_REORDER_BATCH_ROWS."""
+    buffer_out = io.StringIO()
+    writer = csv.writer(buffer_out, lineterminator="\n")
+    for number_row, row in enumerate(csv.reader(_iterate_lines(blocks)), start=1):
+        writer.writerow([row[index] if index < len(row) else "" for index in column_order])
+        if number_row % CSV_REORDER_BATCH_ROWS == 0:
+            yield buffer_out.getvalue().encode(CSV_ENCODING, errors="surrogateescape")
+            buffer_out.seek(0)
+            buffer_out.truncate()
+    yield buffer_out.getvalue().encode(CSV_ENCODING, errors="surrogateescape")
+
+
+def _iterate_lines(blocks: Iterable[bytes | memoryview]) -> Iterator[str]:
+    """Decode the blocks and yield their lines including the line endings."""
+    decoder = codecs.getincrementaldecoder(CSV_ENCODING)(errors="surrogateescape")
+    rest = ""
+    for block in blocks:
+        lines = (rest + decoder.decode(bytes(block))).split("\n")
+        rest = lines.pop()
+        yield from (f"{line}\n" for line in lines)
+    rest += decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+def _iterate_csv_file_blocks(path_file: Path | str, view: memoryview) -> Iterator[memoryview]:
+    """Yield the content of a csv file without the header in blocks read into view."""
+    with open(path_file, "rb") as file_in:
+        file_in.readline()
+        while number_bytes_read := file_in.readinto(view):
+            yield view[:number_bytes_read]
+
+
+def _read_csv_file_ahead(path_file: Path | str, buffer_size: int) -> tuple[bytes, bytes | None]:
+    """Read the header and, if the file is not larger than buffer_size, the remaining content of a csv file."""
+    with open(path_file, "rb") as file_in:
+        header = file_in.readline()
+        if os.fstat(file_in.fileno()).st_size - len(header) > buffer_size:
+            return header, None
+        return header, file_in.read()
+
+
+def _read_csv_files_ahead(
+    executor: ThreadPoolExecutor, list_paths_files: Sequence[Path | str], buffer_size: int, number_files_ahead: int
+) -> Iterator[tuple[bytes, bytes | None]]:
+    """Yield _read_csv_file_ahead of the files in order, while the next number_files_ahead files are read."""
+    iterator_paths_files = iter(list_paths_files)
+    futures: deque[Future] = deque(
+        executor.submit(_read_csv_file_ahead, path_file, buffer_size)
+        for path_file in itertools.islice(iterator_paths_files, number_files_ahead)
+    )
+    while futures:
+        future = futures.popleft()
+        for path_file in itertools.islice(iterator_paths_files, 1):
+            futures.append(executor.submit(_read_csv_file_ahead, path_file, buffer_size))
+        yield future.result()
+
+
+def merge_csv_files_to_parquet(
+    list_paths_files: Sequence[Path | str], path_file_out: Path | str, compression: str | None = None
+) -> None:
+    """
+    Writes csv files with the same columns into a single parquet file with one row group per csv file.
+
+    The columns of all files are checked against the first file before anything is written and are aligned
+    by name, so files with the columns in another order are supported. The known relevance columns get the types
+    of PARQUET_COLUMN_TYPES, the types of other columns are inferred from the first file with rows, with integers
+    widened to floats and columns without any value read as strings. String columns are dictionary-encoded. Empty
+    and header-only files are skipped as in merge_csv_files, if no file has rows, an empty parquet file with the
+    columns of the first header is written. Every file is read and written on its own, so memory usage is bounded
+    by the largest file. Requires pyarrow, see the parquet extra.
+
+    :param list_paths_files: Paths of the csv files to merge, in output order
+    :param path_file_out: Path of the parquet file
+    :param compression: Compression codec of the parquet column chunks, e.g. "gzip" or "zstd", defaults to snappy
+    :raises CsvHeaderMismatchError: If the columns of a file differ from the columns of the first file
+    """
+    list_headers = [_read_csv_header(path_file) for path_file in list_paths_files]
+    _reconcile_csv_headers(list_paths_files, list_headers)
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    writer: pq.ParquetWriter | None = None
+    table_without_rows = None
+    convert_options = pa_csv.ConvertOptions(
+        strings_can_be_null=True,
+        column_types={column: pa.type_for_alias(type_column) for column, type_column in PARQUET_COLUMN_TYPES.items()},
+    )
+    try:
+        for path_file, header in zip(list_paths_files, list_headers):
+            print(path_file)
+            if not header:
+                continue
+            table = pa_csv.read_csv(path_file, convert_options=convert_options)
+            if table.num_rows == 0:
+                table_without_rows = table_without_rows or table
+                continue
+            if writer is None:
+                schema = pa.schema([_widen_parquet_field(pa, field) for field in table.schema])
+                convert_options = pa_csv.ConvertOptions(
+                    strings_can_be_null=True,
+                    column_types=schema,
+                    include_columns=schema.names,
+                    include_missing_columns=False,
+                )
+                table = table.cast(schema)
+                writer = pq.ParquetWriter(path_file_out, schema, compression=compression or "snappy")
+            writer.write_table(table, row_group_size=table.num_rows)
+        if writer is None and table_without_rows is not None:
+            schema = pa.schema([_widen_parquet_field(pa, field) for field in table_without_rows.schema])
+            writer = pq.ParquetWriter(path_file_out, schema, compression=compression or "snappy")
+            writer.write_table(table_without_rows.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _widen_parquet_field(pa, field):
+    """Return the field with strings dictionary-encoded, columns without values as strings and integers as floats."""
+    if pa.types.is_string(field.type) or pa.types.is_null(field.type):
+        return field.with_type(pa.dictionary(pa.int32(), pa.string()))
+    if pa.types.is_integer(field.type) and field.name not in PARQUET_COLUMN_TYPES:
+        return field.with_type(pa.float64())
+    return field
+
+
+TEXT_3434_FILE_NAMES: dict[str, str] = {"csv": "text_3434.csv", "parquet": "text_3434.parquet"}
+TEXT_3434_MANIFEST_FILE_NAME: str = ".text_3434_manifest.json"
+HASH_BUFFER_SIZE: int = 1024 * 1024
+
+
+def _create_text_3434_manifest_entry(path_file: Path | str) -> dict:
+    stat_file = os.stat(path_file)
+    sha256 = hashlib.sha256()
+    with open(path_file, "rb") as file_in:
+        while chunk := file_in.read(HASH_BUFFER_SIZE):
+            sha256.update(chunk)
+    return {
+        "path": str(path_file),
+        "size": stat_file.st_size,
+        "mtime_ns": stat_file.st_mtime_ns,
+        "sha256": sha256.hexdigest(),
+    }
+
+
+def _create_text_3434_manifest_entries(list_paths_files: Sequence[Path | str], max_workers: int = 1) -> list[dict]:
+    """Create the manifest entries of the files concurrently by max_workers threads, in the order of the files."""
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(_create_text_3434_manifest_entry, list_paths_files))
+
+
+def _is_text_3434_manifest_entry_unchanged(manifest_entry: dict) -> bool:
+    """
+    Check if a merged file is unchanged, comparing the hash only if the size matches but the mtime differs. If the
+    hash matches, the mtime of the entry is updated, so that the file is not hashed again by the next run.
+    """
+    if not os.path.isfile(manifest_entry["path"]):
+        return False
+    stat_file = os.stat(manifest_entry["path"])
+    if stat_file.st_size != manifest_entry["size"]:
+        return False
+    if stat_file.st_mtime_ns == manifest_entry["mtime_ns"]:
+        return True
+    manifest_entry_current = _create_text_3434_manifest_entry(manifest_entry["path"])
+    if manifest_entry_current["sha256"] != manifest_entry["sha256"]:
+        return False
+    manifest_entry["mtime_ns"] = manifest_entry_current["mtime_ns"]
+    return True
+
+
+def _read_text_3434_manifest(path_folder_text_3434: Path | str) -> dict:
+    path_file_manifest = Path(path_folder_text_3434) / TEXT_3434_MANIFEST_FILE_NAME
+    if not path_file_manifest.exists():
+        return {}
+    try:
+        return json.loads(path_file_manifest.read_text())
+    except ValueError:
+        print(f"Ignoring corrupt text_3434 manifest {path_file_manifest}.")
+        return {}
+
+
+def _write_text_3434_manifest(path_folder_text_3434: Path | str, manifest: dict) -> None:
+    path_file_manifest = Path(path_folder_text_3434) / TEXT_3434_MANIFEST_FILE_NAME
+    path_file_manifest_tmp = path_file_manifest.with_name(f"{path_file_manifest.name}.{uuid.uuid4().hex}.part")
+    path_file_manifest_tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(path_file_manifest_tmp, path_file_manifest)
+
+
+def _find_relevance_files_to_append(
+    manifest: dict, path_file_text_3434: Path | str, list_paths_files: list[str], max_workers: int = 1
+) -> list[str] | None:
+    """
+    Return the relevance files which are not merged into path_file_text_3434 yet, or None if it has to be
+    rebuilt because it was modified since the manifest was written or a merged file was changed or removed.
+    """
+    if not manifest or not os.path.isfile(path_file_text_3434):
+        return None
+    stat_file_text_3434 = os.stat(path_file_text_3434)
+    if (stat_file_text_3434.st_size, stat_file_text_3434.st_mtime_ns) != (manifest["size"], manifest["mtime_ns"]):
+        print(f"{path_file_text_3434} was modified since it was generated.")
+        return None
+    set_paths_files = set(list_paths_files)
+    list_entries_present = [entry for entry in manifest["files"] if entry["path"] in set_paths_files]
+    if len(list_entries_present) < len(manifest["files"]):
+        print("Relevance files were removed since text_3434 was generated.")
+        return None
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        if not all(executor.map(_is_text_3434_manifest_entry_unchanged, list_entries_present)):
+            print("Relevance files were changed since text_3434 was generated.")
+            return None
+    set_paths_files_merged = {entry["path"] for entry in manifest["files"]}
+    return [path_file for path_file in list_paths_files if path_file not in set_paths_files_merged]
+
+
+def generate_text_3434(
+    project_name: str,
+    s3_usage: bool,
+    s3_settings: S3Settings,
+    project_paths: ProjectPaths,
+    file_format: str = "csv",
+    max_workers: int = 1,
+    incremental: bool = False,
+    compression: str | None = None,
+):
     """
     This function merges all infer relevance outputs into one large file, which is then
     used to train the kpi extraction model.
@@ -92,8 +483,30 @@ def generate_text_3434(project_name: str, s3_usage: bool, s3_settings: S3Setting
     :param project_name: str, representing the project we currently work on
     :param s3_usage: boolean, if we use s3 as we then have to upload the new csv file to s3
     :param s3_settings: dictionary, containing information in case of s3 usage
+    :param file_format: str, either "csv" for text_3434.csv or "parquet" for text_3434.parquet, which requires the
+        parquet extra
+    :param max_workers: int, number of threads reading the relevance files concurrently for the csv format
+    :param incremental: boolean, if True only relevance files which were not merged yet are appended to
+        text_3434.csv, according to a manifest of the merged files. If a merged file was changed or removed,
+        text_3434.csv is rebuilt. Appended files follow the previously merged files, so the order of the rows
+        can differ from a rebuild. Only applies to the uncompressed csv format.
+    :param compression: None, "gzip" or "zstd". For the csv format text_3434.csv is compressed while merging and
+        written and uploaded as text_3434.csv.gz or text_3434.csv.zst, for the parquet format it is the codec of
+        the column chunks
     return None
     """
+    if file_format not in TEXT_3434_FILE_NAMES:
+        raise ValueError(
+            f"Received unexpected file format {file_format}. Can only be one of: {list(TEXT_3434_FILE_NAMES)}"
+        )
+    if compression not in COMPRESSION_FILE_EXTENSIONS:
+        raise ValueError(
+            f"Received unexpected compression {compression}. Can only be one of: {list(COMPRESSION_FILE_EXTENSIONS)}"
+        )
+    file_name_text_3434 = TEXT_3434_FILE_NAMES[file_format]
+    if file_format == "csv":
+        file_name_text_3434 += COMPRESSION_FILE_EXTENSIONS[compression]
+
     if s3_usage:
         s3c_main = S3Communication(
             s3_endpoint_url=os.getenv(s3_settings.main_bucket.s3_endpoint),
@@ -103,27 +516,42 @@ def generate_text_3434(project_name: str, s3_usage: bool, s3_settings: S3Setting
         )
         # Download infer relevance files
         prefix_rel_infer = str(Path(s3_settings.prefix) / project_name / "data" / "output" / "RELEVANCE" / "Text")
-        s3c_main.download_files_in_prefix_to_dir(prefix_rel_infer, str(project_paths.path_folder_relevance))
+        s3c_main.download_files_in_prefix_to_dir(
+            prefix_rel_infer, str(project_paths.path_folder_relevance), incremental=True
+        )
 
-    with open(str(project_paths.path_folder_text_3434) + r"/text_3434.csv", "w") as file_out:
-        very_first = True
-        rel_inf_list = list(glob.iglob(str(project_paths.path_folder_relevance) + r"/*.csv"))
-        if len(rel_inf_list) == 0:
-            print("No relevance inference results found.")
-            return False
+    # the relevance files of sub-prefixes are downloaded into sub-directories
+    rel_inf_list = sorted(glob.iglob(str(project_paths.path_folder_relevance) + r"/**/*.csv", recursive=True))
+    if len(rel_inf_list) == 0:
+        print("No relevance inference results found.")
+        return False
+    path_file_text_3434 = str(project_paths.path_folder_text_3434) + f"/{file_name_text_3434}"
+    incremental = incremental and file_format == "csv" and compression is None
+    manifest: dict = _read_text_3434_manifest(project_paths.path_folder_text_3434) if incremental else {}
+    try:
+        list_paths_files_new = (
+            _find_relevance_files_to_append(manifest, path_file_text_3434, rel_inf_list, max_workers)
+            if incremental
+            else None
+        )
+        if file_format == "parquet":
+            merge_csv_files_to_parquet(rel_inf_list, path_file_text_3434, compression=compression)
+        elif list_paths_files_new is not None:
+            print(f"Appending {len(list_paths_files_new)} new relevance file(s) to {path_file_text_3434}.")
+            list_entries_new = _create_text_3434_manifest_entries(list_paths_files_new, max_workers)
+            merge_csv_files(list_paths_files_new, path_file_text_3434, max_workers=max_workers, append=True)
+            manifest["files"] += list_entries_new
         else:
-            try:
-                for filepath in rel_inf_list:
-                    print(filepath)
-                    with open(filepath) as file_in:
-                        first = True
-                        for line in file_in:
-                            if very_first or not first:
-                                file_out.write(line)
-                            first = False
-                        very_first = False
-            except Exception:
-                return False
+            if incremental:
+                manifest = {"files": _create_text_3434_manifest_entries(rel_inf_list, max_workers)}
+            merge_csv_files(rel_inf_list, path_file_text_3434, max_workers=max_workers, compression=compression)
+        if incremental:
+            stat_file_text_3434 = os.stat(path_file_text_3434)
+            manifest |= {"size": stat_file_text_3434.st_size, "mtime_ns": stat_file_text_3434.st_mtime_ns}
+            _write_text_3434_manifest(project_paths.path_folder_text_3434, manifest)
+    except Exception as e:
+        print(repr(e))
+        return False
 
     if s3_usage:
         s3c_interim = S3Communication(
@@ -134,9 +562,9 @@ def generate_text_3434(project_name: str, s3_usage: bool, s3_settings: S3Setting
         )
         project_prefix_text3434 = str(Path(s3_settings.prefix) / project_name / "data" / "interim" / "ml")
         s3c_interim.upload_file_to_s3(
-            filepath=str(project_paths.path_folder_text_3434) + r"/text_3434.csv",
+            filepath=path_file_text_3434,
             s3_prefix=project_prefix_text3434,
-            s3_key="text_3434.csv",
+            s3_key=file_name_text_3434,
         )
 
     return True
@@ -0,0 +1,126 @@
+import contextlib
+import dataclasses
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urlparse
+
+import requests
+
+PROMETHEUS_METRIC_PREFIX: str = "osc_router_stage"
+
+
+@dataclasses.dataclass
+class StageSpan:
+    """
+    Timing of one stage of a pipeline run, e.g. one request of a node or one batch of a pipelined node.
+
+    :param project_name: Name of the project
+    :param stage: Name of the stage, e.g. extract
+    :param time_start: Unix time of the start of the stage
+    :param time_end: Unix time of the end of the stage
+    :param duration: Duration of the stage in seconds, measured with a monotonic clock
+    :param status_code: Http status code of the last response of the stage, if any
+    :param payload_bytes: Number of payload bytes sent with the request of the stage
+    :param documents_processed: Number of documents processed as reported by the server, if any
+    :param input_units: Size of the input of the stage, e.g. pdfs or table rows, see get_stage_input_units, if any
+    :param succeeded: Whether the stage succeeded
+    """
+
+    project_name: str
+    stage: str
+    time_start: float
+    time_end: float | None = None
+    duration: float | None = None
+    status_code: int | None = None
+    payload_bytes: int = 0
+    documents_processed: int | None = None
+    input_units: int | None = None
+    succeeded: bool = False
+
+    def set_response(self, response: requests.Response) -> None:
+        """
+        Take the status code, the payload bytes and, from a json response with the key documents_processed, the
+        number of processed documents from the response.
+        """
+        self.status_code = response.status_code
+        request = getattr(response, "request", None)
+        body = getattr(request, "body", None)
+        url = getattr(request, "url", None)
+        if isinstance(body, (bytes, str)):
+            self.payload_bytes += len(body)
+        if isinstance(url, str):
+            self.payload_bytes += len(urlparse(url).query)
+        with contextlib.suppress(ValueError, TypeError, AttributeError):
+            self.set_documents_processed(response.json())
+
+    def set_documents_processed(self, dict_response) -> None:
+        documents_processed = dict_response.get("documents_processed")
+        if isinstance(documents_processed, int):
+            self.documents_processed = documents_processed
+
+
+class StageMetrics:
+    """
+    Collects the StageSpans of the pipeline runs of one or more projects and exports them as json lines, one span
+    per line, or as Prometheus text format with the duration, payload bytes, processed documents and number of
+    runs summed per project, stage and success.
+    """
+
+    def __init__(self) -> None:
+        self.list_spans: list[StageSpan] = []
+
+    @contextlib.contextmanager
+    def measure(self, project_name: str, stage: str) -> Iterator[StageSpan]:
+        """Measure the time of the block and record its span, also if the block raises."""
+        span = StageSpan(project_name=project_name, stage=stage, time_start=time.time())
+        time_start_monotonic = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - time_start_monotonic
+            span.time_end = span.time_start + span.duration
+            self.list_spans.append(span)
+
+    def write_json_lines(self, path_file: Path | str, append: bool = True) -> None:
+        """Write the spans as json lines, appended by default, so that the file keeps the history of the runs."""
+        path_file = Path(path_file)
+        path_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(path_file, "a" if append else "w") as file:
+            for span in self.list_spans:
+                file.write(json.dumps(dataclasses.asdict(span)) + "\n")
+
+    def to_prometheus(self) -> str:
+        dict_sums: dict[tuple[str, str, bool], dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for span in self.list_spans:
+            dict_sums_span = dict_sums[(span.project_name, span.stage, span.succeeded)]
+            dict_sums_span["seconds_total"] += span.duration or 0.0
+            dict_sums_span["payload_bytes_total"] += span.payload_bytes
+            dict_sums_span["documents_processed_total"] += span.documents_processed or 0
+            dict_sums_span["runs_total"] += 1
+        list_lines: list[str] = []
+        for metric in ["seconds_total", "payload_bytes_total", "documents_processed_total", "runs_total"]:
+            list_lines.append(f"# TYPE {PROMETHEUS_METRIC_PREFIX}_{metric} counter")
+            for (project_name, stage, succeeded), dict_sums_span in sorted(dict_sums.items()):
+                labels = (
+                    f'project="{self._escape_label(project_name)}",stage="{self._escape_label(stage)}",'
+                    f'succeeded="{str(succeeded).lower()}"'
+                )
+                list_lines.append(f"{PROMETHEUS_METRIC_PREFIX}_{metric}{{{labels}}} {dict_sums_span[metric]!r}")
+        return "\n".join(list_lines) + "\n"
+
+    def write_prometheus(self, path_file: Path | str) -> None:
+        """Write the metrics atomically, so that a node exporter collecting the text file never reads a part."""
+        path_file = Path(path_file)
+        path_file.parent.mkdir(parents=True, exist_ok=True)
+        path_file_tmp = path_file.with_name(f"{path_file.name}.{uuid.uuid4().hex}.part")
+        path_file_tmp.write_text(self.to_prometheus())
+        os.replace(path_file_tmp, path_file)
+
+    @staticmethod
+    def _escape_label(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
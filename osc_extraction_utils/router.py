@@ -1,74 +1,629 @@
+import asyncio
+import contextlib
+import gzip
+import hashlib
 import json
+import random
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from osc_extraction_utils.checkpoints import (
+    STAGE_SETTINGS_SECTIONS,
+    CheckpointStore,
+    create_fingerprint,
+    create_folder_manifest,
+)
+from osc_extraction_utils.endpoints import EndpointPool, get_server_addresses
+from osc_extraction_utils.estimation import (
+    STAGE_INPUT_UNITS,
+    RunEstimate,
+    collect_input_statistics,
+    count_table_rows,
+    estimate_stage,
+    get_stage_input_units,
+    load_stage_history,
+)
+from osc_extraction_utils.health import ServerHealthCache
 from osc_extraction_utils.merger import generate_text_3434
+from osc_extraction_utils.metrics import StageMetrics, StageSpan
 from osc_extraction_utils.paths import ProjectPaths
 from osc_extraction_utils.settings import MainSettings, S3Settings
 
 
+def create_document_shards(
+    list_documents: list[tuple[str, int]], max_documents: int = 0, max_bytes: int = 0
+) -> list[list[str]]:
+    """
+    Split the documents, given as pairs of name and size in bytes, in order into shards of at most max_documents
+    documents and max_bytes bytes, where a limit <= 0 means no limit. A document larger than max_bytes is a shard
+    of its own.
+    """
+    list_shards: list[list[str]] = []
+    list_shard: list[str] = []
+    bytes_shard = 0
+    for document, size in list_documents:
+        if list_shard and (
+            (max_documents > 0 and len(list_shard) >= max_documents)
+            or (max_bytes > 0 and bytes_shard + size > max_bytes)
+        ):
+            list_shards.append(list_shard)
+            list_shard = []
+            bytes_shard = 0
+        list_shard.append(document)
+        bytes_shard += size
+    if list_shard:
+        list_shards.append(list_shard)
+    return list_shards
+
+
+class JitteredRetry(Retry):
+    """
+    Retry adding a random jitter of up to jitter seconds to the exponential backoff, which urllib3 supports as
+    backoff_jitter only from version 2 on.
+    """
+
+    def __init__(self, *args, jitter: float = 0.0, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.jitter: float = jitter
+
+    def new(self, **kwargs) -> "JitteredRetry":
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self) -> float:
+        backoff_time = super().get_backoff_time()
+        if backoff_time <= 0:
+            return backoff_time
+        return backoff_time + random.uniform(0, self.jitter)
+
+
 class Router:
-    def __init__(self, main_settings: MainSettings, s3_settings: S3Settings, project_paths: ProjectPaths) -> None:
+    """
+    Runs the pipeline of a project on the extraction and inference servers.
+
+    With a checkpoint_store, every completed stage is recorded with a fingerprint of its settings sections and
+    local input files, and a rerun skips the stages up to the first stage whose fingerprint changed or which was
+    not completed. All stages after a stage which is run again are run again as well, and stages after a failed
+    stage are not recorded. Checkpoints are not used with s3 usage, since the inputs in s3 are not fingerprinted.
+
+    A request of a node fails its step if no connection is made within general.request_connect_timeout seconds
+    or no response byte is received within general.request_read_timeouts[node] or else
+    general.request_read_timeout seconds, so that a stalled server does not hang the run. The read timeouts
+    default to 6 hours and 24 hours for the trainings, since a step is answered when it is finished; None waits
+    forever.
+
+    Every request of a node and the generation of text_3434 are measured as a StageSpan in stage_metrics, which
+    can be shared by many routers and exported after the runs. The spans of the stages record their input units,
+    the pdfs or table rows, so that estimate_run scales the stages by their historical throughput.
+
+    Before the first step, the extraction, inference and, with general.rb_health_check, rule-based servers are
+    probed concurrently and the run is aborted if one of them is down. The rule-based server is not probed by
+    default, since no stage of the run uses it. The probes are not retried on connection
+    errors and time out after general.health_check_connect_timeout seconds, so that a server which is down is
+    detected at once. The liveness results are cached in health_cache for general.health_check_ttl seconds and
+    refreshed in the background during the run, a health_cache can be shared by many routers.
+
+    With general.ext_endpoints or general.infer_endpoints, the steps are dispatched to a pool of equivalent
+    extraction or inference servers, which have to share the data of the project, e.g. by s3 usage. The pools are
+    kept in endpoint_pools by the comma separated addresses of their endpoints and can be shared by many routers.
+    Endpoints failing their liveness probe or refusing the connection are ejected for
+    general.endpoint_ejection_time seconds. A step failing on an endpoint is not repeated on another endpoint.
+
+    With extraction.shard_size or extraction.shard_bytes > 0, the source pdfs are extracted in shards of at most
+    shard_size pdfs and shard_bytes bytes, which list their pdfs under "documents" in the payload. Up to
+    extraction.shard_workers shards are extracted concurrently, e.g. on the endpoints of the extraction pool, and
+    the failed shards are retried up to extraction.shard_retries times.
+    """
+
+    def __init__(
+        self,
+        main_settings: MainSettings,
+        s3_settings: S3Settings,
+        project_paths: ProjectPaths,
+        checkpoint_store: CheckpointStore | None = None,
+        stage_metrics: StageMetrics | None = None,
+        health_cache: ServerHealthCache | None = None,
+        endpoint_pools: dict[str, EndpointPool] | None = None,
+    ) -> None:
         self._main_settings: MainSettings = main_settings
         self._s3_settings: S3Settings = s3_settings
         self._project_paths: ProjectPaths = project_paths
         self._extraction_server_address: str = ""
         self._inference_server_address: str = ""
+        self._rule_based_server_address: str = ""
         self._return_value: bool = True
         self._payload: dict = {}
+        self._session: requests.Session = self._create_session()
+        self._session_polling: requests.Session = self._create_session(
+            retry_connect=True, retry_read=True, retry_status=True
+        )
+        self._set_payload_references: set[tuple[str, str]] = set()
+        self._checkpoint_store: CheckpointStore | None = checkpoint_store
+        if checkpoint_store is not None and main_settings.general.s3_usage:
+            print("Checkpoints are not used with s3 usage, since the inputs in s3 are not fingerprinted.")
+            self._checkpoint_store = None
+        self._dict_stage_fingerprints: dict[str, str] = {}
+        self._is_stage_rerun: bool = False
+        self._is_stage_failed: bool = False
+        self._stage_metrics: StageMetrics = stage_metrics or StageMetrics()
+        self._health_cache: ServerHealthCache = health_cache or ServerHealthCache(
+            self._create_session(retry_connect=False, retry_read=False, retry_status=True),
+            ttl=main_settings.general.health_check_ttl,
+            timeout=(main_settings.general.health_check_connect_timeout, self._get_timeout("liveness")[1]),
+        )
+        self._endpoint_pools: dict[str, EndpointPool] = {} if endpoint_pools is None else endpoint_pools
 
     @property
     def return_value(self) -> bool:
         return self._return_value
 
+    @property
+    def stage_metrics(self) -> StageMetrics:
+        return self._stage_metrics
+
+    @property
+    def health_cache(self) -> ServerHealthCache:
+        return self._health_cache
+
     def run_router(self):
+        with self._refresh_health_cache():
+            self._run_router()
+
+    @contextlib.contextmanager
+    def _refresh_health_cache(self) -> Iterator[None]:
+        """Refresh the health cache in the background during the run, unless it is refreshed already."""
+        if self._health_cache.is_refreshing:
+            yield
+            return
+        with self._health_cache:
+            yield
+
+    def _run_router(self) -> None:
         self._set_extraction_server_string()
         self._set_inference_server_string()
+        self._set_rule_based_server_string()
+
+        if not self._check_servers_are_live():
+            return
 
-        self._check_extraction_server_is_live()
         self._define_payload()
 
-        self._send_payload_to_server_address_with_node(self._extraction_server_address, "extract")
-        self._send_payload_to_server_address_with_node(self._extraction_server_address, "curate")
+        self._run_stage("extract", self._run_extraction)
+        self._run_stage(
+            "curate", lambda: self._send_payload_to_server_address_with_node(self._extraction_server_address, "curate")
+        )
 
         self._check_inference_server_is_live()
 
         self._check_for_train_relevance_training_and_send_request()
         self._check_for_kpi_training_and_send_request()
 
+    def estimate_run(self, path_file_metrics: Path | str | None = None) -> RunEstimate:
+        """
+        Estimate the wall-clock time and the transferred bytes of each stage of a run without contacting the
+        servers, from the inputs of the project, the settings and the history of the stages in path_file_metrics,
+        the json lines written by StageMetrics.write_json_lines. With a checkpoint_store, the stages, which would be
+        skipped, are marked as skipped.
+
+        :param path_file_metrics: Path of the json lines of the earlier runs
+        :return: Estimate of the run, which is printed as well
+        """
+        input_statistics = collect_input_statistics(
+            self._project_paths.path_folder_source_pdf,
+            self._project_paths.path_folder_source_annotation,
+            self._project_paths.path_folder_source_mapping,
+        )
+        dict_history = load_stage_history(path_file_metrics)
+        number_shards = len(self._create_extraction_shards())
+        dict_arguments_stages: dict[str, dict] = {
+            "extract": {
+                "number_requests": max(1, number_shards),
+                "input_bytes": input_statistics.pdf_bytes,
+                "parallelism": max(1, min(self._main_settings.extraction.shard_workers, number_shards)),
+            },
+            "curate": {"input_bytes": input_statistics.annotation_bytes + input_statistics.kpi_mapping_bytes},
+        }
+        list_stage_estimates = []
+        is_stage_rerun = False
+        for stage in self._list_stages():
+            input_units = get_stage_input_units(
+                stage,
+                self._main_settings,
+                input_statistics.number_pdfs,
+                input_statistics.number_annotation_rows,
+                input_statistics.number_kpi_mapping_rows,
+            )
+            stage_estimate = estimate_stage(
+                stage,
+                dict_history.get(stage),
+                input_statistics.number_pdfs,
+                input_units=input_units,
+                **dict_arguments_stages.get(stage, {}),
+            )
+            if self._checkpoint_store is not None and not is_stage_rerun:
+                stage_estimate.skipped = self._checkpoint_store.is_completed(
+                    stage, self._create_stage_fingerprint(stage)
+                )
+                is_stage_rerun = not stage_estimate.skipped
+            list_stage_estimates.append(stage_estimate)
+        run_estimate = RunEstimate(input_statistics, list_stage_estimates)
+        print(run_estimate.to_text())
+        return run_estimate
+
+    def _list_stages(self) -> list[str]:
+        """Return the stages of a run with the training settings."""
+        return (
+            ["extract", "curate"]
+            + (["train_relevance"] if self._main_settings.train_relevance.train else [])
+            + (["infer_relevance", "text_3434", "train_kpi"] if self._main_settings.train_kpi.train else [])
+        )
+
+    def _run_stage(self, stage: str, run: Callable[[], bool]) -> None:
+        if not self._is_stage_skipped(stage):
+            self._record_stage(stage, run())
+
+    def _is_stage_skipped(self, stage: str) -> bool:
+        """Check if the stage was completed with the same fingerprint and no stage before was run again."""
+        if self._checkpoint_store is None:
+            return False
+        self._dict_stage_fingerprints[stage] = self._create_stage_fingerprint(stage)
+        if not self._is_stage_rerun and self._checkpoint_store.is_completed(
+            stage, self._dict_stage_fingerprints[stage]
+        ):
+            print(f"Skipping {stage}, since it was completed with unchanged inputs.")
+            return True
+        self._is_stage_rerun = True
+        return False
+
+    def _record_stage(self, stage: str, is_succeeded: bool) -> None:
+        if self._checkpoint_store is None:
+            return
+        if is_succeeded and not self._is_stage_failed:
+            self._checkpoint_store.mark_completed(stage, self._dict_stage_fingerprints[stage])
+        else:
+            self._is_stage_failed = True
+            self._checkpoint_store.invalidate(stage)
+
+    def _create_stage_fingerprint(self, stage: str) -> str:
+        dict_settings = self._main_settings.model_dump(mode="json")
+        dict_paths_folders_input = {
+            "extract": [self._project_paths.path_folder_source_pdf],
+            "curate": [
+                self._project_paths.path_folder_source_annotation,
+                self._project_paths.path_folder_source_mapping,
+            ],
+        }
+        return create_fingerprint(
+            stage,
+            self._main_settings.general.project_name,
+            {section: dict_settings[section] for section in STAGE_SETTINGS_SECTIONS[stage]},
+            [create_folder_manifest(path_folder) for path_folder in dict_paths_folders_input.get(stage, [])],
+        )
+
     def _set_extraction_server_string(self) -> None:
-        self._extraction_server_address = (
-            f"http://{self._main_settings.general.ext_ip}:{self._main_settings.general.ext_port}"
+        settings_general = self._main_settings.general
+        self._extraction_server_address = self._set_endpoint_pool(
+            get_server_addresses(settings_general.ext_endpoints, settings_general.ext_ip, settings_general.ext_port)
         )
 
     def _set_inference_server_string(self) -> None:
-        self._inference_server_address = (
-            f"http://{self._main_settings.general.infer_ip}:{self._main_settings.general.infer_port}"
+        settings_general = self._main_settings.general
+        self._inference_server_address = self._set_endpoint_pool(
+            get_server_addresses(
+                settings_general.infer_endpoints, settings_general.infer_ip, settings_general.infer_port
+            )
         )
 
-    def _send_payload_to_server_address_with_node(self, server_address: str, node: str) -> None:
-        response: requests.Response = requests.get(f"{server_address}/{node}", params=self._payload)
-        print(response.text)
-        if response.status_code != 200:
+    def _set_endpoint_pool(self, list_server_addresses: list[str]) -> str:
+        """
+        Create the endpoint pool of the server addresses, if it does not exist, and return the comma separated
+        server addresses as the address of the pool, or the server address without a pool.
+        """
+        server_address = ",".join(list_server_addresses)
+        if len(list_server_addresses) > 1:
+            self._endpoint_pools.setdefault(
+                server_address,
+                EndpointPool(
+                    list_server_addresses,
+                    dispatch=self._main_settings.general.endpoint_dispatch,
+                    ejection_time=self._main_settings.general.endpoint_ejection_time,
+                ),
+            )
+        return server_address
+
+    def _get_endpoints(self, server_address: str) -> list[str]:
+        endpoint_pool = self._endpoint_pools.get(server_address)
+        return [server_address] if endpoint_pool is None else endpoint_pool.list_server_addresses
+
+    @contextlib.contextmanager
+    def _use_endpoint(self, server_address: str) -> Iterator[str]:
+        """Acquire the endpoint of the pool of the server address, or the server address itself without a pool."""
+        endpoint_pool = self._endpoint_pools.get(server_address)
+        if endpoint_pool is None:
+            yield server_address
+            return
+        with endpoint_pool.endpoint() as endpoint:
+            try:
+                yield endpoint
+            except requests.ConnectionError:
+                print(f"Ejecting endpoint {endpoint}, since it refused the connection.")
+                endpoint_pool.eject(endpoint)
+                raise
+
+    def _is_server_live(self, server_address: str) -> bool:
+        """Check if an endpoint of the server address is live and eject the endpoints which are not."""
+        list_endpoints = self._get_endpoints(server_address)
+        dict_health = self._health_cache.check(list_endpoints)
+        endpoint_pool = self._endpoint_pools.get(server_address)
+        if endpoint_pool is not None:
+            for endpoint in list_endpoints:
+                if not dict_health[endpoint] and not endpoint_pool.is_ejected(endpoint):
+                    print(f"Ejecting endpoint {endpoint}, since it is not responding.")
+                    endpoint_pool.eject(endpoint)
+        return any(dict_health.values())
+
+    def _set_rule_based_server_string(self) -> None:
+        self._rule_based_server_address = (
+            f"http://{self._main_settings.general.rb_ip}:{self._main_settings.general.rb_port}"
+        )
+
+    def _check_servers_are_live(self) -> bool:
+        """Probe all servers of the run concurrently and abort the run if one of them is down."""
+        dict_server_addresses = {
+            "Extraction": self._extraction_server_address,
+            "Inference": self._inference_server_address,
+        }
+        if self._main_settings.general.rb_health_check:
+            dict_server_addresses["Rule-based"] = self._rule_based_server_address
+        self._health_cache.check(
+            [
+                endpoint
+                for server_address in dict_server_addresses.values()
+                for endpoint in self._get_endpoints(server_address)
+            ]
+        )
+        list_servers_down = [
+            f"{server} server {', '.join(self._get_endpoints(server_address))}"
+            for server, server_address in dict_server_addresses.items()
+            if not self._is_server_live(server_address)
+        ]
+        if list_servers_down:
+            print(f"Aborting, since these servers are not responding: {', '.join(list_servers_down)}.")
             self._return_value = False
+        return not list_servers_down
+
+    def _create_session(
+        self, retry_connect: bool = True, retry_read: bool = False, retry_status: bool = False
+    ) -> requests.Session:
+        """
+        Create a session of the server calls, which keeps the connections alive and retries with jittered
+        exponential backoff. The requests of the steps are not idempotent, e.g. a repeated train_kpi starts a second
+        training, so they are only retried on connection errors, at which the request did not reach the server. The
+        job status polls are retried on all errors and the retry status codes, the liveness probes only on the retry
+        status codes, so that a server which is down is detected within the connect timeout.
+
+        :param retry_connect: Whether connection errors are retried
+        :param retry_read: Whether read and other errors of GET requests are retried
+        :param retry_status: Whether GET requests answered with the retry status codes are retried
+        """
+        settings_general = self._main_settings.general
+        retry = JitteredRetry(
+            total=settings_general.request_retries,
+            connect=None if retry_connect else 0,
+            read=None if retry_read else 0,
+            other=None if retry_read else 0,
+            backoff_factor=settings_general.request_retry_backoff,
+            jitter=settings_general.request_retry_jitter,
+            status_forcelist=settings_general.request_retry_status_codes if retry_status else None,
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        http_adapter = HTTPAdapter(pool_maxsize=settings_general.request_pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", http_adapter)
+        session.mount("https://", http_adapter)
+        return session
+
+    def _get_timeout(self, node: str) -> tuple[float, float | None]:
+        """Return the connect and read timeout of the requests to the node."""
+        settings_general = self._main_settings.general
+        return (
+            settings_general.request_connect_timeout,
+            settings_general.request_read_timeouts.get(node, settings_general.request_read_timeout),
+        )
+
+    def _send_payload_to_server_address_with_node(
+        self, server_address: str, node: str, payload: dict | None = None
+    ) -> bool:
+        try:
+            is_succeeded = self._send_payload(server_address, node, self._payload if payload is None else payload)
+        except requests.RequestException as e:
+            print(repr(e))
+            is_succeeded = False
+        if not is_succeeded:
+            self._return_value = False
+        return is_succeeded
+
+    def _send_payload(self, server_address: str, node: str, payload: dict) -> bool:
+        with (
+            self._stage_metrics.measure(self._main_settings.general.project_name, node) as span,
+            self._use_endpoint(server_address) as endpoint,
+        ):
+            span.input_units = self._count_stage_input_units(node, payload)
+            response: requests.Response = self._request_node(endpoint, node, payload, timeout=self._get_timeout(node))
+            span.set_response(response)
+            span.succeeded = response.status_code == 200
+        print(response.text)
+        return response.status_code == 200
+
+    def _run_extraction(self) -> bool:
+        list_shards = self._create_extraction_shards()
+        if not list_shards:
+            return self._send_payload_to_server_address_with_node(self._extraction_server_address, "extract")
+        return self._run_extraction_shards(list_shards)
+
+    def _list_source_documents(self) -> list[tuple[str, int]]:
+        """Return the names and sizes of the source pdfs in order of their names."""
+        path_folder_source_pdf = Path(self._project_paths.path_folder_source_pdf)
+        if not path_folder_source_pdf.is_dir():
+            return []
+        return sorted(
+            (path_file.name, path_file.stat().st_size)
+            for path_file in path_folder_source_pdf.iterdir()
+            if path_file.is_file() and not path_file.name.startswith(".")
+        )
+
+    def _count_stage_input_units(self, stage: str, payload: dict) -> int | None:
+        """
+        Return the input units of a request of the stage, see get_stage_input_units, with the pdfs listed under
+        "documents" in the payload or else all source pdfs, or None if they cannot be counted.
+        """
+        unit = STAGE_INPUT_UNITS.get(stage)
+        if unit is None:
+            return None
+        try:
+            if unit == "pdf":
+                number_pdfs = (
+                    len(payload["documents"]) if "documents" in payload else len(self._list_source_documents())
+                )
+                return get_stage_input_units(stage, self._main_settings, number_pdfs=number_pdfs)
+            return get_stage_input_units(
+                stage,
+                self._main_settings,
+                number_annotation_rows=count_table_rows(self._project_paths.path_folder_source_annotation),
+                number_kpi_mapping_rows=(
+                    count_table_rows(self._project_paths.path_folder_source_mapping) if stage == "curate" else 0
+                ),
+            )
+        except (OSError, ValueError) as e:
+            print(f"The input units of {stage} could not be counted: {e!r}")
+            return None
+
+    def _create_extraction_shards(self) -> list[list[str]]:
+        """Return the shards of source pdfs to extract, or an empty list if they are extracted at once."""
+        settings_extraction = self._main_settings.extraction
+        if settings_extraction.shard_size <= 0 and settings_extraction.shard_bytes <= 0:
+            return []
+        list_documents = self._list_source_documents()
+        if not list_documents:
+            print(f"No source pdfs found in {self._project_paths.path_folder_source_pdf} for sharding.")
+            return []
+        return create_document_shards(list_documents, settings_extraction.shard_size, settings_extraction.shard_bytes)
+
+    def _run_extraction_shards(self, list_shards: list[list[str]]) -> bool:
+        """Extract the shards concurrently and retry the failed shards, return if all shards succeeded."""
+
+        def extract_shard(number_shard: int) -> bool:
+            try:
+                is_succeeded = self._send_payload(
+                    self._extraction_server_address,
+                    "extract",
+                    self._create_payload(documents=list_shards[number_shard]),
+                )
+            except requests.RequestException as e:
+                print(repr(e))
+                is_succeeded = False
+            self._print_extraction_shard_progress(number_shard, len(list_shards), is_succeeded)
+            return is_succeeded
+
+        list_numbers_shards = list(range(len(list_shards)))
+        for number_try in range(self._main_settings.extraction.shard_retries + 1):
+            if number_try > 0:
+                print(f"Retrying {len(list_numbers_shards)} failed extraction shards.")
+            with ThreadPoolExecutor(max_workers=max(1, self._main_settings.extraction.shard_workers)) as executor:
+                list_is_succeeded = list(executor.map(extract_shard, list_numbers_shards))
+            list_numbers_shards = [
+                number_shard
+                for number_shard, is_succeeded in zip(list_numbers_shards, list_is_succeeded)
+                if not is_succeeded
+            ]
+            if not list_numbers_shards:
+                return True
+        return self._fail_extraction_shards(list_numbers_shards)
+
+    @staticmethod
+    def _print_extraction_shard_progress(number_shard: int, number_shards: int, is_succeeded: bool) -> None:
+        print(f"Extraction shard {number_shard + 1}/{number_shards} {'succeeded' if is_succeeded else 'failed'}.")
+
+    def _fail_extraction_shards(self, list_numbers_shards: list[int]) -> bool:
+        print(
+            "Extraction failed for the shards "
+            f"{', '.join(str(number_shard + 1) for number_shard in list_numbers_shards)}."
+        )
+        self._return_value = False
+        return False
 
     def _check_extraction_server_is_live(self) -> None:
-        response: requests.Response = requests.get(f"{self._extraction_server_address}/liveness")
-        if response.status_code == 200:
+        if self._is_server_live(self._extraction_server_address):
             print("Extraction server is up. Proceeding to extraction.")
         else:
             print("Extraction server is not responding.")
             self._return_value = False
 
     def _define_payload(self) -> None:
-        self._payload = {"project_name": self._main_settings.general.project_name, "mode": "train"}
-        self._payload.update(self._main_settings.model_dump())
-        self._payload = {"payload": json.dumps(self._payload)}
+        self._payload = self._create_payload()
+
+    def _create_payload(self, **kwargs) -> dict:
+        payload = {"project_name": self._main_settings.general.project_name, "mode": "train"} | kwargs
+        payload.update(self._main_settings.model_dump())
+        return payload
+
+    def _request_node(
+        self, server_address: str, node: str, payload: dict, params: dict | None = None, timeout=None
+    ) -> requests.Response:
+        """
+        Send the payload to the node of the server in the payload mode of the general settings:
+
+        - query: GET with the whole payload as json in the query parameter payload
+        - post: POST with the payload as gzip compressed json body, reduced to the settings sections of the node
+        - reference: the reduced payload is registered once per server by PUT /payloads/<sha256 of the json> with
+          a gzip compressed json body, then GET with the query parameter payload_ref=<sha256 of the json>
+
+        The settings sections of the nodes are defined by general.payload_sections, nodes without an entry get all
+        sections.
+        """
+        url = f"{server_address}/{node}"
+        params = params or {}
+        payload_mode = self._main_settings.general.payload_mode
+        if payload_mode not in ("post", "reference"):
+            return self._session.get(url, params={"payload": json.dumps(payload)} | params, timeout=timeout)
+
+        payload_json = json.dumps(self._select_payload_sections(node, payload), sort_keys=True).encode()
+        body = gzip.compress(payload_json, mtime=0)
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if payload_mode == "post":
+            return self._session.post(url, params=params, data=body, headers=headers, timeout=timeout)
+
+        payload_reference = hashlib.sha256(payload_json).hexdigest()
+        if (server_address, payload_reference) not in self._set_payload_references:
+            response: requests.Response = self._session.put(
+                f"{server_address}/payloads/{payload_reference}", data=body, headers=headers, timeout=timeout
+            )
+            if response.status_code not in (200, 201, 204):
+                return response
+            self._set_payload_references.add((server_address, payload_reference))
+        return self._session.get(url, params={"payload_ref": payload_reference} | params, timeout=timeout)
+
+    def _select_payload_sections(self, node: str, payload: dict) -> dict:
+        """Remove the settings sections, which are not needed by the node, from the payload."""
+        list_sections = self._main_settings.general.payload_sections.get(node)
+        if list_sections is None:
+            return payload
+        return {
+            key: value
+            for key, value in payload.items()
+            if key not in MainSettings.model_fields or key in list_sections or key == "s3_settings"
+        }
 
     def _check_inference_server_is_live(self) -> None:
-        response: requests.Response = requests.get(f"{self._inference_server_address}/liveness")
-        if response.status_code == 200:
+        if self._is_server_live(self._inference_server_address):
             print("Inference server is up. Proceeding to Inference.")
         else:
             print("Inference server is not responding.")
@@ -77,7 +632,12 @@ class Router:
     def _check_for_train_relevance_training_and_send_request(self) -> None:
         print("Relevance training will be started.")
         if self._main_settings.train_relevance.train:
-            self._send_payload_to_server_address_with_node(self._inference_server_address, "train_relevance")
+            self._run_stage(
+                "train_relevance",
+                lambda: self._send_payload_to_server_address_with_node(
+                    self._inference_server_address, "train_relevance"
+                ),
+            )
         else:
             print(
                 "No relevance training done. If you want to have a relevance training please set variable "
@@ -86,29 +646,444 @@ class Router:
 
     def _check_for_kpi_training_and_send_request(self) -> None:
         if self._main_settings.train_kpi.train:
-            self._send_payload_to_server_address_with_node(self._inference_server_address, "infer_relevance")
-            self._check_for_generate_text_3434()
+            self._run_stage(
+                "infer_relevance",
+                lambda: self._send_payload_to_server_address_with_node(
+                    self._inference_server_address, "infer_relevance"
+                ),
+            )
+            self._run_stage("text_3434", self._check_for_generate_text_3434)
             print("Next we start the training of the inference model. This may take some time.")
-            self._send_payload_to_server_address_with_node(self._inference_server_address, "train_kpi")
+            self._run_stage(
+                "train_kpi",
+                lambda: self._send_payload_to_server_address_with_node(self._inference_server_address, "train_kpi"),
+            )
         else:
             print(
                 "No kpi training done. If you want to have a kpi training please set variable"
                 " train under train_kpi to true."
             )
 
-    def _check_for_generate_text_3434(self) -> None:
+    def _check_for_generate_text_3434(self) -> bool:
+        with self._stage_metrics.measure(self._main_settings.general.project_name, "text_3434") as span:
+            span.input_units = self._count_stage_input_units("text_3434", {})
+            span.succeeded = self._generate_text_3434()
+        return span.succeeded
+
+    def _generate_text_3434(self) -> bool:
         try:
             temp: bool = generate_text_3434(
                 self._main_settings.general.project_name,
                 self._main_settings.general.s3_usage,
                 self._s3_settings,
                 self._project_paths,
+                file_format=self._main_settings.train_kpi.text_3434.file_format,
+                max_workers=self._main_settings.train_kpi.text_3434.max_workers,
+                incremental=self._main_settings.train_kpi.text_3434.incremental,
+                compression=self._main_settings.train_kpi.text_3434.compression,
             )
             if temp:
                 print("text_3434 was generated without error.")
             else:
                 print("text_3434 was not generated without error.")
+            return temp
         except Exception as e:
             print("Error while generating text_3434.")
             print(repr(e))
             print(traceback.format_exc())
+            return False
+
+
+JOB_STATUSES_FINISHED: tuple[str, ...] = ("succeeded", "failed")
+
+
+class AsyncRouter(Router):
+    """
+    Router which runs every step as a job on the servers and polls for its status without blocking, so that one
+    process can drive many projects concurrently, e.g. by
+    asyncio.gather(*(router.run_router_async() for router in list_routers)).
+
+    A step is submitted by the request of Router with the additional parameter async=true. A server supporting
+    jobs answers with status 202 and {"job_id": ...}, and GET /jobs/<job_id>?wait=<seconds> answers with
+    {"status": "queued" | "running" | "succeeded" | "failed", "message": ...}, waiting up to wait seconds for the
+    job to finish (long polling). A server answering the submission with status 200 ran the step synchronously.
+    The polls are repeated with exponential backoff, the timeouts and intervals are set in the general settings.
+    The requests share the pooled sessions of Router with their retries, the status polls are retried on the retry
+    status codes, the submissions only on connection errors.
+    The http requests run in the default executor, the waiting between the polls does not occupy a thread.
+    The jobs on an endpoint are limited by its semaphore in server_semaphores, see RouterScheduler.
+
+    With general.pipeline_batch_size > 0, no relevance training and kpi training, the source pdfs are streamed
+    through the steps in batches: the payload of a batch lists its pdfs under "documents", and the relevance
+    inference of a batch on the inference server runs while the next batch is extracted on the extraction server.
+    The curation, which does not depend on the pdfs, runs once after the last batch is extracted.
+    """
+
+    def __init__(
+        self,
+        main_settings: MainSettings,
+        s3_settings: S3Settings,
+        project_paths: ProjectPaths,
+        server_semaphores: dict[str, asyncio.Semaphore] | None = None,
+        checkpoint_store: CheckpointStore | None = None,
+        stage_metrics: StageMetrics | None = None,
+        health_cache: ServerHealthCache | None = None,
+        endpoint_pools: dict[str, EndpointPool] | None = None,
+    ) -> None:
+        super().__init__(
+            main_settings,
+            s3_settings,
+            project_paths,
+            checkpoint_store=checkpoint_store,
+            stage_metrics=stage_metrics,
+            health_cache=health_cache,
+            endpoint_pools=endpoint_pools,
+        )
+        self._server_semaphores: dict[str, asyncio.Semaphore] = server_semaphores or {}
+
+    async def run_router_async(self) -> None:
+        if self._health_cache.is_refreshing:
+            await self._run_router_async()
+            return
+        self._health_cache.start_background_refresh()
+        try:
+            await self._run_router_async()
+        finally:
+            await asyncio.to_thread(self._health_cache.stop_background_refresh)
+
+    async def _run_router_async(self) -> None:
+        self._set_extraction_server_string()
+        self._set_inference_server_string()
+        self._set_rule_based_server_string()
+
+        if not await asyncio.to_thread(self._check_servers_are_live):
+            return
+
+        self._define_payload()
+
+        list_batches = self._create_document_batches()
+        if list_batches:
+            await asyncio.to_thread(self._check_inference_server_is_live)
+            list_stages_pipelined = ["extract", "curate", "infer_relevance"]
+            if not all([self._is_stage_skipped(stage) for stage in list_stages_pipelined]):
+                is_succeeded = await self._run_pipelined_batches(list_batches)
+                for stage in list_stages_pipelined:
+                    self._record_stage(stage, is_succeeded)
+            await self._generate_text_3434_and_run_kpi_training_job()
+            return
+
+        await self._run_stage_async("extract", self._run_extraction_async)
+        await self._run_stage_async(
+            "curate", lambda: self._run_job_on_server_address_with_node(self._extraction_server_address, "curate")
+        )
+
+        await asyncio.to_thread(self._check_inference_server_is_live)
+
+        await self._check_for_train_relevance_training_and_run_job()
+        await self._check_for_kpi_training_and_run_job()
+
+    async def _check_for_train_relevance_training_and_run_job(self) -> None:
+        print("Relevance training will be started.")
+        if self._main_settings.train_relevance.train:
+            await self._run_stage_async(
+                "train_relevance",
+                lambda: self._run_job_on_server_address_with_node(self._inference_server_address, "train_relevance"),
+            )
+        else:
+            print(
+                "No relevance training done. If you want to have a relevance training please set variable "
+                "train under train_relevance to true."
+            )
+
+    async def _check_for_kpi_training_and_run_job(self) -> None:
+        if self._main_settings.train_kpi.train:
+            await self._run_stage_async(
+                "infer_relevance",
+                lambda: self._run_job_on_server_address_with_node(self._inference_server_address, "infer_relevance"),
+            )
+            await self._generate_text_3434_and_run_kpi_training_job()
+        else:
+            print(
+                "No kpi training done. If you want to have a kpi training please set variable"
+                " train under train_kpi to true."
+            )
+
+    async def _generate_text_3434_and_run_kpi_training_job(self) -> None:
+        await self._run_stage_async("text_3434", lambda: asyncio.to_thread(self._check_for_generate_text_3434))
+        print("Next we start the training of the inference model. This may take some time.")
+        await self._run_stage_async(
+            "train_kpi", lambda: self._run_job_on_server_address_with_node(self._inference_server_address, "train_kpi")
+        )
+
+    async def _run_stage_async(self, stage: str, run: Callable[[], Awaitable[bool]]) -> None:
+        if not self._is_stage_skipped(stage):
+            self._record_stage(stage, await run())
+
+    def _create_document_batches(self) -> list[list[str]]:
+        """Return the batches of source pdfs to pipeline, or an empty list if the steps have to run in order."""
+        pipeline_batch_size = self._main_settings.general.pipeline_batch_size
+        if pipeline_batch_size <= 0:
+            return []
+        if self._main_settings.train_relevance.train or not self._main_settings.train_kpi.train:
+            print("Pipelining is only possible without relevance training and with kpi training.")
+            return []
+        list_documents = self._list_source_documents()
+        if not list_documents:
+            print(
+                f"No source pdfs found in {self._project_paths.path_folder_source_pdf} for pipelining, running the "
+                "steps in order."
+            )
+            return []
+        return create_document_shards(list_documents, max_documents=pipeline_batch_size)
+
+    async def _run_extraction_async(self) -> bool:
+        list_shards = self._create_extraction_shards()
+        if not list_shards:
+            return await self._run_job_on_server_address_with_node(self._extraction_server_address, "extract")
+        return await self._run_extraction_shards_async(list_shards)
+
+    async def _run_extraction_shards_async(self, list_shards: list[list[str]]) -> bool:
+        """Extract the shards as concurrent jobs and retry the failed shards, return if all shards succeeded."""
+        semaphore_shards = asyncio.Semaphore(max(1, self._main_settings.extraction.shard_workers))
+
+        async def extract_shard(number_shard: int) -> bool:
+            async with semaphore_shards:
+                try:
+                    is_succeeded = await self._run_job_on_endpoint(
+                        self._extraction_server_address,
+                        "extract",
+                        self._create_payload(documents=list_shards[number_shard]),
+                    )
+                except requests.RequestException as e:
+                    print(repr(e))
+                    is_succeeded = False
+            self._print_extraction_shard_progress(number_shard, len(list_shards), is_succeeded)
+            return is_succeeded
+
+        list_numbers_shards = list(range(len(list_shards)))
+        for number_try in range(self._main_settings.extraction.shard_retries + 1):
+            if number_try > 0:
+                print(f"Retrying {len(list_numbers_shards)} failed extraction shards.")
+            list_is_succeeded = await asyncio.gather(
+                *(extract_shard(number_shard) for number_shard in list_numbers_shards)
+            )
+            list_numbers_shards = [
+                number_shard
+                for number_shard, is_succeeded in zip(list_numbers_shards, list_is_succeeded)
+                if not is_succeeded
+            ]
+            if not list_numbers_shards:
+                return True
+        return self._fail_extraction_shards(list_numbers_shards)
+
+    async def _run_pipelined_batches(self, list_batches: list[list[str]]) -> bool:
+        """
+        Extract the batches in order, while the relevance of the previous batches is inferred, curate once after
+        the last batch and return if all jobs succeeded.
+        """
+        queue_payloads: asyncio.Queue[dict | None] = asyncio.Queue()
+        list_is_succeeded: list[bool] = []
+
+        async def extract_batches_and_curate() -> None:
+            for number_batch, list_documents in enumerate(list_batches, start=1):
+                print(f"Extracting batch {number_batch}/{len(list_batches)} with {len(list_documents)} pdfs.")
+                payload = self._create_payload(documents=list_documents)
+                is_succeeded = await self._run_job_on_server_address_with_node(
+                    self._extraction_server_address, "extract", payload
+                )
+                list_is_succeeded.append(is_succeeded)
+                if is_succeeded:
+                    await queue_payloads.put(payload)
+            await queue_payloads.put(None)
+            list_is_succeeded.append(
+                await self._run_job_on_server_address_with_node(self._extraction_server_address, "curate")
+            )
+
+        async def infer_relevance_batches() -> None:
+            while (payload := await queue_payloads.get()) is not None:
+                list_is_succeeded.append(
+                    await self._run_job_on_server_address_with_node(
+                        self._inference_server_address, "infer_relevance", payload
+                    )
+                )
+
+        await asyncio.gather(extract_batches_and_curate(), infer_relevance_batches())
+        return all(list_is_succeeded)
+
+    async def _run_job_on_server_address_with_node(
+        self, server_address: str, node: str, payload: dict | None = None
+    ) -> bool:
+        try:
+            is_succeeded = await self._run_job_on_endpoint(
+                server_address, node, self._payload if payload is None else payload
+            )
+        except requests.RequestException as e:
+            print(repr(e))
+            is_succeeded = False
+        if not is_succeeded:
+            self._return_value = False
+        return is_succeeded
+
+    async def _run_job_on_endpoint(self, server_address: str, node: str, payload: dict) -> bool:
+        """Run the node as a job on an endpoint of the server address, limited by the semaphore of the endpoint."""
+        with self._use_endpoint(server_address) as endpoint:
+            async with self._server_semaphores.get(endpoint) or contextlib.nullcontext():
+                with self._stage_metrics.measure(self._main_settings.general.project_name, node) as span:
+                    span.input_units = await asyncio.to_thread(self._count_stage_input_units, node, payload)
+                    span.succeeded = await self._run_job(endpoint, node, payload, span)
+        return span.succeeded
+
+    async def _run_job(self, server_address: str, node: str, payload: dict, span: StageSpan) -> bool:
+        """
+        Submit the node as a job and poll for its status until it is finished or the job timeout expired. The status
+        code, payload bytes and processed documents of the job are set in the span.
+        """
+        settings_general = self._main_settings.general
+        response: requests.Response = await asyncio.to_thread(
+            self._request_node,
+            server_address,
+            node,
+            payload,
+            params={"async": "true"},
+            timeout=settings_general.job_request_timeout,
+        )
+        span.set_response(response)
+        if response.status_code != 202:
+            print(response.text)
+            return response.status_code == 200
+        try:
+            job_id = response.json()["job_id"]
+        except (ValueError, KeyError, TypeError):
+            print(f"Received no job id for {node}: {response.text}")
+            return False
+        print(f"Started {node} for project {settings_general.project_name} as job {job_id}.")
+
+        loop = asyncio.get_running_loop()
+        time_timeout = None if settings_general.job_timeout is None else loop.time() + settings_general.job_timeout
+        poll_interval = settings_general.job_poll_interval
+        while True:
+            try:
+                response = await asyncio.to_thread(
+                    self._session_polling.get,
+                    f"{server_address}/jobs/{job_id}",
+                    params={"wait": settings_general.job_long_poll},
+                    timeout=settings_general.job_request_timeout + settings_general.job_long_poll,
+                )
+            except requests.RequestException as e:
+                print(f"Polling job {job_id} failed, retrying: {e!r}")
+            else:
+                span.status_code = response.status_code
+                if response.status_code != 200:
+                    print(response.text)
+                    return False
+                try:
+                    dict_status = response.json()
+                    status = dict_status["status"]
+                except (ValueError, KeyError, TypeError):
+                    print(f"Received no status for job {job_id}: {response.text}")
+                    return False
+                if status in JOB_STATUSES_FINISHED:
+                    span.set_documents_processed(dict_status)
+                    print(dict_status.get("message", ""))
+                    return status == "succeeded"
+            if time_timeout is not None and loop.time() + poll_interval > time_timeout:
+                print(f"Job {job_id} for {node} did not finish within {settings_general.job_timeout} seconds.")
+                return False
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(
+                poll_interval * settings_general.job_poll_backoff, settings_general.job_poll_interval_max
+            )
+
+
+class RouterScheduler:
+    """
+    Runs the pipelines of many projects concurrently with one AsyncRouter per project, limiting the number of
+    concurrent jobs per server, so that each extraction and inference server is kept busy without being
+    overloaded. A failing project does not stop the others. The endpoint pools are shared by the projects, so that
+    their jobs are balanced over the endpoints.
+
+    :param list_projects: Pairs of the settings and the paths of the projects
+    :param s3_settings: S3 settings shared by the projects
+    :param max_jobs_per_server: Maximum number of concurrent jobs on a server
+    :param dict_max_jobs_per_server: Maximum number of concurrent jobs per server address, e.g.
+        {"http://172.30.88.213:6000": 2}, overriding max_jobs_per_server
+    :param stage_metrics: StageMetrics shared by the routers of the projects
+    :param health_cache: ServerHealthCache shared by the routers of the projects, which is refreshed in the
+        background while the projects run, defaults to a cache with the settings of the first project
+    """
+
+    def __init__(
+        self,
+        list_projects: list[tuple[MainSettings, ProjectPaths]],
+        s3_settings: S3Settings,
+        max_jobs_per_server: int = 1,
+        dict_max_jobs_per_server: dict[str, int] | None = None,
+        stage_metrics: StageMetrics | None = None,
+        health_cache: ServerHealthCache | None = None,
+    ) -> None:
+        self._list_projects: list[tuple[MainSettings, ProjectPaths]] = list_projects
+        self._s3_settings: S3Settings = s3_settings
+        self._max_jobs_per_server: int = max_jobs_per_server
+        self._dict_max_jobs_per_server: dict[str, int] = dict_max_jobs_per_server or {}
+        self._stage_metrics: StageMetrics = stage_metrics or StageMetrics()
+        self._health_cache: ServerHealthCache | None = health_cache
+
+    @property
+    def stage_metrics(self) -> StageMetrics:
+        return self._stage_metrics
+
+    def run(self) -> list[bool]:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> list[bool]:
+        """Run the pipelines of all projects and return their return values in the order of the projects."""
+        server_semaphores: dict[str, asyncio.Semaphore] = {}
+        for main_settings, _ in self._list_projects:
+            settings_general = main_settings.general
+            for server_address in get_server_addresses(
+                settings_general.ext_endpoints, settings_general.ext_ip, settings_general.ext_port
+            ) + get_server_addresses(
+                settings_general.infer_endpoints, settings_general.infer_ip, settings_general.infer_port
+            ):
+                server_semaphores.setdefault(
+                    server_address,
+                    asyncio.Semaphore(self._dict_max_jobs_per_server.get(server_address, self._max_jobs_per_server)),
+                )
+        health_cache = self._health_cache
+        endpoint_pools: dict[str, EndpointPool] = {}
+        list_routers: list[AsyncRouter] = []
+        for main_settings, project_paths in self._list_projects:
+            router = AsyncRouter(
+                main_settings,
+                self._s3_settings,
+                project_paths,
+                server_semaphores=server_semaphores,
+                stage_metrics=self._stage_metrics,
+                health_cache=health_cache,
+                endpoint_pools=endpoint_pools,
+            )
+            health_cache = router.health_cache
+            list_routers.append(router)
+        if health_cache is not None:
+            health_cache.start_background_refresh()
+        try:
+            list_return_values = await asyncio.gather(*(self._run_router(router) for router in list_routers))
+        finally:
+            if health_cache is not None:
+                await asyncio.to_thread(health_cache.stop_background_refresh)
+        for (main_settings, _), return_value in zip(self._list_projects, list_return_values):
+            print(
+                f"Project {main_settings.general.project_name} finished {'' if return_value else 'not '}successfully."
+            )
+        return list_return_values
+
+    @staticmethod
+    async def _run_router(router: AsyncRouter) -> bool:
+        try:
+            await router.run_router_async()
+        except Exception as e:
+            print(f"Error while running project {router._main_settings.general.project_name}.")
+            print(repr(e))
+            print(traceback.format_exc())
+            return False
+        return router.return_value
@@ -1,13 +1,67 @@
 """S3 communication tools."""
+import asyncio
+import functools
+import json
 import os
 import os.path as osp
 import pathlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
 from io import BytesIO
 from pathlib import Path
+from typing import Any, Callable
 
 import boto3
 import pandas as pd
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from osc_extraction_utils.exceptions import S3TransferError
+
+DEFAULT_MAX_POOL_CONNECTIONS: int = 10
+MULTIPART_THRESHOLD: int = 64 * 1024 * 1024
+MULTIPART_CHUNKSIZE: int = 16 * 1024 * 1024
+MULTIPART_MAX_CONCURRENCY: int = 4
+SYNC_MANIFEST_FILE_NAME: str = ".s3_sync_manifest.json"
+COMPRESSION_MAGIC_BYTES: dict[str, bytes] = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+
+_shared_s3_resources: dict[tuple, Any] = {}
+_shared_s3_resources_lock = threading.Lock()
+
+
+def get_shared_s3_resource(
+    s3_endpoint_url: str | None,
+    aws_access_key_id: str | None,
+    aws_secret_access_key: str | None,
+    max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+    tcp_keepalive: bool = True,
+) -> Any:
+    """
+    Return the process-wide boto3 s3 resource for the given endpoint, credentials and connection pool settings.
+
+    The resource, and with it the connection pool of its client, is created only once, so that all
+    S3Communication objects of a process reuse already established connections. The bucket is not part of the
+    key, as a connection pool serves all buckets of an endpoint.
+    """
+    key = (s3_endpoint_url, aws_access_key_id, aws_secret_access_key, max_pool_connections, tcp_keepalive)
+    with _shared_s3_resources_lock:
+        if key not in _shared_s3_resources:
+            _shared_s3_resources[key] = boto3.resource(
+                "s3",
+                endpoint_url=s3_endpoint_url,
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                config=Config(max_pool_connections=max_pool_connections, tcp_keepalive=tcp_keepalive),
+            )
+        return _shared_s3_resources[key]
+
+
+def clear_shared_s3_resources() -> None:
+    """Drop all shared boto3 s3 resources, e.g. after credentials have been rotated."""
+    with _shared_s3_resources_lock:
+        _shared_s3_resources.clear()
 
 
 class S3FileType(Enum):
@@ -31,43 +85,78 @@ class S3Communication(object):
         aws_access_key_id: str | None,
         aws_secret_access_key: str | None,
         s3_bucket: str | None,
+        max_workers: int = 1,
+        max_pool_connections: int | None = None,
+        tcp_keepalive: bool = True,
     ) -> None:
-        """Initialize communicator."""
+        """
+        Initialize communicator.
+
+        max_workers is the default number of threads used for transferring the files of a prefix or directory.
+        max_pool_connections is the size of the HTTP connection pool, by default large enough for max_workers.
+        The boto3 resource is shared with all communicators of the process with the same endpoint, credentials
+        and connection pool settings, see get_shared_s3_resource.
+        """
         self.s3_endpoint_url = s3_endpoint_url
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
-        self.s3_resource = boto3.resource(
-            "s3",
-            endpoint_url=self.s3_endpoint_url,
-            aws_access_key_id=self.aws_access_key_id,
-            aws_secret_access_key=self.aws_secret_access_key,
+        self.max_workers = max_workers
+        if max_pool_connections is None:
+            max_pool_connections = max(DEFAULT_MAX_POOL_CONNECTIONS, max_workers * MULTIPART_MAX_CONCURRENCY)
+        self.s3_resource = get_shared_s3_resource(
+            self.s3_endpoint_url,
+            self.aws_access_key_id,
+            self.aws_secret_access_key,
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=tcp_keepalive,
+        )
+        # in contrast to the resource, the low-level client is thread safe and is used for concurrent transfers
+        self.s3_client = self.s3_resource.meta.client
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=MULTIPART_MAX_CONCURRENCY,
         )
         self.bucket = s3_bucket
 
     def _upload_bytes(self, buffer_bytes, prefix, key):
         """Upload byte content in buffer to bucket."""
-        s3_object = self.s3_resource.Object(self.bucket, osp.join(prefix, key))
-        status = s3_object.put(Body=buffer_bytes)
+        status = self.s3_client.put_object(Bucket=self.bucket, Key=osp.join(prefix, key), Body=buffer_bytes)
         return status
 
     def _download_bytes(self, prefix: str, key: str) -> bytes:
         """Download byte content in bucket/prefix/key to buffer."""
         buffer = BytesIO()
-        s3_object = self.s3_resource.Object(self.bucket, osp.join(prefix, key))
-        s3_object.download_fileobj(buffer)
+        self.s3_client.download_fileobj(self.bucket, osp.join(prefix, key), buffer)
         return buffer.getvalue()
 
-    def upload_file_to_s3(self, filepath: Path | str, s3_prefix: str, s3_key: str):
-        """Read file from disk and upload to s3 bucket/prefix/key."""
+    def upload_file_to_s3(self, filepath: Path | str, s3_prefix: str, s3_key: str) -> None:
+        """
+        Stream file from disk to s3 bucket/prefix/key.
+
+        Files larger than MULTIPART_THRESHOLD are uploaded as multipart upload in chunks of MULTIPART_CHUNKSIZE.
+        """
         with open(filepath, "rb") as f:
-            status = self._upload_bytes(f.read(), s3_prefix, s3_key)
-        return status
+            self.s3_client.upload_fileobj(f, self.bucket, osp.join(s3_prefix, s3_key), Config=self.transfer_config)
 
-    def download_file_from_s3(self, filepath: Path, s3_prefix: str, s3_key: str):
-        """Download file from s3 bucket/prefix/key and save it to filepath on disk."""
-        buffer_bytes = self._download_bytes(s3_prefix, s3_key)
-        with open(filepath, "wb") as f:
-            f.write(buffer_bytes)
+    def download_file_from_s3(self, filepath: Path | str, s3_prefix: str, s3_key: str) -> None:
+        """
+        Stream file from s3 bucket/prefix/key to filepath on disk.
+
+        The object is written to a hidden temporary file next to filepath, which atomically replaces filepath once
+        the download is complete. Memory usage does not depend on the object size.
+        """
+        path_file = Path(filepath)
+        path_file_tmp = path_file.with_name(f".{path_file.name}.{uuid.uuid4().hex}.part")
+        try:
+            with open(path_file_tmp, "xb") as f:
+                self.s3_client.download_fileobj(
+                    self.bucket, osp.join(s3_prefix, s3_key), f, Config=self.transfer_config
+                )
+            os.replace(path_file_tmp, path_file)
+        except BaseException:
+            path_file_tmp.unlink(missing_ok=True)
+            raise
 
     def upload_df_to_s3(self, df, s3_prefix, s3_key, filetype=S3FileType.PARQUET, **pd_to_ftype_args):
         """
@@ -89,9 +178,17 @@ class S3Communication(object):
         return status
 
     def download_df_from_s3(self, s3_prefix, s3_key, filetype=S3FileType.PARQUET, **pd_read_ftype_args):
-        """Read from s3 and see if the saved data is correct."""
+        """
+        Read from s3 and see if the saved data is correct.
+
+        Gzip and zstd compressed csv and json files are detected by their magic bytes and decompressed, unless
+        a compression is passed explicitly. Zstd requires the zstd extra.
+        """
         buffer_bytes = self._download_bytes(s3_prefix, s3_key)
         buffer = BytesIO(buffer_bytes)
+        compression = self._detect_compression(buffer_bytes)
+        if compression is not None and filetype in (S3FileType.CSV, S3FileType.JSON):
+            pd_read_ftype_args.setdefault("compression", compression)
 
         if filetype == S3FileType.CSV:
             df = pd.read_csv(buffer, **pd_read_ftype_args)
@@ -103,40 +200,266 @@ class S3Communication(object):
             raise ValueError(f"Received unexpected file type arg {filetype}. Can only be one of: {list(S3FileType)})")
         return df
 
-    def upload_files_in_dir_to_prefix(self, source_dir, s3_prefix):
+    @staticmethod
+    def _detect_compression(buffer_bytes: bytes) -> str | None:
+        """Return the compression of the bytes according to their magic bytes, or None if they are not compressed."""
+        return next(
+            (
+                compression
+                for compression, magic_bytes in COMPRESSION_MAGIC_BYTES.items()
+                if buffer_bytes.startswith(magic_bytes)
+            ),
+            None,
+        )
+
+    def upload_files_in_dir_to_prefix(self, source_dir, s3_prefix, max_workers: int | None = None) -> None:
         """
-        Upload all files in a directory to under the s3 prefix, recursively.
+        Upload all files in a directory to under the s3 prefix, recursively, keeping the structure of sub
+        directories, i.e. source_dir/sub/file.csv is uploaded to s3_prefix/sub/file.csv.
 
-        Excludes hidden files and directories by default.
+        Excludes hidden files and directories by default. The files are uploaded concurrently by max_workers
+        threads, defaulting to the max_workers of the communicator. Failed uploads do not stop the others and are
+        raised together as S3TransferError.
         """
         # convert to pathlib path
         source_dir_pl = pathlib.Path(source_dir)
 
-        # get all files and directories EXCEPT hidden ones
-        upload_files_paths = list(source_dir_pl.rglob("[!.]*"))
-        for fpath in upload_files_paths:
-            self.upload_file_to_s3(fpath, s3_prefix, fpath.name)
-
-    def download_files_in_prefix_to_dir(self, s3_prefix, destination_dir) -> None:
-        """
-        Download all files under a prefix to a directory.
-
-        Modified from original code here: https://stackoverflow.com/a/33350380
-        """
-        paginator = self.s3_resource.meta.client.get_paginator("list_objects")
-        for result in paginator.paginate(Bucket=self.bucket, Delimiter="/", Prefix=s3_prefix):
-            # download all files in the sub "directory", if any
-            if result.get("CommonPrefixes") is not None:
-                for subdir in result.get("CommonPrefixes"):
-                    self.download_files_in_prefix_to_dir(
-                        subdir.get("Prefix"),
-                        destination_dir,
-                    )
-            # download files at the root of this prefix
-            for file in result.get("Contents", []):
-                dest_filename = osp.basename(file.get("Key"))
-                if dest_filename:
-                    dest_pathname = osp.join(destination_dir, dest_filename)
-                    if not osp.exists(osp.dirname(dest_pathname)):
-                        os.makedirs(osp.dirname(dest_pathname))
-                    self.download_file_from_s3(dest_pathname, s3_prefix, dest_filename)
+        # get all files EXCEPT hidden ones and the ones in hidden directories
+        upload_files_paths = [
+            fpath
+            for fpath in source_dir_pl.rglob("[!.]*")
+            if fpath.is_file() and not any(part.startswith(".") for part in fpath.relative_to(source_dir_pl).parts)
+        ]
+        list_upload_jobs = [
+            (str(fpath), (fpath, s3_prefix, fpath.relative_to(source_dir_pl).as_posix()))
+            for fpath in upload_files_paths
+        ]
+        self._run_transfer_jobs(self.upload_file_to_s3, list_upload_jobs, max_workers or self.max_workers)
+
+    def download_files_in_prefix_to_dir(
+        self, s3_prefix, destination_dir, max_workers: int | None = None, incremental: bool = False
+    ) -> None:
+        """
+        Download all files under a prefix to a directory, keeping the structure of sub "directories".
+
+        The prefix is treated as "directory", i.e. s3_prefix/sub/file.csv is saved to destination_dir/sub/file.csv.
+        All objects are listed in one flat, paginated listing and downloaded concurrently by max_workers threads,
+        defaulting to the max_workers of the communicator. Failed downloads do not stop the others and are raised
+        together as S3TransferError.
+
+        With incremental, the ETag, size and last modified date of every listed object are stored in a manifest
+        file in destination_dir. Objects which are unchanged since the last download and whose local file has not
+        been modified are skipped, so that re-running on an unchanged prefix only lists it.
+        """
+        s3_prefix_dir = self._to_prefix_dir(s3_prefix)
+        dict_download_jobs: dict[str, tuple[dict, tuple]] = {}
+        for s3_object in self._list_objects_in_prefix(s3_prefix_dir):
+            relative_path = s3_object["Key"][len(s3_prefix_dir) :]
+            if not relative_path or relative_path.endswith("/"):
+                # "directory" placeholder objects
+                continue
+            if ".." in relative_path.split("/"):
+                print(f"Skipping {s3_object['Key']}, as it points outside of {destination_dir}.")
+                continue
+            dest_pathname = osp.join(destination_dir, *relative_path.split("/"))
+            os.makedirs(osp.dirname(dest_pathname), exist_ok=True)
+            dict_download_jobs[relative_path] = (
+                s3_object,
+                (dest_pathname, osp.dirname(s3_object["Key"]), osp.basename(s3_object["Key"])),
+            )
+
+        dict_manifest: dict[str, dict] = self._read_sync_manifest(destination_dir) if incremental else {}
+        list_download_jobs = [
+            (s3_object["Key"], args)
+            for relative_path, (s3_object, args) in dict_download_jobs.items()
+            if not self._is_in_sync(dict_manifest.get(relative_path), s3_object, Path(args[0]))
+        ]
+        try:
+            self._run_transfer_jobs(self.download_file_from_s3, list_download_jobs, max_workers or self.max_workers)
+        except S3TransferError as exception:
+            if incremental:
+                self._update_sync_manifest(
+                    destination_dir, dict_manifest, dict_download_jobs, exception.failed_transfers
+                )
+            raise
+        if incremental:
+            self._update_sync_manifest(destination_dir, dict_manifest, dict_download_jobs, {})
+
+    @staticmethod
+    def _to_prefix_dir(s3_prefix) -> str:
+        """Return the prefix of a s3 "directory", i.e. with a single trailing slash unless it is the bucket root."""
+        s3_prefix = str(s3_prefix).strip("/")
+        return f"{s3_prefix}/" if s3_prefix else ""
+
+    def _list_objects_in_prefix(self, s3_prefix) -> list[dict]:
+        """List the objects, including ETag, Size and LastModified, of all files under a prefix recursively."""
+        list_objects: list[dict] = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for result in paginator.paginate(Bucket=self.bucket, Prefix=s3_prefix):
+            list_objects.extend(result.get("Contents", []))
+        return list_objects
+
+    @staticmethod
+    def _read_sync_manifest(destination_dir) -> dict[str, dict]:
+        path_file_manifest = Path(destination_dir) / SYNC_MANIFEST_FILE_NAME
+        if not path_file_manifest.exists():
+            return {}
+        try:
+            return json.loads(path_file_manifest.read_text())
+        except ValueError:
+            print(f"Ignoring corrupt sync manifest {path_file_manifest}.")
+            return {}
+
+    def _update_sync_manifest(
+        self,
+        destination_dir,
+        dict_manifest: dict[str, dict],
+        dict_download_jobs: dict[str, tuple[dict, tuple]],
+        dict_failed_transfers: dict[str, Exception],
+    ) -> None:
+        for relative_path, (s3_object, args) in dict_download_jobs.items():
+            if s3_object["Key"] in dict_failed_transfers:
+                dict_manifest.pop(relative_path, None)
+            else:
+                dict_manifest[relative_path] = self._create_sync_manifest_entry(s3_object, Path(args[0]))
+        self._write_sync_manifest(destination_dir, dict_manifest)
+
+    @staticmethod
+    def _write_sync_manifest(destination_dir, dict_manifest: dict[str, dict]) -> None:
+        path_file_manifest = Path(destination_dir) / SYNC_MANIFEST_FILE_NAME
+        path_file_manifest_tmp = path_file_manifest.with_name(f"{path_file_manifest.name}.{uuid.uuid4().hex}.part")
+        path_file_manifest_tmp.write_text(json.dumps(dict_manifest, indent=2, sort_keys=True))
+        os.replace(path_file_manifest_tmp, path_file_manifest)
+
+    @staticmethod
+    def _create_sync_manifest_entry(s3_object: dict, path_file: Path) -> dict:
+        stat_file = path_file.stat()
+        return {
+            "key": s3_object["Key"],
+            "etag": s3_object["ETag"],
+            "size": s3_object["Size"],
+            "last_modified": s3_object["LastModified"].isoformat(),
+            "local_size": stat_file.st_size,
+            "local_mtime_ns": stat_file.st_mtime_ns,
+        }
+
+    @staticmethod
+    def _is_in_sync(manifest_entry: dict | None, s3_object: dict, path_file: Path) -> bool:
+        """Check if the manifest entry matches the listed object and the local file was not modified since."""
+        if manifest_entry is None or not path_file.exists():
+            return False
+        stat_file = path_file.stat()
+        return (
+            manifest_entry["key"] == s3_object["Key"]
+            and manifest_entry["etag"] == s3_object["ETag"]
+            and manifest_entry["size"] == s3_object["Size"]
+            and manifest_entry["last_modified"] == s3_object["LastModified"].isoformat()
+            and manifest_entry["local_size"] == stat_file.st_size
+            and manifest_entry["local_mtime_ns"] == stat_file.st_mtime_ns
+        )
+
+    @staticmethod
+    def _run_transfer_jobs(transfer: Callable[..., Any], list_jobs: list[tuple[str, tuple]], max_workers: int) -> None:
+        """
+        Run transfer(*args) for all (name, args) jobs in a thread pool and print the progress per file.
+
+        Raises S3TransferError with all failed names after every job has finished.
+        """
+        dict_failed_transfers: dict[str, Exception] = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            dict_futures = {executor.submit(transfer, *args): name for name, args in list_jobs}
+            for number_done, future in enumerate(as_completed(dict_futures), start=1):
+                name = dict_futures[future]
+                try:
+                    future.result()
+                    print(f"Transferred {name} ({number_done}/{len(dict_futures)})")
+                except Exception as exception:
+                    dict_failed_transfers[name] = exception
+                    print(f"Failed to transfer {name} ({number_done}/{len(dict_futures)}): {exception!r}")
+        if dict_failed_transfers:
+            raise S3TransferError(dict_failed_transfers)
+
+
+class AsyncS3Communication(object):
+    """
+    Asyncio variant of S3Communication with the same methods as coroutines.
+
+    The blocking boto3 calls of a wrapped S3Communication run in a thread pool of max_in_flight threads, with a
+    connection pool of the same size, so that up to max_in_flight requests are in flight while the event loop
+    stays free, e.g. for the HTTP calls to the extraction and inference servers.
+    """
+
+    def __init__(
+        self,
+        s3_endpoint_url: str | None,
+        aws_access_key_id: str | None,
+        aws_secret_access_key: str | None,
+        s3_bucket: str | None,
+        max_in_flight: int = 256,
+        max_workers: int = 1,
+    ) -> None:
+        """
+        Initialize communicator.
+
+        max_workers is the default number of threads used by one prefix or directory transfer.
+        """
+        self.s3_communication = S3Communication(
+            s3_endpoint_url=s3_endpoint_url,
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            s3_bucket=s3_bucket,
+            max_workers=max_workers,
+            max_pool_connections=max(max_in_flight, max_workers * MULTIPART_MAX_CONCURRENCY),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="s3_async")
+
+    async def __aenter__(self) -> "AsyncS3Communication":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Shut down the thread pool in a thread, so that the event loop keeps running until the calls finish."""
+        await asyncio.to_thread(self._executor.shutdown, True)
+
+    def close(self) -> None:
+        """Shut down the thread pool after the running calls have finished."""
+        self._executor.shutdown(wait=True)
+
+    async def _run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def upload_file_to_s3(self, filepath: Path | str, s3_prefix: str, s3_key: str) -> None:
+        """Stream file from disk to s3 bucket/prefix/key, see S3Communication.upload_file_to_s3."""
+        await self._run(self.s3_communication.upload_file_to_s3, filepath, s3_prefix, s3_key)
+
+    async def download_file_from_s3(self, filepath: Path | str, s3_prefix: str, s3_key: str) -> None:
+        """Stream file from s3 bucket/prefix/key to disk, see S3Communication.download_file_from_s3."""
+        await self._run(self.s3_communication.download_file_from_s3, filepath, s3_prefix, s3_key)
+
+    async def upload_df_to_s3(self, df, s3_prefix, s3_key, filetype=S3FileType.PARQUET, **pd_to_ftype_args):
+        """Upload the data frame to s3 bucket/prefix/key, see S3Communication.upload_df_to_s3."""
+        return await self._run(
+            self.s3_communication.upload_df_to_s3, df, s3_prefix, s3_key, filetype, **pd_to_ftype_args
+        )
+
+    async def download_df_from_s3(self, s3_prefix, s3_key, filetype=S3FileType.PARQUET, **pd_read_ftype_args):
+        """Read a data frame from s3 bucket/prefix/key, see S3Communication.download_df_from_s3."""
+        return await self._run(
+            self.s3_communication.download_df_from_s3, s3_prefix, s3_key, filetype, **pd_read_ftype_args
+        )
+
+    async def upload_files_in_dir_to_prefix(self, source_dir, s3_prefix, max_workers: int | None = None) -> None:
+        """Upload all files in a directory, see S3Communication.upload_files_in_dir_to_prefix."""
+        await self._run(self.s3_communication.upload_files_in_dir_to_prefix, source_dir, s3_prefix, max_workers)
+
+    async def download_files_in_prefix_to_dir(
+        self, s3_prefix, destination_dir, max_workers: int | None = None, incremental: bool = False
+    ) -> None:
+        """Download all files under a prefix, see S3Communication.download_files_in_prefix_to_dir."""
+        await self._run(
+            self.s3_communication.download_files_in_prefix_to_dir,
+            s3_prefix,
+            destination_dir,
+            max_workers,
+            incremental,
+        )
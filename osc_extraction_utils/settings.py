@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -14,10 +14,45 @@ class General(BaseSettings):
     ext_port: int = 4000
     infer_ip: str = "172.30.88.213"
     infer_port: int = 6000
+    ext_endpoints: List[str] = []
+    infer_endpoints: List[str] = []
+    endpoint_dispatch: Literal["least_outstanding", "round_robin"] = "least_outstanding"
+    endpoint_ejection_time: float = 30.0
     rb_ip: str = "172.30.224.91"
     rb_port: int = 8000
+    rb_health_check: bool = False  # probe the rule-based server before a run, which none of its stages uses
+    health_check_ttl: float = 30.0
+    health_check_connect_timeout: float = 1.0
     delete_interim_files: bool = True
     s3_usage: bool = False
+    request_connect_timeout: float = 10.0
+    # seconds without a response byte until a step fails, generous since the steps are answered when finished
+    request_read_timeout: float | None = 6 * 3600.0
+    request_read_timeouts: dict[str, float | None] = {
+        "liveness": 30.0,
+        "train_relevance": 24 * 3600.0,
+        "train_kpi": 24 * 3600.0,
+    }
+    request_retries: int = 3
+    request_retry_backoff: float = 1.0
+    request_retry_jitter: float = 1.0
+    request_retry_status_codes: List[int] = [502, 503, 504]  # only for the liveness probes and job status polls
+    request_pool_maxsize: int = 10
+    job_request_timeout: float = 30.0
+    job_poll_interval: float = 1.0
+    job_poll_interval_max: float = 60.0
+    job_poll_backoff: float = 2.0
+    job_long_poll: float = 0.0
+    job_timeout: float | None = None
+    pipeline_batch_size: int = 0
+    payload_mode: Literal["query", "post", "reference"] = "query"
+    payload_sections: dict[str, List[str]] = {
+        "extract": ["general", "extraction"],
+        "curate": ["general", "curation"],
+        "train_relevance": ["general", "train_relevance"],
+        "infer_relevance": ["general", "train_relevance", "infer_relevance"],
+        "train_kpi": ["general", "train_kpi"],
+    }
 
 
 class DataExport(BaseSettings):
@@ -38,6 +73,10 @@ class Extraction(BaseSettings):
     skip_extracted_files: bool = True
     use_extractions: bool = True
     store_extractions: bool = True
+    shard_size: int = 0
+    shard_bytes: int = 0
+    shard_workers: int = 4
+    shard_retries: int = 1
 
 
 class Curation(BaseSettings):
@@ -99,9 +138,9 @@ class TrainRelevance(BaseSettings):
     output_model_name: str = "TEST_1"
     train: bool = True
     seed: int = 42
-    processor: Processor = Processor()
-    model: Model = Model()
-    training: Training = Training()
+    processor: Processor = Field(default_factory=Processor)
+    model: Model = Field(default_factory=Model)
+    training: Training = Field(default_factory=Training)
 
 
 class InferRelevance(BaseSettings):
@@ -138,18 +177,26 @@ class KpiProcessor(BaseSettings):
     metric: str = "squad"
 
 
+class Text3434(BaseSettings):
+    file_format: Literal["csv", "parquet"] = "csv"
+    max_workers: int = 1
+    incremental: bool = False
+    compression: Literal["gzip", "zstd"] | None = None
+
+
 class TrainKpi(BaseSettings):
     input_model_name: str | None = None
     output_model_name: str = "TEST_1"
     base_model: str = "a-ware/roberta-large-squadv2"
     train: bool = True
     seed: int = 42
-    curation: KpiCuration = KpiCuration()
-    data: Data = Data()
-    mlflow: MlFlow = MlFlow()
-    processor: KpiProcessor = KpiProcessor()
-    model: Model = Model(model_lm_output_types=["per_token"])
-    training: Training = Training(dropout=0.3, metric="f1", max_processes=1)
+    curation: KpiCuration = Field(default_factory=KpiCuration)
+    data: Data = Field(default_factory=Data)
+    mlflow: MlFlow = Field(default_factory=MlFlow)
+    processor: KpiProcessor = Field(default_factory=KpiProcessor)
+    model: Model = Field(default_factory=lambda: Model(model_lm_output_types=["per_token"]))
+    training: Training = Field(default_factory=lambda: Training(dropout=0.3, metric="f1", max_processes=1))
+    text_3434: Text3434 = Field(default_factory=Text3434)
 
 
 class InferKpi(BaseSettings):
@@ -195,20 +242,20 @@ class InterimBucketSettings(BaseSettings):
 
 class S3Settings(Settings, BaseSettings):
     prefix: str = Field(default="corporate_data_extraction_projects")
-    main_bucket: MainBucketSettings = Field(default=MainBucketSettings())
-    interim_bucket: InterimBucketSettings = Field(default=InterimBucketSettings())
+    main_bucket: MainBucketSettings = Field(default_factory=MainBucketSettings)
+    interim_bucket: InterimBucketSettings = Field(default_factory=InterimBucketSettings)
 
 
 class MainSettings(Settings, BaseSettings):
-    general: General = General()
-    data_export: DataExport = DataExport()
-    extraction: Extraction = Extraction()
-    curation: Curation = Curation()
-    train_relevance: TrainRelevance = TrainRelevance()
-    infer_relevance: InferRelevance = InferRelevance()
-    train_kpi: TrainKpi = TrainKpi()
-    infer_kpi: InferKpi = InferKpi()
-    rule_based: RuleBased = RuleBased()
+    general: General = Field(default_factory=General)
+    data_export: DataExport = Field(default_factory=DataExport)
+    extraction: Extraction = Field(default_factory=Extraction)
+    curation: Curation = Field(default_factory=Curation)
+    train_relevance: TrainRelevance = Field(default_factory=TrainRelevance)
+    infer_relevance: InferRelevance = Field(default_factory=InferRelevance)
+    train_kpi: TrainKpi = Field(default_factory=TrainKpi)
+    infer_kpi: InferKpi = Field(default_factory=InferKpi)
+    rule_based: RuleBased = Field(default_factory=RuleBased)
     s3_settings: S3Settings | None = None
 
 
@@ -1,3 +1,5 @@
+import copy
+import functools
 from pathlib import Path
 from typing import Type
 
@@ -6,14 +8,34 @@ import yaml
 from osc_extraction_utils.settings import MainSettings, S3Settings
 
 
+def load_yaml_file(path_file: Path | str) -> dict:
+    """
+    Parse a yaml file, cached by its path, modification time and size, so that a file is only parsed again after it
+    changed. The result is a copy, which the caller may change.
+    """
+    path_file = Path(path_file).resolve()
+    stat_file = path_file.stat()
+    return copy.deepcopy(_load_yaml_file(str(path_file), stat_file.st_mtime_ns, stat_file.st_size))
+
+
+def clear_yaml_cache() -> None:
+    _load_yaml_file.cache_clear()
+
+
+@functools.lru_cache(maxsize=32)
+def _load_yaml_file(path_file: str, mtime_ns: int, size: int) -> dict:
+    with open(path_file, mode="r") as file:
+        return yaml.safe_load(file) or {}
+
+
 class SettingsHandler:
     """
     Class for reading and writing setting files
     """
 
-    def __init__(self, main_settings: MainSettings = MainSettings(), s3_settings: S3Settings = S3Settings()):
-        self.main_settings: MainSettings = main_settings
-        self.s3_settings: S3Settings = s3_settings
+    def __init__(self, main_settings: MainSettings | None = None, s3_settings: S3Settings | None = None):
+        self.main_settings: MainSettings = main_settings if main_settings is not None else MainSettings()
+        self.s3_settings: S3Settings = s3_settings if s3_settings is not None else S3Settings()
 
     def read_settings(
         self,
@@ -30,8 +52,7 @@ class SettingsHandler:
 
     @staticmethod
     def _read_setting_file(path: Path) -> S3Settings | MainSettings:
-        with open(path, mode="r") as file_settings:
-            loaded_settings: dict = yaml.safe_load(file_settings)
+        loaded_settings: dict = load_yaml_file(path)
         settings: Type[S3Settings] | Type[MainSettings] = SettingsHandler._settings_factory(loaded_settings)
         return settings(**loaded_settings)
 
@@ -0,0 +1,311 @@
+import asyncio
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import requests
+from _pytest.capture import CaptureFixture
+
+from osc_extraction_utils.conftest import JobServerStandIn
+from osc_extraction_utils.paths import ProjectPaths
+from osc_extraction_utils.router import AsyncRouter, RouterScheduler
+from osc_extraction_utils.settings import MainSettings, S3Settings
+
+
+@pytest.fixture
+def create_main_settings(main_settings: MainSettings, job_server: JobServerStandIn):
+    def create_main_settings(project_name: str = "TEST", **dict_general_settings) -> MainSettings:
+        main_settings_job_server = main_settings.model_copy(deep=True)
+        main_settings_job_server.general = main_settings.general.model_copy(
+            update={
+                "project_name": project_name,
+                "ext_ip": job_server.ip,
+                "ext_port": job_server.port,
+                "infer_ip": job_server.ip,
+                "infer_port": job_server.port,
+                "rb_ip": job_server.ip,
+                "rb_port": job_server.port,
+                "job_poll_interval": 0.01,
+                "job_poll_interval_max": 0.02,
+                "request_retry_backoff": 0.0,
+                "request_retry_jitter": 0.0,
+            }
+            | dict_general_settings
+        )
+        main_settings_job_server.train_relevance.train = True
+        main_settings_job_server.train_kpi.train = True
+        return main_settings_job_server
+
+    with patch("osc_extraction_utils.router.generate_text_3434", lambda *args, **kwargs: True):
+        yield create_main_settings
+
+
+@pytest.fixture
+def create_async_router(create_main_settings, s3_settings: S3Settings, project_paths: ProjectPaths):
+    def create_async_router(project_name: str = "TEST", **dict_general_settings) -> AsyncRouter:
+        return AsyncRouter(create_main_settings(project_name, **dict_general_settings), s3_settings, project_paths)
+
+    return create_async_router
+
+
+def test_async_router_runs_jobs(create_async_router, job_server: JobServerStandIn):
+    job_server.number_polls_running = 3
+    async_router = create_async_router()
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is True
+    assert job_server.nodes_requested() == ["extract", "curate", "train_relevance", "infer_relevance", "train_kpi"]
+    assert all(job["number_polls"] == 4 for job in job_server.jobs.values())
+
+
+def test_async_router_failed_job(create_async_router, job_server: JobServerStandIn, capsys: CaptureFixture[str]):
+    job_server.nodes_failing = {"curate"}
+    async_router = create_async_router()
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is False
+    assert "curate finished." in capsys.readouterr().out
+
+
+def test_async_router_retries_only_job_polls_on_bad_gateway(create_async_router, job_server: JobServerStandIn):
+    job_server.number_responses_failing.update({"jobs": 2})
+    async_router = create_async_router(request_retries=3)
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is True
+
+    job_server.number_responses_failing.update({"extract": 1})
+    async_router = create_async_router(request_retries=3)
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is False
+    assert job_server.nodes_requested().count("extract") == 2
+
+
+def test_async_router_synchronous_server(create_async_router, job_server: JobServerStandIn):
+    job_server.nodes_sync = {"extract", "curate", "train_relevance", "infer_relevance", "train_kpi"}
+    async_router = create_async_router()
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is True
+    assert not job_server.jobs
+
+
+def test_async_router_job_timeout(create_async_router, job_server: JobServerStandIn, capsys: CaptureFixture[str]):
+    job_server.number_polls_running = 1000
+    async_router = create_async_router(job_timeout=0.05)
+
+    asyncio.run(
+        async_router._run_job_on_server_address_with_node(f"http://{job_server.ip}:{job_server.port}", "train_kpi")
+    )
+
+    assert async_router.return_value is False
+    assert "did not finish within 0.05 seconds" in capsys.readouterr().out
+
+
+def test_async_router_submission_read_timeout(create_async_router, job_server: JobServerStandIn):
+    job_server.delays["curate"] = 0.2
+    async_router = create_async_router(job_request_timeout=0.05)
+
+    asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is False
+    assert job_server.nodes_requested()[:2] == ["extract", "curate"]
+
+
+@pytest.mark.parametrize("content", [b"accepted", b'{"id": "1"}', b'["1"]'])
+def test_async_router_submission_without_job_id(
+    create_async_router, job_server: JobServerStandIn, capsys: CaptureFixture[str], content: bytes
+):
+    response = requests.Response()
+    response.status_code = 202
+    response._content = content
+    async_router = create_async_router()
+
+    with patch.object(async_router, "_request_node", return_value=response):
+        asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is False
+    assert f"Received no job id for extract: {content.decode()}" in capsys.readouterr().out
+    span = async_router.stage_metrics.list_spans[0]
+    assert (span.stage, span.status_code, span.succeeded) == ("extract", 202, False)
+
+
+def test_async_router_poll_without_status(create_async_router, job_server: JobServerStandIn):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = b"{}"
+    async_router = create_async_router()
+
+    with patch.object(async_router._session_polling, "get", return_value=response):
+        asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is False
+    span = async_router.stage_metrics.list_spans[0]
+    assert (span.stage, span.status_code, span.succeeded) == ("extract", 200, False)
+
+
+def test_async_router_runs_projects_concurrently(create_async_router, job_server: JobServerStandIn):
+    job_server.number_polls_running = 3
+    list_async_routers = [create_async_router(project_name=f"PROJECT_{i}") for i in range(3)]
+
+    async def run_routers():
+        await asyncio.gather(*(async_router.run_router_async() for async_router in list_async_routers))
+
+    asyncio.run(run_routers())
+
+    assert all(async_router.return_value for async_router in list_async_routers)
+    list_project_names = [
+        json.loads(params["payload"])["project_name"]
+        for path, params in job_server.requests
+        if path.strip("/") in ("extract", "train_kpi")
+    ]
+    # every project is extracted before any project finished
+    assert sorted(list_project_names[:3]) == ["PROJECT_0", "PROJECT_1", "PROJECT_2"]
+
+
+@pytest.mark.parametrize("max_jobs_per_server", [1, 2])
+def test_router_scheduler_limits_jobs_per_server(
+    create_main_settings,
+    s3_settings: S3Settings,
+    project_paths: ProjectPaths,
+    job_server: JobServerStandIn,
+    max_jobs_per_server: int,
+):
+    job_server.number_polls_running = 2
+    list_projects = [(create_main_settings(project_name=f"PROJECT_{i}"), project_paths) for i in range(4)]
+
+    router_scheduler = RouterScheduler(list_projects, s3_settings, max_jobs_per_server=max_jobs_per_server)
+    list_return_values = router_scheduler.run()
+
+    assert list_return_values == [True] * 4
+    assert len(job_server.jobs) == 4 * 5
+    assert job_server.max_number_jobs_running == max_jobs_per_server
+    assert len(router_scheduler.stage_metrics.list_spans) == 4 * 6
+
+
+def test_router_scheduler_balances_jobs_over_endpoints(
+    create_main_settings,
+    s3_settings: S3Settings,
+    project_paths: ProjectPaths,
+    job_server: JobServerStandIn,
+    create_job_server,
+):
+    list_job_servers = [job_server, create_job_server()]
+    list_infer_endpoints = [f"{job_server_infer.ip}:{job_server_infer.port}" for job_server_infer in list_job_servers]
+    list_projects = [
+        (create_main_settings(project_name=f"PROJECT_{i}", infer_endpoints=list_infer_endpoints), project_paths)
+        for i in range(4)
+    ]
+
+    list_return_values = RouterScheduler(list_projects, s3_settings, max_jobs_per_server=2).run()
+
+    assert list_return_values == [True] * 4
+    for job_server_infer in list_job_servers:
+        assert 0 < job_server_infer.nodes_requested().count("train_relevance") < 4
+        assert job_server_infer.max_number_jobs_running <= 2
+    assert sum(len(job_server_infer.jobs) for job_server_infer in list_job_servers) == 4 * 5
+
+
+def test_router_scheduler_isolates_failing_project(
+    create_main_settings,
+    s3_settings: S3Settings,
+    project_paths: ProjectPaths,
+    job_server: JobServerStandIn,
+    capsys: CaptureFixture[str],
+):
+    server_address = f"http://{job_server.ip}:{job_server.port}"
+    list_projects = [
+        (create_main_settings(project_name="PROJECT_UP"), project_paths),
+        (create_main_settings(project_name="PROJECT_DOWN", ext_port=1), project_paths),
+    ]
+
+    router_scheduler = RouterScheduler(
+        list_projects, s3_settings, max_jobs_per_server=1, dict_max_jobs_per_server={server_address: 3}
+    )
+    list_return_values = router_scheduler.run()
+
+    assert list_return_values == [True, False]
+    cmd_output = capsys.readouterr().out
+    assert "Aborting, since these servers are not responding: Extraction server http://127.0.0.1:1." in cmd_output
+    assert "Project PROJECT_UP finished successfully." in cmd_output
+
+
+def test_async_router_pipelines_batches(
+    create_main_settings,
+    s3_settings: S3Settings,
+    project_paths: ProjectPaths,
+    job_server: JobServerStandIn,
+    tmp_path: Path,
+):
+    job_server.number_polls_running = 3
+    for i in range(5):
+        (tmp_path / f"report_{i}.pdf").touch()
+    (tmp_path / ".hidden.pdf").touch()
+    main_settings_pipelined = create_main_settings(pipeline_batch_size=2)
+    main_settings_pipelined.train_relevance.train = False
+
+    with patch.object(project_paths, "path_folder_source_pdf", tmp_path):
+        async_router = AsyncRouter(main_settings_pipelined, s3_settings, project_paths)
+        asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is True
+    list_nodes = job_server.nodes_requested()
+    assert list_nodes.count("extract") == list_nodes.count("infer_relevance") == 3
+    assert list_nodes.count("curate") == 1
+    assert list_nodes[-1] == "train_kpi"
+    # the relevance of the first batch is inferred before the last batch is extracted, curation follows the last
+    index_extract_last = len(list_nodes) - 1 - list_nodes[::-1].index("extract")
+    assert list_nodes.index("infer_relevance") < index_extract_last < list_nodes.index("curate")
+    assert [
+        "documents" in json.loads(params["payload"]) for path, params in job_server.requests if path == "/curate"
+    ] == [False]
+    list_batches = [
+        json.loads(params["payload"])["documents"] for path, params in job_server.requests if path == "/infer_relevance"
+    ]
+    assert list_batches == [["report_0.pdf", "report_1.pdf"], ["report_2.pdf", "report_3.pdf"], ["report_4.pdf"]]
+    list_spans_infer_relevance = [
+        span for span in async_router.stage_metrics.list_spans if span.stage == "infer_relevance"
+    ]
+    assert [span.documents_processed for span in list_spans_infer_relevance] == [2, 2, 1]
+    assert all(span.status_code == 200 and span.succeeded for span in list_spans_infer_relevance)
+
+
+def test_async_router_pipelining_requires_no_relevance_training(
+    create_async_router, job_server: JobServerStandIn, capsys: CaptureFixture[str]
+):
+    async_router = create_async_router(pipeline_batch_size=2)
+
+    asyncio.run(async_router.run_router_async())
+
+    assert job_server.nodes_requested() == ["extract", "curate", "train_relevance", "infer_relevance", "train_kpi"]
+    assert "Pipelining is only possible without relevance training" in capsys.readouterr().out
+
+
+def test_async_router_extracts_shards(
+    create_async_router,
+    project_paths: ProjectPaths,
+    job_server: JobServerStandIn,
+    tmp_path: Path,
+    capsys: CaptureFixture[str],
+):
+    for i in range(5):
+        (tmp_path / f"report_{i}.pdf").write_bytes(b"0" * (10 if i != 2 else 100))
+    async_router = create_async_router(request_retries=0)
+    async_router._main_settings.extraction.shard_bytes = 30
+    job_server.number_responses_failing["extract"] = 1
+
+    with patch.object(project_paths, "path_folder_source_pdf", tmp_path):
+        asyncio.run(async_router.run_router_async())
+
+    assert async_router.return_value is True
+    assert "Retrying 1 failed extraction shards." in capsys.readouterr().out
+    list_shards = [payload["documents"] for node, payload in job_server.payloads_received if node == "extract"]
+    assert sorted(list_shards) == [["report_0.pdf", "report_1.pdf"], ["report_2.pdf"], ["report_3.pdf", "report_4.pdf"]]
+    assert job_server.nodes_requested().count("curate") == 1
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from osc_extraction_utils.s3_communication import AsyncS3Communication, S3FileType
+
+
+def test_download_file_from_s3_many_in_flight(async_s3_communication_fake: AsyncS3Communication, tmp_path: Path):
+    s3_client = async_s3_communication_fake.s3_communication.s3_client
+    number_files = 200
+    for i in range(number_files):
+        s3_client.put_object(Bucket="bucket", Key=f"prefix/file_{i}", Body=f"content {i}")
+    path_folder_destination = tmp_path / "async_download"
+    path_folder_destination.mkdir()
+
+    download_fileobj = s3_client.download_fileobj
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+
+    def download_fileobj_slow(*args, **kwargs):
+        with lock:
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        time.sleep(0.2)
+        download_fileobj(*args, **kwargs)
+        with lock:
+            in_flight["current"] -= 1
+
+    s3_client.download_fileobj = download_fileobj_slow
+
+    async def download_all():
+        await asyncio.gather(
+            *[
+                async_s3_communication_fake.download_file_from_s3(
+                    path_folder_destination / f"file_{i}", "prefix", f"file_{i}"
+                )
+                for i in range(number_files)
+            ]
+        )
+
+    asyncio.run(download_all())
+
+    assert in_flight["max"] > 100
+    assert (path_folder_destination / "file_42").read_text() == "content 42"
+
+
+def test_upload_and_download_df(async_s3_communication_fake: AsyncS3Communication):
+    df = pd.DataFrame({"company": ["A", "B"], "answer": [1.0, 2.5]})
+
+    async def upload_and_download():
+        await async_s3_communication_fake.upload_df_to_s3(df, "prefix", "df.csv", S3FileType.CSV, index=False)
+        return await async_s3_communication_fake.download_df_from_s3("prefix", "df.csv", S3FileType.CSV)
+
+    df_downloaded = asyncio.run(upload_and_download())
+
+    pd.testing.assert_frame_equal(df_downloaded, df)
+
+
+def test_transfer_files_between_dir_and_prefix(async_s3_communication_fake: AsyncS3Communication, tmp_path: Path):
+    path_folder_source = tmp_path / "async_upload"
+    (path_folder_source / "sub").mkdir(parents=True)
+    (path_folder_source / "file.csv").write_text("file")
+    (path_folder_source / "sub" / "file_sub.csv").write_text("file_sub")
+    path_folder_destination = tmp_path / "async_download_prefix"
+
+    async def upload_and_download():
+        async with async_s3_communication_fake:
+            await async_s3_communication_fake.upload_files_in_dir_to_prefix(path_folder_source, "prefix")
+            await async_s3_communication_fake.download_files_in_prefix_to_dir(
+                "prefix", path_folder_destination, max_workers=2
+            )
+
+    asyncio.run(upload_and_download())
+
+    assert (path_folder_destination / "file.csv").read_text() == "file"
+    assert (path_folder_destination / "sub" / "file_sub.csv").read_text() == "file_sub"
+
+
+def test_exit_does_not_block_event_loop(async_s3_communication_fake: AsyncS3Communication, tmp_path: Path):
+    s3_client = async_s3_communication_fake.s3_communication.s3_client
+    s3_client.put_object(Bucket="bucket", Key="prefix/file", Body="content")
+    download_fileobj = s3_client.download_fileobj
+
+    def download_fileobj_slow(*args, **kwargs):
+        time.sleep(0.5)
+        download_fileobj(*args, **kwargs)
+
+    s3_client.download_fileobj = download_fileobj_slow
+    list_ticks: list[float] = []
+
+    async def tick():
+        for _ in range(5):
+            list_ticks.append(time.perf_counter())
+            await asyncio.sleep(0.05)
+
+    async def download_while_ticking():
+        task_tick = asyncio.ensure_future(tick())
+        async with async_s3_communication_fake:
+            task_download = asyncio.ensure_future(
+                async_s3_communication_fake.download_file_from_s3(tmp_path / "file", "prefix", "file")
+            )
+            await asyncio.sleep(0)
+            time_exit = time.perf_counter()
+        time_exited = time.perf_counter()
+        await asyncio.gather(task_download, task_tick)
+        return time_exit, time_exited
+
+    time_exit, time_exited = asyncio.run(download_while_ticking())
+
+    assert (tmp_path / "file").read_text() == "content"
+    assert any(time_exit < time_tick < time_exited for time_tick in list_ticks)
@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+from osc_extraction_utils.checkpoints import (
+    CheckpointStore,
+    create_fingerprint,
+    create_folder_manifest,
+)
+
+
+def test_checkpoint_store_persists_fingerprints(tmp_path: Path):
+    path_file_checkpoints = tmp_path / "checkpoints" / "checkpoints.json"
+    checkpoint_store = CheckpointStore(path_file_checkpoints)
+    assert not checkpoint_store.is_completed("extract", "fingerprint")
+
+    checkpoint_store.mark_completed("extract", "fingerprint")
+    checkpoint_store.mark_completed("curate", "fingerprint_curate")
+    checkpoint_store.invalidate("curate")
+    checkpoint_store.invalidate("train_kpi")
+
+    checkpoint_store_reloaded = CheckpointStore(path_file_checkpoints)
+    assert checkpoint_store_reloaded.is_completed("extract", "fingerprint")
+    assert not checkpoint_store_reloaded.is_completed("extract", "other_fingerprint")
+    assert not checkpoint_store_reloaded.is_completed("curate", "fingerprint_curate")
+    assert list(path_file_checkpoints.parent.iterdir()) == [path_file_checkpoints]
+
+
+def test_checkpoint_store_ignores_corrupt_file(tmp_path: Path):
+    path_file_checkpoints = tmp_path / "checkpoints.json"
+    path_file_checkpoints.write_text("{not json")
+
+    assert not CheckpointStore(path_file_checkpoints).is_completed("extract", "fingerprint")
+
+
+def test_create_folder_manifest(tmp_path: Path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / ".hidden").mkdir()
+    (tmp_path / "a.pdf").write_text("a")
+    (tmp_path / "sub" / "b.pdf").write_text("bb")
+    (tmp_path / ".hidden" / "c.pdf").write_text("c")
+    (tmp_path / ".d.pdf").write_text("d")
+
+    list_manifest = create_folder_manifest(tmp_path)
+
+    assert [(path, size) for path, size, _ in list_manifest] == [("a.pdf", 1), ("sub/b.pdf", 2)]
+    fingerprint = create_fingerprint("extract", list_manifest)
+    os.utime(tmp_path / "a.pdf", ns=(0, 0))
+    assert create_fingerprint("extract", create_folder_manifest(tmp_path)) != fingerprint
+    assert create_folder_manifest(tmp_path / "missing") == []
@@ -11,6 +11,10 @@ from osc_extraction_utils.core_utils import (
     copy_file_without_overwrite,
     create_folder,
 )
+from osc_extraction_utils.s3_communication import (
+    SYNC_MANIFEST_FILE_NAME,
+    S3Communication,
+)
 
 
 @pytest.fixture()
@@ -118,6 +122,33 @@ def test_copy_file_without_overwrite_file_not_exists(
     assert path_folder_destination_file.exists()
 
 
+def test_copy_file_without_overwrite_skips_sync_manifest(
+    prerequisites_copy_file_without_overwrite, path_folder_temporary: Path, s3_communication_fake: S3Communication
+):
+    path_folder_source = path_folder_temporary / "source"
+    path_folder_destination = path_folder_temporary / "destination"
+    s3_communication_fake.s3_client.put_object(Bucket="bucket", Key="prefix/test.txt", Body="content")
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix", str(path_folder_source), incremental=True)
+    assert (path_folder_source / SYNC_MANIFEST_FILE_NAME).exists()
+
+    copy_file_without_overwrite(str(path_folder_source), str(path_folder_destination))
+
+    assert [path.name for path in path_folder_destination.iterdir()] == ["test.txt"]
+
+
+def test_copy_file_without_overwrite_copies_sub_directories(
+    prerequisites_copy_file_without_overwrite, path_folder_temporary: Path
+):
+    path_folder_source = path_folder_temporary / "source"
+    path_folder_destination = path_folder_temporary / "destination"
+    (path_folder_source / "sub").mkdir()
+    (path_folder_source / "sub" / "test.txt").write_text("content")
+
+    copy_file_without_overwrite(str(path_folder_source), str(path_folder_destination))
+
+    assert (path_folder_destination / "sub" / "test.txt").read_text() == "content"
+
+
 def test_delete_file(path_folder_temporary: Path):
     path_file_temporary = path_folder_temporary / "test.txt"
     path_file_temporary.touch()
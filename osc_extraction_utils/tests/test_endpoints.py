@@ -0,0 +1,55 @@
+import pytest
+
+from osc_extraction_utils.endpoints import EndpointPool, get_server_addresses
+
+
+def test_get_server_addresses():
+    assert get_server_addresses([], "0.0.0.0", 8000) == ["http://0.0.0.0:8000"]
+    assert get_server_addresses(["0.0.0.1:6000", "https://gpu:6000"], "0.0.0.0", 8000) == [
+        "http://0.0.0.1:6000",
+        "https://gpu:6000",
+    ]
+
+
+def test_endpoint_pool_dispatches_to_least_outstanding():
+    endpoint_pool = EndpointPool(["a", "b", "c"])
+
+    list_endpoints = [endpoint_pool.acquire() for _ in range(3)]
+    assert list_endpoints == ["a", "b", "c"]
+    endpoint_pool.release("b")
+    assert endpoint_pool.acquire() == "b"
+    endpoint_pool.release("a")
+    endpoint_pool.release("c")
+    assert [endpoint_pool.acquire(), endpoint_pool.acquire()] == ["c", "a"]
+    assert endpoint_pool.dict_outstanding == {"a": 1, "b": 1, "c": 1}
+
+
+def test_endpoint_pool_dispatches_round_robin():
+    endpoint_pool = EndpointPool(["a", "b"], dispatch="round_robin")
+
+    for _ in range(3):
+        with endpoint_pool.endpoint():
+            pass
+    assert endpoint_pool.acquire() == "b"
+    assert endpoint_pool.acquire() == "a"
+    assert endpoint_pool.dict_outstanding == {"a": 1, "b": 1}
+
+
+def test_endpoint_pool_ejects_endpoints():
+    endpoint_pool = EndpointPool(["a", "b"], dispatch="round_robin", ejection_time=60.0)
+
+    endpoint_pool.eject("a")
+    assert endpoint_pool.is_ejected("a")
+    assert [endpoint_pool.acquire() for _ in range(3)] == ["b", "b", "b"]
+    endpoint_pool.eject("b")
+    assert endpoint_pool.acquire() in ("a", "b")
+
+    endpoint_pool.ejection_time = 0.0
+    endpoint_pool.eject("a")
+    endpoint_pool.eject("b")
+    assert not endpoint_pool.is_ejected("a")
+
+
+def test_endpoint_pool_needs_server_addresses():
+    with pytest.raises(ValueError):
+        EndpointPool([])
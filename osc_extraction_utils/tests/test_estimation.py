@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from osc_extraction_utils.estimation import (
+    PDF_PAGE_PATTERN,
+    StageHistory,
+    collect_input_statistics,
+    count_pdf_pages,
+    estimate_stage,
+    get_stage_input_units,
+    load_stage_history,
+)
+from osc_extraction_utils.settings import MainSettings
+
+
+@pytest.fixture
+def path_folder_data_test(path_folder_root_testing: Path) -> Path:
+    return path_folder_root_testing / "data" / "TEST" / "input"
+
+
+def test_collect_input_statistics(path_folder_data_test: Path):
+    input_statistics = collect_input_statistics(
+        path_folder_data_test / "pdfs" / "training",
+        path_folder_data_test / "annotations",
+        path_folder_data_test / "kpi_mapping",
+    )
+
+    assert input_statistics.number_pdfs == 1
+    assert input_statistics.number_pdf_pages == count_pdf_pages(
+        path_folder_data_test / "pdfs" / "training" / "Test.pdf"
+    )
+    assert input_statistics.number_pdf_pages > 0
+    assert input_statistics.pdf_bytes == (path_folder_data_test / "pdfs" / "training" / "Test.pdf").stat().st_size
+    assert input_statistics.number_annotation_rows == 6
+    assert input_statistics.number_kpi_mapping_rows == 7
+
+
+def test_count_pdf_pages_in_chunks(tmp_path: Path):
+    path_file_pdf = tmp_path / "report.pdf"
+    content = b"%PDF /Type /Page /Type/Pages /Type" + b" " * 32 + b"/Page\n" + b"x /Type  /Page " * 20 + b"/Type /Page"
+    path_file_pdf.write_bytes(content)
+
+    number_pages = len(PDF_PAGE_PATTERN.findall(content))
+    assert number_pages == 23
+    assert [count_pdf_pages(path_file_pdf, read_size) for read_size in (1, 7, 50, 1024)] == [number_pages] * 4
+
+
+def test_get_stage_input_units():
+    main_settings = MainSettings()
+    main_settings.train_kpi.training.run_cv = True
+
+    assert get_stage_input_units("extract", main_settings, 3, 10, 4) == 3
+    assert get_stage_input_units("curate", main_settings, 3, 10, 4) == 14
+    assert get_stage_input_units("train_relevance", main_settings, 3, 10, 4) == 10 * 10
+    assert get_stage_input_units("train_kpi", main_settings, 3, 10, 4) == 10 * 10 * 5
+    assert get_stage_input_units("liveness", main_settings, 3, 10, 4) is None
+
+
+def test_load_stage_history(tmp_path: Path):
+    path_file_metrics = tmp_path / "spans.jsonl"
+    list_spans = [
+        {"stage": "extract", "duration": 4.0, "payload_bytes": 100, "documents_processed": 2, "succeeded": True},
+        {"stage": "extract", "duration": 2.0, "payload_bytes": 100, "documents_processed": None, "succeeded": True},
+        {"stage": "extract", "duration": 60.0, "payload_bytes": 100, "documents_processed": 1, "succeeded": False},
+        {"stage": "curate", "duration": 3.0, "payload_bytes": 50, "input_units": 12, "succeeded": True},
+    ]
+    path_file_metrics.write_text("\n".join(json.dumps(dict_span) for dict_span in list_spans) + "\n\n")
+
+    dict_history = load_stage_history(path_file_metrics)
+
+    assert dict_history == {
+        "extract": StageHistory(
+            number_spans=2, seconds=6.0, payload_bytes=200, number_documents=2, seconds_documents=4.0
+        ),
+        "curate": StageHistory(
+            number_spans=1, seconds=3.0, payload_bytes=50, number_input_units=12, seconds_input_units=3.0
+        ),
+    }
+    assert load_stage_history(tmp_path / "missing.jsonl") == {}
+
+
+def test_estimate_stage():
+    stage_history = StageHistory(
+        number_spans=2, seconds=6.0, payload_bytes=200, number_documents=2, seconds_documents=4.0
+    )
+
+    stage_estimate = estimate_stage("extract", stage_history, 10, number_requests=4, input_bytes=1000, parallelism=2)
+    assert stage_estimate.seconds == pytest.approx(10.0)
+    assert stage_estimate.transfer_bytes == 1400
+    stage_estimate = estimate_stage("curate", stage_history, 10)
+    assert stage_estimate.seconds == pytest.approx(3.0)
+    assert stage_estimate.basis == "mean of 2 runs"
+    stage_history = StageHistory(number_spans=2, seconds=6.0, number_input_units=200, seconds_input_units=4.0)
+    stage_estimate = estimate_stage("train_kpi", stage_history, 10, input_units=1000)
+    assert stage_estimate.seconds == pytest.approx(20.0)
+    assert stage_estimate.basis == "0.02 s per row epoch from 200 row epochs"
+    stage_estimate = estimate_stage("train_kpi", stage_history, 10)
+    assert stage_estimate.seconds == pytest.approx(3.0)
+    stage_estimate = estimate_stage("train_kpi", None, 10, input_bytes=5)
+    assert stage_estimate.seconds is None and stage_estimate.transfer_bytes == 5
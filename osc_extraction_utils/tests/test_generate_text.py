@@ -1,9 +1,19 @@
+import os
 from pathlib import Path
 from unittest.mock import Mock, patch
 
+import pandas as pd
+import pytest
 from _pytest.capture import CaptureFixture
 
-from osc_extraction_utils.merger import generate_text_3434
+from osc_extraction_utils.conftest import write_to_file
+from osc_extraction_utils.exceptions import CsvHeaderMismatchError
+from osc_extraction_utils.merger import (
+    TEXT_3434_MANIFEST_FILE_NAME,
+    generate_text_3434,
+    merge_csv_files,
+    merge_csv_files_to_parquet,
+)
 from osc_extraction_utils.paths import ProjectPaths
 from osc_extraction_utils.s3_communication import S3Communication
 from osc_extraction_utils.settings import S3Settings
@@ -163,7 +173,7 @@ def test_generate_text_not_successful_exception(
             file.unlink()
 
     # patch glob.iglob to force an exception...
-    with patch("osc_extraction_utils.merger.glob.iglob", side_effect=lambda *args: [None]):
+    with patch("osc_extraction_utils.merger.glob.iglob", side_effect=lambda *args, **kwargs: [None]):
         return_value = generate_text_3434(
             project_name=project_name,
             s3_usage=s3_usage,
@@ -172,3 +182,416 @@ def test_generate_text_not_successful_exception(
         )
 
         assert return_value is False
+
+
+def test_merge_csv_files_copies_in_blocks(tmp_path: Path):
+    """Tests if the merged file is correct when the files are larger than the copy buffer and
+    a file misses the trailing newline
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_folder_merge = tmp_path
+    list_paths_files = []
+    for i in range(3):
+        path_file = path_folder_merge / f"{i}_test.csv"
+        path_file.write_text("HEADER\n" + "".join(f"row {i} {j}\n" for j in range(100)) + f"last row {i}")
+        list_paths_files.append(path_file)
+    path_file_out = path_folder_merge / "merged.csv"
+
+    merge_csv_files(list_paths_files, path_file_out, buffer_size=7)
+
+    lines_expected = ["HEADER"]
+    for i in range(3):
+        lines_expected += [f"row {i} {j}" for j in range(100)] + [f"last row {i}"]
+    assert path_file_out.read_text().splitlines() == lines_expected
+
+
+def test_generate_text_parquet(
+    prerequisites_generate_text, path_folder_temporary: Path, project_paths: ProjectPaths, s3_settings: S3Settings
+):
+    """Tests if the relevance files are merged into text_3434.parquet with one row group per file and
+    dictionary-encoded string columns
+    Requesting prerequisites_generate_text automatically (autouse)
+
+    :param path_folder_temporary: Requesting the path_folder_temporary fixture
+    :type path_folder_temporary: Path
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    pa = pytest.importorskip("pyarrow")
+    path_folder_relevance = path_folder_temporary / "relevance"
+    for i in range(5):
+        write_to_file(path_folder_relevance / f"{i}_test.csv", f"{i},paragraph {i}", "page,text")
+
+    return_value = generate_text_3434("test", False, s3_settings, project_paths=project_paths, file_format="parquet")
+
+    assert return_value is True
+    file_parquet = pq.ParquetFile(path_folder_temporary / "folder_test_3434" / "text_3434.parquet")
+    assert file_parquet.num_row_groups == 5
+    assert file_parquet.schema_arrow.field("text").type == pa.dictionary(pa.int32(), pa.string())
+    df_text_3434 = file_parquet.read().to_pandas()
+    assert sorted(df_text_3434["page"]) == list(range(5))
+    assert sorted(df_text_3434["text"]) == [f"paragraph {i}" for i in range(5)]
+
+
+def test_generate_text_unknown_file_format(project_paths: ProjectPaths, s3_settings: S3Settings):
+    with pytest.raises(ValueError):
+        generate_text_3434("test", False, s3_settings, project_paths=project_paths, file_format="xlsx")
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_merge_csv_files_keeps_order(tmp_path: Path, max_workers: int):
+    """Tests if the files are merged in the given order with reading ahead, streaming of files larger
+    than the buffer and skipping of empty files
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    list_paths_files = []
+    lines_expected = ["HEADER"]
+    for i in range(50):
+        path_file = tmp_path / f"{i:02d}_test.csv"
+        number_rows = 1 if i % 2 else 20
+        path_file.write_text("HEADER\n" + "".join(f"row {i} {j}\n" for j in range(number_rows)))
+        lines_expected += [f"row {i} {j}" for j in range(number_rows)]
+        list_paths_files.append(path_file)
+    (tmp_path / "empty.csv").touch()
+    list_paths_files.insert(10, tmp_path / "empty.csv")
+    path_file_out = tmp_path / "merged.csv"
+
+    merge_csv_files(list_paths_files, path_file_out, buffer_size=64, max_workers=max_workers)
+
+    assert path_file_out.read_text().splitlines() == lines_expected
+
+
+def test_merge_csv_files_different_header(tmp_path: Path):
+    """Tests if a file with a different header raises an error
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    write_to_file(tmp_path / "0_test.csv", "content", "HEADER")
+    write_to_file(tmp_path / "1_test.csv", "content", "OTHER_HEADER")
+
+    with pytest.raises(ValueError, match="1_test.csv"):
+        merge_csv_files([tmp_path / "0_test.csv", tmp_path / "1_test.csv"], tmp_path / "merged.csv", max_workers=2)
+
+
+@pytest.mark.parametrize("buffer_size", [5, 1024])
+def test_merge_csv_files_reorders_columns(tmp_path: Path, buffer_size: int):
+    """Tests if a file with the same columns in another order is aligned to the columns of the first
+    file, also for quoted values spanning several lines and blocks
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    (tmp_path / "0_test.csv").write_text("page,text,pdf_name\n0,first,a.pdf\n")
+    (tmp_path / "1_test.csv").write_text('pdf_name,page,text\nb.pdf,1,"multi\nline, äöü"\nc.pdf,2,last')
+    (tmp_path / "2_test.csv").write_text("page,text,pdf_name\n3,raw,d.pdf\n")
+    path_file_out = tmp_path / "merged.csv"
+
+    merge_csv_files(sorted(tmp_path.glob("*_test.csv")), path_file_out, buffer_size=buffer_size, max_workers=2)
+
+    df_merged = pd.read_csv(path_file_out)
+    assert list(df_merged.columns) == ["page", "text", "pdf_name"]
+    assert df_merged.values.tolist() == [
+        [0, "first", "a.pdf"],
+        [1, "multi\nline, äöü", "b.pdf"],
+        [2, "last", "c.pdf"],
+        [3, "raw", "d.pdf"],
+    ]
+
+
+def test_merge_csv_files_reports_all_mismatches(tmp_path: Path):
+    """Tests if all files with other columns are reported before anything is written
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    write_to_file(tmp_path / "0_test.csv", "0,text", "page,text")
+    write_to_file(tmp_path / "1_test.csv", "0", "page")
+    write_to_file(tmp_path / "2_test.csv", "text,0", "text,page")
+    write_to_file(tmp_path / "3_test.csv", "0,text,a.pdf", "page,text,pdf_name")
+    path_file_out = tmp_path / "merged.csv"
+
+    with pytest.raises(CsvHeaderMismatchError) as exception_info:
+        merge_csv_files(sorted(tmp_path.glob("*_test.csv")), path_file_out)
+
+    assert exception_info.value.mismatches == {
+        str(tmp_path / "1_test.csv"): "missing columns ['text'], unexpected columns []",
+        str(tmp_path / "3_test.csv"): "missing columns [], unexpected columns ['pdf_name']",
+    }
+    assert not path_file_out.exists()
+
+
+def test_merge_csv_files_to_parquet_aligns_columns(tmp_path: Path):
+    """Tests if the parquet merge aligns reordered columns by name and rejects other columns
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_to_file(tmp_path / "0_test.csv", "0,first", "page,text")
+    write_to_file(tmp_path / "1_test.csv", "second,1", "text,page")
+    path_file_out = tmp_path / "merged.parquet"
+
+    merge_csv_files_to_parquet(sorted(tmp_path.glob("*_test.csv")), path_file_out)
+
+    assert pq.read_table(path_file_out).to_pydict() == {"page": [0, 1], "text": ["first", "second"]}
+
+    write_to_file(tmp_path / "2_test.csv", "0", "page")
+    with pytest.raises(CsvHeaderMismatchError, match="2_test.csv"):
+        merge_csv_files_to_parquet(sorted(tmp_path.glob("*_test.csv")), tmp_path / "other.parquet")
+    assert not (tmp_path / "other.parquet").exists()
+
+
+def test_merge_csv_files_to_parquet_numeric_first_file(tmp_path: Path):
+    """Tests if a first file with a numeric text, an integer score and an integer column does not fix types,
+    which the next files cannot be converted to
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_to_file(tmp_path / "0_test.csv", "0,2019,1,7", "page,text,score,number")
+    write_to_file(tmp_path / "1_test.csv", "1,Scope 1 emissions,0.25,7.5", "page,text,score,number")
+    path_file_out = tmp_path / "merged.parquet"
+
+    merge_csv_files_to_parquet(sorted(tmp_path.glob("*_test.csv")), path_file_out)
+
+    assert pq.read_table(path_file_out).to_pydict() == {
+        "page": [0, 1],
+        "text": ["2019", "Scope 1 emissions"],
+        "score": [1.0, 0.25],
+        "number": [7.0, 7.5],
+    }
+
+
+def test_merge_csv_files_to_parquet_skips_files_without_rows(tmp_path: Path):
+    """Tests if empty and header-only files are skipped and the types are inferred from the first file with rows
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    (tmp_path / "0_test.csv").touch()
+    (tmp_path / "1_test.csv").write_text(",kpi_id,pred,text\n")
+    write_to_file(tmp_path / "2_test.csv", "0,3,1,Scope 1 emissions", ",kpi_id,pred,text")
+    path_file_out = tmp_path / "merged.parquet"
+
+    merge_csv_files_to_parquet(sorted(tmp_path.glob("*_test.csv")), path_file_out)
+
+    table = pq.read_table(path_file_out)
+    assert table.to_pydict() == {"": [0.0], "kpi_id": [3.0], "pred": [1.0], "text": ["Scope 1 emissions"]}
+    assert all(pa.types.is_floating(table.schema.field(column).type) for column in ["", "kpi_id", "pred"])
+
+    # without any rows an empty file with the columns of the first header is written
+    merge_csv_files_to_parquet(sorted(tmp_path.glob("*_test.csv"))[:2], path_file_out)
+    assert pq.read_table(path_file_out).to_pydict() == {"": [], "kpi_id": [], "pred": [], "text": []}
+
+
+def test_generate_text_parquet_skips_empty_file(project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path):
+    """Tests if an empty relevance file does not fail the generation of text_3434.parquet
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    pq = pytest.importorskip("pyarrow.parquet")
+    path_folder_relevance = tmp_path / "relevance"
+    path_folder_relevance.mkdir()
+    (path_folder_relevance / "0_test.csv").touch()
+    write_to_file(path_folder_relevance / "1_test.csv", "0,first", "page,text")
+
+    with (
+        patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+        patch.object(project_paths, "path_folder_text_3434", tmp_path),
+    ):
+        assert generate_text_3434("test", False, s3_settings, project_paths=project_paths, file_format="parquet")
+
+    assert pq.read_table(tmp_path / "text_3434.parquet").to_pydict() == {"page": [0], "text": ["first"]}
+
+
+def test_generate_text_incremental(project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path):
+    """Tests if only new relevance files are appended to text_3434.csv and if it is rebuilt when a merged
+    file was changed or removed
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_folder_relevance = tmp_path / "relevance"
+    path_folder_relevance.mkdir()
+    path_file_text_3434 = tmp_path / "text_3434.csv"
+    for i in range(5):
+        write_to_file(path_folder_relevance / f"{i}_test.csv", f"That is a test {i}", "HEADER")
+
+    def generate_text_3434_incremental() -> list[list]:
+        with (
+            patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+            patch.object(project_paths, "path_folder_text_3434", tmp_path),
+            patch("osc_extraction_utils.merger.merge_csv_files", wraps=merge_csv_files) as mocked_merge,
+        ):
+            assert generate_text_3434("test", False, s3_settings, project_paths=project_paths, incremental=True)
+        return [[Path(path_file).name for path_file in call.args[0]] for call in mocked_merge.call_args_list]
+
+    assert generate_text_3434_incremental() == [[f"{i}_test.csv" for i in range(5)]]
+    assert (tmp_path / TEXT_3434_MANIFEST_FILE_NAME).exists()
+
+    # nothing new, then only the new file is appended
+    assert generate_text_3434_incremental() == [[]]
+    write_to_file(path_folder_relevance / "5_test.csv", "That is a test 5", "HEADER")
+    assert generate_text_3434_incremental() == [["5_test.csv"]]
+    assert path_file_text_3434.read_text().splitlines() == ["HEADER"] + [f"That is a test {i}" for i in range(6)]
+
+    # a touched file with the same content is not merged again and its new mtime is stored, so it is hashed once
+    os.utime(path_folder_relevance / "0_test.csv", ns=(0, 0))
+    assert generate_text_3434_incremental() == [[]]
+    with patch("osc_extraction_utils.merger._create_text_3434_manifest_entry") as mocked_create_manifest_entry:
+        assert generate_text_3434_incremental() == [[]]
+    mocked_create_manifest_entry.assert_not_called()
+
+    # changed and removed files lead to a rebuild
+    write_to_file(path_folder_relevance / "1_test.csv", "That is a changed test 1", "HEADER")
+    assert generate_text_3434_incremental() == [[f"{i}_test.csv" for i in range(6)]]
+    assert "That is a changed test 1" in path_file_text_3434.read_text().splitlines()
+    (path_folder_relevance / "2_test.csv").unlink()
+    assert generate_text_3434_incremental() == [["0_test.csv", "1_test.csv", "3_test.csv", "4_test.csv", "5_test.csv"]]
+
+    # a modified text_3434.csv leads to a rebuild
+    with open(path_file_text_3434, "a") as file_text_3434:
+        file_text_3434.write("modified\n")
+    assert len(generate_text_3434_incremental()[0]) == 5
+    assert "modified" not in path_file_text_3434.read_text()
+
+
+def test_generate_text_includes_sub_directories(project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path):
+    """Tests if the relevance files in sub-directories, downloaded from sub-prefixes, are merged as well
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_folder_relevance = tmp_path / "relevance"
+    (path_folder_relevance / "sub").mkdir(parents=True)
+    write_to_file(path_folder_relevance / "0_test.csv", "That is a test 0", "HEADER")
+    write_to_file(path_folder_relevance / "sub" / "1_test.csv", "That is a test 1", "HEADER")
+
+    with (
+        patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+        patch.object(project_paths, "path_folder_text_3434", tmp_path),
+    ):
+        assert generate_text_3434("test", False, s3_settings, project_paths=project_paths)
+
+    assert (tmp_path / "text_3434.csv").read_text().splitlines() == ["HEADER", "That is a test 0", "That is a test 1"]
+
+
+def test_generate_text_incremental_unreadable_file(
+    project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path
+):
+    """Tests if an error while checking the merged files returns False instead of raising
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_folder_relevance = tmp_path / "relevance"
+    path_folder_relevance.mkdir()
+    write_to_file(path_folder_relevance / "0_test.csv", "That is a test 0", "HEADER")
+
+    with (
+        patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+        patch.object(project_paths, "path_folder_text_3434", tmp_path),
+    ):
+        assert generate_text_3434("test", False, s3_settings, project_paths=project_paths, incremental=True)
+        os.utime(path_folder_relevance / "0_test.csv", ns=(0, 0))
+        with patch("osc_extraction_utils.merger.open", side_effect=PermissionError("unreadable")):
+            return_value = generate_text_3434("test", False, s3_settings, project_paths=project_paths, incremental=True)
+
+    assert return_value is False
+
+
+def test_generate_text_full_rebuild_does_not_hash(project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path):
+    """Tests if the relevance files are not hashed and no manifest is written without incremental
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_folder_relevance = tmp_path / "relevance"
+    path_folder_relevance.mkdir()
+    for i in range(3):
+        write_to_file(path_folder_relevance / f"{i}_test.csv", f"That is a test {i}", "HEADER")
+
+    with (
+        patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+        patch.object(project_paths, "path_folder_text_3434", tmp_path),
+        patch("osc_extraction_utils.merger._create_text_3434_manifest_entry") as mocked_create_manifest_entry,
+    ):
+        assert generate_text_3434("test", False, s3_settings, project_paths=project_paths, max_workers=2)
+
+    mocked_create_manifest_entry.assert_not_called()
+    assert not (tmp_path / TEXT_3434_MANIFEST_FILE_NAME).exists()
+    assert (tmp_path / "text_3434.csv").read_text().splitlines() == ["HEADER"] + [
+        f"That is a test {i}" for i in range(3)
+    ]
+
+
+def test_merge_csv_files_append_reconciles_with_existing_header(tmp_path: Path):
+    """Tests if appended files are reconciled with the header of the existing file and separated by a newline
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    path_file_out = tmp_path / "merged.csv"
+    path_file_out.write_text("page,text\n0,first")
+    (tmp_path / "1_test.csv").write_text("text,page\nsecond,1\n")
+
+    merge_csv_files([tmp_path / "1_test.csv"], path_file_out, append=True)
+
+    assert path_file_out.read_text().splitlines() == ["page,text", "0,first", "1,second"]
+
+
+@pytest.mark.parametrize("compression, extension", [("gzip", ".gz"), ("zstd", ".zst")])
+def test_generate_text_compressed(
+    project_paths: ProjectPaths, s3_settings: S3Settings, tmp_path: Path, compression: str, extension: str
+):
+    """Tests if text_3434.csv is compressed while merging and named after the compression
+
+    :param tmp_path: Requesting the default tmp_path fixture
+    :type tmp_path: Path
+    """
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    path_folder_relevance = tmp_path / "relevance"
+    path_folder_relevance.mkdir()
+    for i in range(3):
+        write_to_file(path_folder_relevance / f"{i}_test.csv", f"{i},That is a test {i}", "page,text")
+
+    with (
+        patch.object(project_paths, "path_folder_relevance", path_folder_relevance),
+        patch.object(project_paths, "path_folder_text_3434", tmp_path),
+    ):
+        assert generate_text_3434(
+            "test", False, s3_settings, project_paths=project_paths, compression=compression, incremental=True
+        )
+
+    df_text_3434 = pd.read_csv(tmp_path / f"text_3434.csv{extension}", compression=compression)
+    assert df_text_3434["text"].tolist() == [f"That is a test {i}" for i in range(3)]
+    assert not (tmp_path / TEXT_3434_MANIFEST_FILE_NAME).exists()
+
+
+def test_generate_text_unknown_compression(project_paths: ProjectPaths, s3_settings: S3Settings):
+    with pytest.raises(ValueError):
+        generate_text_3434("test", False, s3_settings, project_paths=project_paths, compression="bz2")
+
+
+def test_merge_csv_files_to_parquet_compression(tmp_path: Path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    write_to_file(tmp_path / "0_test.csv", "0,first", "page,text")
+    path_file_out = tmp_path / "merged.parquet"
+
+    merge_csv_files_to_parquet([tmp_path / "0_test.csv"], path_file_out, compression="zstd")
+
+    assert pq.ParquetFile(path_file_out).metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+def test_merge_csv_files_append_compressed(tmp_path: Path):
+    with pytest.raises(ValueError):
+        merge_csv_files([], tmp_path / "merged.csv.gz", append=True, compression="gzip")
@@ -0,0 +1,54 @@
+import time
+
+from osc_extraction_utils.conftest import JobServerStandIn
+from osc_extraction_utils.health import ServerHealthCache
+
+
+def count_liveness_probes(job_server: JobServerStandIn) -> int:
+    return sum(path == "/liveness" for path, _ in job_server.requests)
+
+
+def test_server_health_cache_probes_once_per_ttl(job_server: JobServerStandIn):
+    server_address = f"http://{job_server.ip}:{job_server.port}"
+    server_address_down = "http://127.0.0.1:1"
+    health_cache = ServerHealthCache(ttl=60.0, timeout=1.0)
+
+    dict_health = health_cache.check([server_address, server_address_down, server_address])
+    assert dict_health == {server_address: True, server_address_down: False}
+    assert health_cache.check([server_address]) == {server_address: True}
+    assert count_liveness_probes(job_server) == 1
+
+    job_server.number_responses_failing["liveness"] = 1
+    health_cache.invalidate(server_address)
+    assert health_cache.check([server_address]) == {server_address: False}
+    health_cache.ttl = 0.0
+    assert health_cache.check([server_address]) == {server_address: True}
+    assert count_liveness_probes(job_server) == 3
+
+
+def test_server_health_cache_probes_concurrently(job_server: JobServerStandIn):
+    list_server_addresses = [f"http://{job_server.ip}:{job_server.port}/server_{i}" for i in range(4)]
+    job_server.delays.update({f"server_{i}/liveness": 0.2 for i in range(4)})
+    health_cache = ServerHealthCache()
+
+    time_start = time.perf_counter()
+    dict_health = health_cache.check(list_server_addresses)
+
+    assert time.perf_counter() - time_start < 0.6
+    assert dict_health == {server_address: True for server_address in list_server_addresses}
+
+
+def test_server_health_cache_refreshes_in_background(job_server: JobServerStandIn):
+    server_address = f"http://{job_server.ip}:{job_server.port}"
+    health_cache = ServerHealthCache(ttl=60.0, refresh_interval=0.01)
+    health_cache.check([server_address])
+
+    with health_cache:
+        time_end = time.monotonic() + 5
+        while count_liveness_probes(job_server) < 3 and time.monotonic() < time_end:
+            time.sleep(0.01)
+    number_probes = count_liveness_probes(job_server)
+    time.sleep(0.05)
+
+    assert number_probes >= 3
+    assert count_liveness_probes(job_server) == number_probes
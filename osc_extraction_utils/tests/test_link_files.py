@@ -4,7 +4,15 @@ from typing import Generator
 
 import pytest
 
-from osc_extraction_utils.utils import link_extracted_files, link_files
+from osc_extraction_utils.s3_communication import (
+    SYNC_MANIFEST_FILE_NAME,
+    S3Communication,
+)
+from osc_extraction_utils.utils import (
+    copy_file_without_overwrite,
+    link_extracted_files,
+    link_files,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -49,6 +57,33 @@ def test_link_files(path_folder_temporary: Path):
         assert path_current_file.stat().st_nlink == 2
 
 
+@pytest.mark.parametrize("function_transfer", [link_files, copy_file_without_overwrite])
+def test_link_and_copy_files_skip_sync_manifest(
+    path_folder_temporary: Path, s3_communication_fake: S3Communication, function_transfer
+):
+    path_folder_source = path_folder_temporary / "source"
+    path_folder_destination = path_folder_temporary / "destination"
+    s3_communication_fake.s3_client.put_object(Bucket="bucket", Key="prefix/test.txt", Body="content")
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix", str(path_folder_source), incremental=True)
+    assert (path_folder_source / SYNC_MANIFEST_FILE_NAME).exists()
+
+    function_transfer(str(path_folder_source), str(path_folder_destination))
+
+    assert [path.name for path in path_folder_destination.iterdir()] == ["test.txt"]
+
+
+@pytest.mark.parametrize("function_transfer", [link_files, copy_file_without_overwrite])
+def test_link_and_copy_files_keep_sub_directories(path_folder_temporary: Path, function_transfer):
+    path_folder_source = path_folder_temporary / "source"
+    path_folder_destination = path_folder_temporary / "destination"
+    (path_folder_source / "sub").mkdir()
+    (path_folder_source / "sub" / "test.txt").write_text("content")
+
+    function_transfer(str(path_folder_source), str(path_folder_destination))
+
+    assert (path_folder_destination / "sub" / "test.txt").read_text() == "content"
+
+
 def test_link_extracted_files_result(path_folder_temporary: Path):
     """Tests if link_extracted_files returns True if executed
     Requesting path_folders_required_linking automatically (autouse)
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from osc_extraction_utils.metrics import StageMetrics
+
+
+def test_stage_metrics_records_span_if_block_raises():
+    stage_metrics = StageMetrics()
+
+    with pytest.raises(RuntimeError):
+        with stage_metrics.measure("TEST", "extract"):
+            raise RuntimeError()
+
+    (span,) = stage_metrics.list_spans
+    assert span.stage == "extract" and span.succeeded is False
+    assert span.time_end == pytest.approx(span.time_start + span.duration)
+
+
+def test_stage_metrics_exports(tmp_path: Path):
+    stage_metrics = StageMetrics()
+    for project_name, stage, succeeded in [("TEST", "extract", True), ("TEST", "extract", True), ('"A"', "curate", 0)]:
+        with stage_metrics.measure(project_name, stage) as span:
+            span.succeeded = bool(succeeded)
+            span.payload_bytes = 1500000
+            span.documents_processed = 2
+
+    path_file_json_lines = tmp_path / "metrics" / "spans.jsonl"
+    stage_metrics.write_json_lines(path_file_json_lines)
+    stage_metrics.write_json_lines(path_file_json_lines)
+    list_spans = [json.loads(line) for line in path_file_json_lines.read_text().splitlines()]
+    assert len(list_spans) == 6
+    assert list_spans[0]["stage"] == "extract" and list_spans[0]["payload_bytes"] == 1500000
+
+    path_file_prometheus = tmp_path / "metrics" / "router.prom"
+    stage_metrics.write_prometheus(path_file_prometheus)
+    text_prometheus = path_file_prometheus.read_text()
+    assert "# TYPE osc_router_stage_seconds_total counter" in text_prometheus
+    assert 'osc_router_stage_payload_bytes_total{project="TEST",stage="extract",succeeded="true"} 3000000.0' in (
+        text_prometheus
+    )
+    assert 'osc_router_stage_runs_total{project="\\"A\\"",stage="curate",succeeded="false"} 1.0' in text_prometheus
+    assert sorted(path.name for path in path_file_prometheus.parent.iterdir()) == ["router.prom", "spans.jsonl"]
@@ -1,3 +1,4 @@
+import time
 import typing
 from pathlib import Path
 from unittest.mock import Mock, patch
@@ -5,9 +6,12 @@ from unittest.mock import Mock, patch
 import pytest
 import requests_mock
 from _pytest.capture import CaptureFixture
+from urllib3.exceptions import ConnectTimeoutError
 
+from osc_extraction_utils.checkpoints import CHECKPOINTS_FILE_NAME, CheckpointStore
+from osc_extraction_utils.conftest import JobServerStandIn
 from osc_extraction_utils.paths import ProjectPaths
-from osc_extraction_utils.router import Router
+from osc_extraction_utils.router import JitteredRetry, Router, create_document_shards
 from osc_extraction_utils.settings import MainSettings, S3Settings
 
 
@@ -19,6 +23,11 @@ def router(main_settings: MainSettings, s3_settings: S3Settings, project_paths:
         "ext_port": 8000,
         "infer_ip": "0.0.0.1",
         "infer_port": 8000,
+        "rb_ip": "0.0.0.2",
+        "rb_port": 8000,
+        "health_check_ttl": 30.0,
+        "ext_endpoints": [],
+        "infer_endpoints": [],
     }
 
     with patch.object(main_settings, "general", Mock(**dict_general_settings)):
@@ -42,6 +51,7 @@ def server(prerequisites_generate_text) -> requests_mock.mocker.Mocker:
     inference_port = 8000
     server_address_extraction = f"http://{extraction_ip}:{extraction_port}"
     server_address_inference = f"http://{inference_ip}:{inference_port}"
+    server_address_rule_based = "http://0.0.0.2:8000"
 
     with requests_mock.Mocker() as mocked_server, patch("osc_extraction_utils.router.json"):
         mocked_server.get(f"{server_address_extraction}/liveness", status_code=200)
@@ -51,6 +61,7 @@ def server(prerequisites_generate_text) -> requests_mock.mocker.Mocker:
         mocked_server.get(f"{server_address_inference}/train_relevance", status_code=200)
         mocked_server.get(f"{server_address_inference}/infer_relevance", status_code=200)
         mocked_server.get(f"{server_address_inference}/train_kpi", status_code=200)
+        mocked_server.get(f"{server_address_rule_based}/liveness", status_code=200)
         yield mocked_server
 
 
@@ -172,7 +183,7 @@ def test_run_router_relevance_training(
     inference_port = 8000
     server_address_node = f"http://{inference_ip}:{inference_port}/train_relevance"
 
-    with patch.object(main_settings, "train_relevance", Mock(train=train_relevance)):
+    with patch.object(main_settings.train_relevance, "train", train_relevance):
         server.get(server_address_node, status_code=status_code)
         router.run_router()
 
@@ -226,14 +237,14 @@ def test_run_router_kpi_training(
     mocked_generate_text = Mock()
     if project_name:
         if status_code_train_kpi < 0:
-            mocked_generate_text.side_effect = lambda *args: True
+            mocked_generate_text.side_effect = lambda *args, **kwargs: True
         else:
-            mocked_generate_text.side_effect = lambda *args: False
+            mocked_generate_text.side_effect = lambda *args, **kwargs: False
     else:
         mocked_generate_text.side_effect = Exception()
 
     with patch("osc_extraction_utils.router.generate_text_3434", mocked_generate_text), patch.object(
-        main_settings, "train_kpi", Mock(train=train_kpi)
+        main_settings.train_kpi, "train", train_kpi
     ):
         server.get(server_address_node_infer_relevance, status_code=status_code_infer_relevance)
         server.get(server_address_node_train_kpi, status_code=status_code_train_kpi)
@@ -260,3 +271,382 @@ def test_run_router_successful_run(
         router.run_router()
 
     assert router.return_value is True
+
+
+@pytest.fixture
+def router_job_server(
+    main_settings: MainSettings, s3_settings: S3Settings, project_paths: ProjectPaths, job_server: JobServerStandIn
+):
+    def router_job_server(**dict_general_settings) -> Router:
+        main_settings_job_server = main_settings.model_copy(deep=True)
+        main_settings_job_server.general = main_settings.general.model_copy(
+            update={
+                "ext_ip": job_server.ip,
+                "ext_port": job_server.port,
+                "infer_ip": job_server.ip,
+                "infer_port": job_server.port,
+                "rb_ip": job_server.ip,
+                "rb_port": job_server.port,
+                "request_retry_backoff": 0.0,
+                "request_retry_jitter": 0.0,
+            }
+            | dict_general_settings
+        )
+        main_settings_job_server.train_kpi.train = False
+        return Router(main_settings=main_settings_job_server, s3_settings=s3_settings, project_paths=project_paths)
+
+    return router_job_server
+
+
+def test_run_router_reuses_connection(router_job_server, job_server: JobServerStandIn):
+    router = router_job_server()
+
+    router.run_router()
+
+    assert router.return_value is True
+    # one liveness probe for all servers on the same address, the later liveness checks use the health cache,
+    # and one kept alive connection each for the liveness probes and for the steps
+    assert len(job_server.requests) == 4
+    assert len(job_server.client_ports) == 2
+
+
+@pytest.mark.parametrize("request_retries, return_value_expected", [(3, True), (1, False)])
+def test_run_router_retries_bad_gateway(
+    router_job_server, job_server: JobServerStandIn, request_retries: int, return_value_expected: bool
+):
+    job_server.number_responses_failing.update({"liveness": 2})
+    router = router_job_server(request_retries=request_retries)
+
+    router.run_router()
+
+    assert router.return_value is return_value_expected
+
+
+def test_run_router_does_not_retry_steps_on_bad_gateway(router_job_server, job_server: JobServerStandIn):
+    job_server.number_responses_failing.update({"extract": 1, "curate": 1})
+    router = router_job_server(request_retries=3)
+
+    router.run_router()
+
+    assert router.return_value is False
+    assert job_server.nodes_requested()[:2] == ["extract", "curate"]
+    assert job_server.nodes_requested().count("extract") == job_server.nodes_requested().count("curate") == 1
+
+
+def test_jittered_retry_adds_jitter_to_backoff():
+    retry = JitteredRetry(total=5, backoff_factor=1.0, jitter=0.5)
+    assert retry.get_backoff_time() == 0
+
+    for _ in range(2):
+        retry = retry.increment(method="GET", url="/extract", error=ConnectTimeoutError())
+
+    assert retry.jitter == 0.5
+    assert 2.0 <= retry.get_backoff_time() <= 2.5
+
+
+def test_run_router_default_read_timeouts_are_finite(s3_settings: S3Settings, project_paths: ProjectPaths):
+    router = Router(MainSettings(), s3_settings, project_paths)
+
+    assert router._get_timeout("extract") == (10.0, 6 * 3600.0)
+    assert router._get_timeout("train_kpi") == (10.0, 24 * 3600.0)
+    assert router._get_timeout("liveness") == (10.0, 30.0)
+
+
+def test_run_router_read_timeout_per_node(router_job_server, job_server: JobServerStandIn):
+    job_server.delays["curate"] = 0.2
+    router = router_job_server(request_read_timeouts={"curate": 0.05}, request_retries=0)
+
+    router.run_router()
+    assert router.return_value is False
+    assert job_server.nodes_requested()[:2] == ["extract", "curate"]
+    assert not [span for span in router.stage_metrics.list_spans if span.stage == "curate"][0].succeeded
+
+    router = router_job_server(request_read_timeouts={"curate": 1.0}, request_retries=0)
+    router.run_router()
+    assert router.return_value is True
+
+
+@pytest.mark.parametrize("payload_mode", ["post", "reference"])
+def test_run_router_payload_modes(router_job_server, job_server: JobServerStandIn, payload_mode: str):
+    router = router_job_server(payload_mode=payload_mode)
+    router._main_settings.train_kpi.train = True
+
+    with patch("osc_extraction_utils.router.generate_text_3434", lambda *args, **kwargs: True):
+        router.run_router()
+
+    assert router.return_value is True
+    dict_payloads = dict(job_server.payloads_received)
+    assert list(dict_payloads) == ["extract", "curate", "train_relevance", "infer_relevance", "train_kpi"]
+    assert dict_payloads["extract"]["project_name"] == router._main_settings.general.project_name
+    assert {"general", "extraction"} <= set(dict_payloads["extract"])
+    assert not {"curation", "train_kpi", "infer_kpi"} & set(dict_payloads["extract"])
+    assert {"train_relevance", "infer_relevance"} <= set(dict_payloads["infer_relevance"])
+    assert all(params == {} or "payload_ref" in params for path, params in job_server.requests if path == "/extract")
+    number_payloads_registered = len(job_server.payloads_registered)
+    assert number_payloads_registered == (5 if payload_mode == "reference" else 0)
+
+    # registered payloads are only referenced when sent again
+    router._send_payload_to_server_address_with_node(router._extraction_server_address, "extract")
+    assert len(job_server.payloads_registered) == number_payloads_registered
+    assert job_server.nodes_requested().count("payloads") == 0
+    assert job_server.payloads_received[-1] == ("extract", dict_payloads["extract"])
+
+
+def test_run_router_payload_reference_registration_fails(router_job_server, job_server: JobServerStandIn):
+    router = router_job_server(payload_mode="reference", request_retries=0)
+    router._set_extraction_server_string()
+    router._define_payload()
+
+    with patch.object(router._session, "put", return_value=Mock(status_code=500, text="Internal Server Error")):
+        router._send_payload_to_server_address_with_node(router._extraction_server_address, "extract")
+
+    assert router.return_value is False
+    assert "extract" not in job_server.nodes_requested()
+
+
+def test_run_router_resumes_from_checkpoints(
+    router_job_server, job_server: JobServerStandIn, project_paths: ProjectPaths, tmp_path: Path
+):
+    dict_paths_folders = {
+        name: tmp_path / name
+        for name in ["path_folder_source_pdf", "path_folder_source_annotation", "path_folder_source_mapping"]
+    }
+    for path_folder in dict_paths_folders.values():
+        path_folder.mkdir()
+        (path_folder / "file.txt").write_text("content")
+    checkpoint_store = CheckpointStore(tmp_path / CHECKPOINTS_FILE_NAME)
+    list_nodes_all = ["extract", "curate", "train_relevance", "infer_relevance", "train_kpi"]
+
+    def run_router() -> list[str]:
+        router = router_job_server()
+        router._main_settings.train_kpi.train = True
+        router._checkpoint_store = checkpoint_store
+        number_requests = len(job_server.nodes_requested())
+        router.run_router()
+        return job_server.nodes_requested()[number_requests:]
+
+    with (
+        patch.object(project_paths, "path_folder_source_pdf", dict_paths_folders["path_folder_source_pdf"]),
+        patch.object(project_paths, "path_folder_source_annotation", dict_paths_folders["path_folder_source_annotation"]),
+        patch.object(project_paths, "path_folder_source_mapping", dict_paths_folders["path_folder_source_mapping"]),
+        patch("osc_extraction_utils.router.generate_text_3434", lambda *args, **kwargs: True),
+    ):
+        assert run_router() == list_nodes_all
+        assert run_router() == []
+
+        # a changed annotation makes curate and all later stages dirty
+        (dict_paths_folders["path_folder_source_annotation"] / "file.txt").write_text("changed content")
+        assert run_router() == list_nodes_all[1:]
+
+        # a failed stage is run again, the stages after it are not recorded
+        job_server.number_responses_failing["infer_relevance"] = 1
+        assert run_router() == []
+        checkpoint_store.invalidate("infer_relevance")
+        assert run_router() == ["infer_relevance", "train_kpi"]
+        assert run_router() == ["infer_relevance", "train_kpi"]
+        assert run_router() == []
+
+
+def test_run_router_measures_stages(router_job_server, job_server: JobServerStandIn):
+    job_server.number_responses_failing["curate"] = 4
+    router = router_job_server()
+
+    router.run_router()
+
+    list_spans = router.stage_metrics.list_spans
+    assert [span.stage for span in list_spans] == ["extract", "curate", "train_relevance"]
+    assert [span.status_code for span in list_spans] == [200, 502, 200]
+    assert [span.succeeded for span in list_spans] == [True, False, True]
+    assert all(span.payload_bytes > 0 and span.duration >= 0 for span in list_spans)
+
+
+def test_run_router_aborts_if_server_is_down(
+    router_job_server, job_server: JobServerStandIn, capsys: CaptureFixture[str]
+):
+    router = router_job_server(rb_port=1, rb_health_check=True)
+
+    router.run_router()
+
+    assert router.return_value is False
+    assert job_server.nodes_requested() == []
+    assert "Aborting, since these servers are not responding: Rule-based server http://127.0.0.1:1." in (
+        capsys.readouterr().out
+    )
+
+    router = router_job_server(rb_port=1)
+    router.run_router()
+    assert router.return_value is True
+
+
+def test_run_router_aborts_at_once_if_connection_is_refused(router_job_server, job_server: JobServerStandIn):
+    router = router_job_server(ext_port=1, request_retry_backoff=1.0, request_retry_jitter=1.0)
+
+    time_start = time.perf_counter()
+    router.run_router()
+
+    assert time.perf_counter() - time_start < 1.0
+    assert router.return_value is False
+    assert job_server.nodes_requested() == []
+
+
+def test_run_router_refreshes_health_cache_during_run(router_job_server):
+    router = router_job_server()
+    list_is_refreshing = []
+    run_stage = router._run_stage
+
+    def run_stage_recorded(stage, run):
+        list_is_refreshing.append(router.health_cache.is_refreshing)
+        run_stage(stage, run)
+
+    with patch.object(router, "_run_stage", run_stage_recorded):
+        router.run_router()
+
+    assert list_is_refreshing == [True, True, True]
+    assert not router.health_cache.is_refreshing
+
+    # a health cache refreshed already, e.g. by a RouterScheduler, keeps refreshing after the run
+    with router.health_cache:
+        router.run_router()
+        assert router.health_cache.is_refreshing
+
+
+def test_run_router_dispatches_to_endpoint_pool(
+    router_job_server, job_server: JobServerStandIn, create_job_server, capsys: CaptureFixture[str]
+):
+    job_server_second = create_job_server()
+    list_infer_endpoints = [
+        f"{job_server.ip}:{job_server.port}",
+        f"{job_server_second.ip}:{job_server_second.port}",
+        "127.0.0.1:1",
+    ]
+    router = router_job_server(infer_endpoints=list_infer_endpoints, endpoint_dispatch="round_robin")
+    router._main_settings.train_kpi.train = True
+
+    with patch("osc_extraction_utils.router.generate_text_3434", lambda *args, **kwargs: True):
+        router.run_router()
+
+    assert router.return_value is True
+    assert "Ejecting endpoint http://127.0.0.1:1, since it is not responding." in capsys.readouterr().out
+    assert job_server.nodes_requested() == ["extract", "curate", "train_relevance", "train_kpi"]
+    assert job_server_second.nodes_requested() == ["infer_relevance"]
+
+
+def test_run_router_ejects_endpoint_refusing_connection(router_job_server, job_server: JobServerStandIn):
+    server_address_live = f"http://{job_server.ip}:{job_server.port}"
+    router = router_job_server(infer_endpoints=["127.0.0.1:1", server_address_live], endpoint_dispatch="round_robin")
+    router._set_inference_server_string()
+    router._define_payload()
+
+    assert not router._send_payload_to_server_address_with_node(router._inference_server_address, "infer_relevance")
+    assert router.return_value is False
+    for _ in range(2):
+        assert router._send_payload_to_server_address_with_node(router._inference_server_address, "infer_relevance")
+
+    assert job_server.nodes_requested() == ["infer_relevance", "infer_relevance"]
+
+
+def test_create_document_shards():
+    list_documents = [("a.pdf", 10), ("b.pdf", 10), ("c.pdf", 50), ("d.pdf", 10), ("e.pdf", 10)]
+
+    assert create_document_shards(list_documents, max_documents=2) == [
+        ["a.pdf", "b.pdf"],
+        ["c.pdf", "d.pdf"],
+        ["e.pdf"],
+    ]
+    assert create_document_shards(list_documents, max_bytes=30) == [["a.pdf", "b.pdf"], ["c.pdf"], ["d.pdf", "e.pdf"]]
+    assert create_document_shards(list_documents, max_documents=1, max_bytes=100) == [
+        [name] for name, _ in list_documents
+    ]
+    assert create_document_shards(list_documents) == [[name for name, _ in list_documents]]
+
+
+@pytest.mark.parametrize(
+    "number_responses_failing, return_value_expected, cmd_output_expected",
+    [(1, True, "Retrying 1 failed extraction shards."), (6, False, "Extraction failed for the shards 1, 2, 3.")],
+)
+def test_run_router_extracts_shards(
+    router_job_server,
+    job_server: JobServerStandIn,
+    project_paths: ProjectPaths,
+    tmp_path: Path,
+    number_responses_failing: int,
+    return_value_expected: bool,
+    cmd_output_expected: str,
+    capsys: CaptureFixture[str],
+):
+    for i in range(5):
+        (tmp_path / f"report_{i}.pdf").write_bytes(b"0" * 10)
+    job_server.number_responses_failing["extract"] = number_responses_failing
+    router = router_job_server(request_retries=0)
+    router._main_settings.extraction.shard_size = 2
+    router._main_settings.extraction.shard_retries = 1
+
+    with patch.object(project_paths, "path_folder_source_pdf", tmp_path):
+        router.run_router()
+
+    assert router.return_value is return_value_expected
+    assert cmd_output_expected in capsys.readouterr().out
+    list_shards = [payload["documents"] for node, payload in job_server.payloads_received if node == "extract"]
+    # the failed requests are not received, every shard is received once when it succeeds
+    list_shards_expected = [["report_0.pdf", "report_1.pdf"], ["report_2.pdf", "report_3.pdf"], ["report_4.pdf"]]
+    assert sorted(list_shards) == (list_shards_expected if return_value_expected else [])
+
+
+def test_run_router_estimates_run(
+    router_job_server,
+    job_server: JobServerStandIn,
+    project_paths: ProjectPaths,
+    tmp_path: Path,
+    capsys: CaptureFixture[str],
+):
+    path_folder_source_pdf = tmp_path / "pdfs"
+    path_folder_source_pdf.mkdir()
+    for i in range(4):
+        (path_folder_source_pdf / f"report_{i}.pdf").write_bytes(b"%PDF /Type /Page /Type /Pages")
+    path_folder_source_annotation = tmp_path / "annotations"
+    path_folder_source_annotation.mkdir()
+    (path_folder_source_annotation / "annotations.csv").write_text("kpi_id,answer\n" + "0,1\n" * 3)
+    path_file_metrics = tmp_path / "spans.jsonl"
+    checkpoint_store = CheckpointStore(tmp_path / CHECKPOINTS_FILE_NAME)
+
+    with (
+        patch.object(project_paths, "path_folder_source_pdf", path_folder_source_pdf),
+        patch.object(project_paths, "path_folder_source_annotation", path_folder_source_annotation),
+    ):
+        router = router_job_server()
+        router._checkpoint_store = checkpoint_store
+        run_estimate = router.estimate_run(path_file_metrics)
+        assert run_estimate.input_statistics.number_pdfs == 4
+        assert run_estimate.input_statistics.number_pdf_pages == 4
+        assert [stage_estimate.seconds for stage_estimate in run_estimate.list_stage_estimates] == [None] * 3
+
+        router.run_router()
+        router.stage_metrics.write_json_lines(path_file_metrics)
+        run_estimate_completed = router.estimate_run(path_file_metrics)
+        (path_folder_source_pdf / "report_4.pdf").write_bytes(b"%PDF")
+        (path_folder_source_annotation / "annotations_new.csv").write_text("kpi_id,answer\n" + "0,1\n" * 6)
+        router._main_settings.extraction.shard_size = 2
+        run_estimate = router.estimate_run(path_file_metrics)
+
+    assert job_server.nodes_requested() == ["extract", "curate", "train_relevance"]
+    assert [stage_estimate.skipped for stage_estimate in run_estimate_completed.list_stage_estimates] == [True] * 3
+    assert run_estimate_completed.seconds == 0.0
+    assert [
+        (stage_estimate.stage, stage_estimate.skipped, stage_estimate.seconds is not None)
+        for stage_estimate in run_estimate.list_stage_estimates
+    ] == [("extract", False, True), ("curate", False, True), ("train_relevance", False, True)]
+    # 3 shards of the 5 pdfs with the mean payload of the extraction of the 4 pdfs
+    assert run_estimate.list_stage_estimates[0].transfer_bytes == pytest.approx(
+        run_estimate.input_statistics.pdf_bytes + 3 * router.stage_metrics.list_spans[0].payload_bytes
+    )
+    n_epochs = router._main_settings.train_relevance.training.n_epochs
+    assert [(span.stage, span.input_units) for span in router.stage_metrics.list_spans] == [
+        ("extract", 4),
+        ("curate", 3),
+        ("train_relevance", 3 * n_epochs),
+    ]
+    # the curation and the training scale with the 9 instead of 3 annotation rows
+    for stage_estimate, span in zip(run_estimate.list_stage_estimates[1:], router.stage_metrics.list_spans[1:]):
+        assert stage_estimate.seconds == pytest.approx(3 * span.duration)
+    assert run_estimate.list_stage_estimates[2].basis.endswith(f"from {3 * n_epochs} row epochs")
+    assert "Total: " in capsys.readouterr().out
@@ -0,0 +1,240 @@
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+from osc_extraction_utils.exceptions import S3TransferError
+from osc_extraction_utils.s3_communication import (
+    SYNC_MANIFEST_FILE_NAME,
+    S3Communication,
+    S3FileType,
+    clear_shared_s3_resources,
+    get_shared_s3_resource,
+)
+
+
+def put_objects(s3_communication: S3Communication, list_keys: list[str]) -> None:
+    for key in list_keys:
+        s3_communication.s3_client.put_object(Bucket=s3_communication.bucket, Key=key, Body=f"content of {key}")
+
+
+@pytest.mark.parametrize("max_workers", [1, 8])
+def test_download_files_in_prefix_to_dir(s3_communication_fake: S3Communication, tmp_path: Path, max_workers: int):
+    list_keys = [f"project/data/file_{i}.csv" for i in range(25)] + ["project/data/sub/file_sub.csv"]
+    put_objects(s3_communication_fake, list_keys + ["project/other/file_other.csv"])
+    path_folder_destination = tmp_path / f"download_{max_workers}"
+
+    s3_communication_fake.download_files_in_prefix_to_dir(
+        "project/data/", str(path_folder_destination), max_workers=max_workers
+    )
+
+    for key in list_keys:
+        assert (path_folder_destination / Path(key).relative_to("project/data")).read_text() == f"content of {key}"
+    assert not (path_folder_destination / "file_other.csv").exists()
+    assert s3_communication_fake.s3_client.calls["GetObject"] == len(list_keys)
+
+
+def test_download_files_in_prefix_to_dir_uses_worker_threads(s3_communication_fake: S3Communication, tmp_path: Path):
+    put_objects(s3_communication_fake, [f"prefix/file_{i}" for i in range(8)])
+    download_fileobj = s3_communication_fake.s3_client.download_fileobj
+    thread_names: set[str] = set()
+
+    def download_fileobj_slow(*args, **kwargs):
+        thread_names.add(threading.current_thread().name)
+        time.sleep(0.05)
+        download_fileobj(*args, **kwargs)
+
+    s3_communication_fake.s3_client.download_fileobj = download_fileobj_slow
+    s3_communication_fake.max_workers = 4
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(tmp_path / "download_threads"))
+
+    assert len(thread_names) == 4
+
+
+def test_download_files_in_prefix_to_dir_aggregates_errors(
+    s3_communication_fake: S3Communication, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+):
+    list_keys = [f"prefix/file_{i}" for i in range(5)]
+    put_objects(s3_communication_fake, list_keys)
+    s3_communication_fake.s3_client.keys_failing = {"prefix/file_1", "prefix/file_3"}
+    path_folder_destination = tmp_path / "download_errors"
+
+    with pytest.raises(S3TransferError) as exception_info:
+        s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), max_workers=3)
+
+    assert set(exception_info.value.failed_transfers) == {"prefix/file_1", "prefix/file_3"}
+    assert sorted(path.name for path in path_folder_destination.iterdir()) == ["file_0", "file_2", "file_4"]
+    cmd_output, _ = capsys.readouterr()
+    assert "Failed to transfer prefix/file_1" in cmd_output
+    assert "(5/5)" in cmd_output
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_upload_files_in_dir_to_prefix(s3_communication_fake: S3Communication, tmp_path: Path, max_workers: int):
+    path_folder_source = tmp_path / f"upload_{max_workers}"
+    (path_folder_source / "sub").mkdir(parents=True)
+    (path_folder_source / ".hidden_folder").mkdir()
+    list_file_names = [f"file_{i}.csv" for i in range(10)]
+    for file_name in list_file_names:
+        (path_folder_source / file_name).write_text(f"content of {file_name}")
+    (path_folder_source / "sub" / "file_sub.csv").write_text("content of file_sub.csv")
+    (path_folder_source / ".hidden_file").write_text("hidden")
+    (path_folder_source / ".hidden_folder" / "file_in_hidden_folder").write_text("hidden")
+
+    s3_communication_fake.upload_files_in_dir_to_prefix(path_folder_source, "prefix", max_workers=max_workers)
+
+    s3_client = s3_communication_fake.s3_client
+    assert sorted(key for _, key in s3_client.objects) == sorted(
+        f"prefix/{file_name}" for file_name in list_file_names + ["sub/file_sub.csv"]
+    )
+    assert s3_client.objects[("bucket", "prefix/file_3.csv")] == b"content of file_3.csv"
+    assert all(
+        config.multipart_threshold == s3_communication_fake.transfer_config.multipart_threshold
+        for config in s3_client.upload_configs.values()
+    )
+
+
+def test_download_file_from_s3_replaces_file_atomically(s3_communication_fake: S3Communication, tmp_path: Path):
+    put_objects(s3_communication_fake, ["prefix/file.pdf"])
+    path_folder_destination = tmp_path / "download_atomic"
+    path_folder_destination.mkdir()
+    path_file = path_folder_destination / "file.pdf"
+    path_file.write_text("old content")
+
+    s3_communication_fake.s3_client.keys_failing = {"prefix/file.pdf"}
+    with pytest.raises(ClientError):
+        s3_communication_fake.download_file_from_s3(path_file, "prefix", "file.pdf")
+    assert path_file.read_text() == "old content"
+    assert list(path_folder_destination.iterdir()) == [path_file]
+
+    s3_communication_fake.s3_client.keys_failing = set()
+    s3_communication_fake.download_file_from_s3(path_file, "prefix", "file.pdf")
+    assert path_file.read_text() == "content of prefix/file.pdf"
+    assert list(path_folder_destination.iterdir()) == [path_file]
+
+
+def test_download_files_in_prefix_to_dir_incremental(s3_communication_fake: S3Communication, tmp_path: Path):
+    s3_client = s3_communication_fake.s3_client
+    put_objects(s3_communication_fake, [f"prefix/file_{i}" for i in range(5)])
+    path_folder_destination = tmp_path / "download_incremental"
+
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), incremental=True)
+    assert s3_client.calls["GetObject"] == 5
+    assert (path_folder_destination / SYNC_MANIFEST_FILE_NAME).exists()
+
+    # unchanged prefix: only listing
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), incremental=True)
+    assert s3_client.calls["GetObject"] == 5
+    assert s3_client.calls["ListObjectsV2"] == 2
+
+    # changed object, new object and locally deleted file are transferred again
+    s3_client.put_object(Bucket="bucket", Key="prefix/file_0", Body="changed content")
+    s3_client.put_object(Bucket="bucket", Key="prefix/file_5", Body="new content")
+    (path_folder_destination / "file_1").unlink()
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), incremental=True)
+    assert s3_client.calls["GetObject"] == 8
+    assert (path_folder_destination / "file_0").read_text() == "changed content"
+    assert (path_folder_destination / "file_5").read_text() == "new content"
+    assert (path_folder_destination / "file_1").read_text() == "content of prefix/file_1"
+
+
+def test_download_files_in_prefix_to_dir_incremental_skips_failed_in_manifest(
+    s3_communication_fake: S3Communication, tmp_path: Path
+):
+    s3_client = s3_communication_fake.s3_client
+    put_objects(s3_communication_fake, [f"prefix/file_{i}" for i in range(3)])
+    path_folder_destination = tmp_path / "download_incremental_failed"
+    s3_client.keys_failing = {"prefix/file_1"}
+
+    with pytest.raises(S3TransferError):
+        s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), incremental=True)
+
+    s3_client.keys_failing = set()
+    s3_communication_fake.download_files_in_prefix_to_dir("prefix/", str(path_folder_destination), incremental=True)
+    assert s3_client.calls["GetObject"] == 4
+    assert (path_folder_destination / "file_1").read_text() == "content of prefix/file_1"
+
+
+def test_download_files_in_prefix_to_dir_keeps_sub_directories(s3_communication_fake: S3Communication, tmp_path: Path):
+    s3_client = s3_communication_fake.s3_client
+    s3_client.max_keys = 2
+    list_keys = ["project/data/file.csv", "project/data/a/file.csv", "project/data/a/b/file.csv", "project/data/b/"]
+    put_objects(s3_communication_fake, list_keys + ["project/data_other/file.csv", "project/data/../escape.csv"])
+    path_folder_destination = tmp_path / "download_sub_directories"
+
+    s3_communication_fake.download_files_in_prefix_to_dir("project/data", str(path_folder_destination))
+
+    list_paths_files = sorted(path for path in path_folder_destination.rglob("*") if path.is_file())
+    assert list_paths_files == [
+        path_folder_destination / "a" / "b" / "file.csv",
+        path_folder_destination / "a" / "file.csv",
+        path_folder_destination / "file.csv",
+    ]
+    assert (path_folder_destination / "a" / "b" / "file.csv").read_text() == "content of project/data/a/b/file.csv"
+    assert s3_client.calls["ListObjectsV2"] == 3
+
+
+def test_upload_and_download_files_keep_same_named_files_in_sub_directories(
+    s3_communication_fake: S3Communication, tmp_path: Path
+):
+    path_folder_source = tmp_path / "upload_same_names"
+    for path_folder in [path_folder_source, path_folder_source / "a", path_folder_source / "a" / "b"]:
+        path_folder.mkdir(parents=True, exist_ok=True)
+        (path_folder / "file.csv").write_text(f"content of {path_folder.relative_to(tmp_path).as_posix()}")
+    path_folder_destination = tmp_path / "download_same_names"
+
+    s3_communication_fake.upload_files_in_dir_to_prefix(path_folder_source, "project/data", max_workers=4)
+    s3_communication_fake.download_files_in_prefix_to_dir("project/data", str(path_folder_destination))
+
+    for path_file in path_folder_source.rglob("*.csv"):
+        path_file_relative = path_file.relative_to(path_folder_source)
+        assert (path_folder_destination / path_file_relative).read_text() == path_file.read_text()
+
+
+def test_s3_communication_shares_s3_resource(fake_s3_resources):
+    settings_bucket = {
+        "s3_endpoint_url": "https://0.0.0.0",
+        "aws_access_key_id": "key",
+        "aws_secret_access_key": "secret",
+    }
+
+    s3_communication_main = S3Communication(**settings_bucket, s3_bucket="main")
+    s3_communication_interim = S3Communication(**settings_bucket, s3_bucket="interim")
+    s3_communication_other_key = S3Communication(**(settings_bucket | {"aws_access_key_id": "other"}), s3_bucket="main")
+    s3_communication_more_workers = S3Communication(**settings_bucket, s3_bucket="main", max_workers=16)
+
+    assert s3_communication_main.s3_client is s3_communication_interim.s3_client
+    assert s3_communication_main.bucket == "main" and s3_communication_interim.bucket == "interim"
+    assert s3_communication_main.s3_client is not s3_communication_other_key.s3_client
+    assert s3_communication_main.s3_client is not s3_communication_more_workers.s3_client
+
+
+def test_get_shared_s3_resource_configures_connection_pool():
+    clear_shared_s3_resources()
+    with patch("osc_extraction_utils.s3_communication.boto3.resource") as mocked_resource:
+        get_shared_s3_resource("https://0.0.0.0", "key", "secret", max_pool_connections=64, tcp_keepalive=True)
+        get_shared_s3_resource("https://0.0.0.0", "key", "secret", max_pool_connections=64, tcp_keepalive=True)
+    clear_shared_s3_resources()
+
+    mocked_resource.assert_called_once()
+    config = mocked_resource.call_args.kwargs["config"]
+    assert config.max_pool_connections == 64
+    assert config.tcp_keepalive is True
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd", None])
+def test_download_df_from_s3_decompresses(s3_communication_fake: S3Communication, compression: str | None):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    df = pd.DataFrame({"page": [0, 1], "text": ["first", "second"]})
+    s3_communication_fake.upload_df_to_s3(
+        df, "prefix", "text_3434.csv", filetype=S3FileType.CSV, index=False, compression=compression
+    )
+
+    df_downloaded = s3_communication_fake.download_df_from_s3("prefix", "text_3434.csv", filetype=S3FileType.CSV)
+
+    assert df_downloaded.equals(df)
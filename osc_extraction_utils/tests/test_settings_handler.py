@@ -1,9 +1,18 @@
+import os
+import subprocess
+import sys
 from unittest.mock import patch
 
 import pytest
+import yaml
 
 from osc_extraction_utils.conftest import project_tests_root
-from osc_extraction_utils.settings_handler import SettingsHandler
+from osc_extraction_utils.settings import MainSettings
+from osc_extraction_utils.settings_handler import (
+    SettingsHandler,
+    clear_yaml_cache,
+    load_yaml_file,
+)
 
 
 @pytest.fixture()
@@ -38,3 +47,60 @@ def test_read_setting_file(settings_handler, path_folder_root_testing):
     path_settings_main = path_root / "data" / "TEST" / "settings.yaml"
 
     settings_handler._read_setting_file(path_settings_main)
+
+
+def test_load_yaml_file_parses_unchanged_file_once(tmp_path):
+    path_file = tmp_path / "settings.yaml"
+    path_file.write_text("general:\n  project_name: TEST_CACHE\n")
+    clear_yaml_cache()
+
+    with patch("osc_extraction_utils.settings_handler.yaml.safe_load", wraps=yaml.safe_load) as mocked_safe_load:
+        dict_loaded = load_yaml_file(path_file)
+        dict_loaded["general"]["project_name"] = "CHANGED"
+        dict_loaded_again = load_yaml_file(path_file)
+
+    mocked_safe_load.assert_called_once()
+    assert dict_loaded_again == {"general": {"project_name": "TEST_CACHE"}}
+
+
+def test_load_yaml_file_parses_changed_file_again(tmp_path):
+    path_file = tmp_path / "settings.yaml"
+    path_file.write_text("general:\n  project_name: TEST_CACHE\n")
+    clear_yaml_cache()
+    load_yaml_file(path_file)
+
+    path_file.write_text("general:\n  project_name: TEST_CHANGED\n")
+    stat_file = path_file.stat()
+    os.utime(path_file, ns=(stat_file.st_atime_ns, stat_file.st_mtime_ns + 1_000_000_000))
+
+    assert load_yaml_file(path_file) == {"general": {"project_name": "TEST_CHANGED"}}
+
+
+def test_read_setting_file_returns_independent_settings(settings_handler, path_folder_root_testing):
+    path_settings_main = path_folder_root_testing / "data" / "TEST" / "settings.yaml"
+
+    settings_main = settings_handler._read_setting_file(path_settings_main)
+    settings_main.general.project_name = "CHANGED"
+
+    assert isinstance(settings_main, MainSettings)
+    assert settings_handler._read_setting_file(path_settings_main).general.project_name != "CHANGED"
+
+
+def test_import_constructs_no_settings():
+    code = (
+        "import pydantic_settings\n"
+        "list_constructed = []\n"
+        "init = pydantic_settings.BaseSettings.__init__\n"
+        "def init_counted(self, *args, **kwargs):\n"
+        "    list_constructed.append(type(self).__name__)\n"
+        "    init(self, *args, **kwargs)\n"
+        "pydantic_settings.BaseSettings.__init__ = init_counted\n"
+        "import osc_extraction_utils.settings, osc_extraction_utils.settings_handler\n"
+        "print(list_constructed)\n"
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, cwd=project_tests_root().parent, text=True
+    )
+
+    assert result.stdout.strip() == "[]"
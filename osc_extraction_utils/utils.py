@@ -6,6 +6,7 @@ from typing import Any
 
 import pandas as pd
 
+from osc_extraction_utils.checkpoints import create_folder_manifest
 from osc_extraction_utils.paths import ProjectPaths
 from osc_extraction_utils.s3_communication import S3Communication
 from osc_extraction_utils.settings import MainSettings, S3Settings
@@ -35,13 +36,13 @@ def save_train_info(
         # s3_settings = project_settings["s3_settings"]
         project_prefix = s3_settings.prefix + "/" + project_name + "/data"
         s3c_main.download_files_in_prefix_to_dir(
-            project_prefix + "/input/kpi_mapping", str(project_paths.path_folder_source_mapping)
+            project_prefix + "/input/kpi_mapping", str(project_paths.path_folder_source_mapping), incremental=True
         )
         s3c_main.download_files_in_prefix_to_dir(
-            project_prefix + "/input/annotations", str(project_paths.path_folder_source_annotation)
+            project_prefix + "/input/annotations", str(project_paths.path_folder_source_annotation), incremental=True
         )
         s3c_main.download_files_in_prefix_to_dir(
-            project_prefix + "/input/pdfs/training", str(project_paths.path_folder_source_pdf)
+            project_prefix + "/input/pdfs/training", str(project_paths.path_folder_source_pdf), incremental=True
         )
 
     dir_train: dict[str, Any] = {}
@@ -49,7 +50,9 @@ def save_train_info(
     # dir_train.update({'train_settings': project_settings})
     dir_train.update({"train_settings": main_settings})
     # dir_train.update({'pdfs_used': os.listdir(source_pdf)})
-    dir_train.update({"pdfs_used": os.listdir(project_paths.path_folder_source_pdf)})
+    dir_train.update(
+        {"pdfs_used": [name for name in os.listdir(project_paths.path_folder_source_pdf) if not name.startswith(".")]}
+    )
     first = True
     for filename in os.listdir(str(project_paths.path_folder_source_annotation)):
         if filename[-5:] == ".xlsx":
@@ -85,20 +88,24 @@ def save_train_info(
 
 
 def copy_file_without_overwrite(src_path, dest_path):
-    for filename in os.listdir(src_path):
+    # files in sub-directories are copied into the same sub-directories, hidden files like the manifest of an
+    # incremental s3 download are skipped
+    for filename, _, _ in create_folder_manifest(src_path):
         # construct the src path and file name
         src_path_file_name = os.path.join(src_path, filename)
         # construct the dest path and file name
         dest_path_file_name = os.path.join(dest_path, filename)
         # test if the dest file exists, if false, do the copy, or else abort the copy operation.
         if not os.path.exists(dest_path_file_name):
+            os.makedirs(os.path.dirname(dest_path_file_name), exist_ok=True)
             shutil.copyfile(src_path_file_name, dest_path_file_name)
     return True
 
 
 def link_files(source_dir, destination_dir):
-    files = os.listdir(source_dir)
+    files = [filename for filename, _, _ in create_folder_manifest(source_dir)]
     for file in files:
+        os.makedirs(os.path.dirname(f"{destination_dir}/{file}"), exist_ok=True)
         os.link(f"{source_dir}/{file}", f"{destination_dir}/{file}")
 
 